@@ -26,12 +26,23 @@ __uri__ = 'http://mutopiaproject.org/'
 __license__ = 'MIT'
 __copyright__ = 'Copyright 2018 The Mutopia Project'
 
-from .assets import collect_assets
+from .archive import ArchiveManifest
+from .assets import collect_assets, existing_assets
+from .bundle import write_bundle, read_index
+from .checkpoint import Checkpoint, fingerprint, source_files
+from .compress import compression_policy
+from .download import fetch
+from .commands.bench import bench_compilers
 from .commands.build import build
 from .commands.check import check
+from .commands.compilers import prefetch
 from .commands.init import init
+from .commands.query import query
+from .commands.rdf import rdf
 from .commands.tag import tag
 from .commands.clean import clean
+from .commands.stats import stats
+from .commands.unbundle import unbundle
 from .config import CONFIG_DICT, CONFIG_DIR, getDBPath
 from .config import test_config, saveConfig
 from .core import MUTOPIA_BASE, FTP_BASE, URL_BASE
@@ -41,7 +52,14 @@ from .header import Loader, LYLoader, VersionLoader
 from .header import RawLoader, Header, REQUIRED_FIELDS
 from .header import find_header
 from .lily import LyLocator, LyVersion
+from .lyindex import ListingCache
+from .lyregistry import CompilerRegistry
+from .preview import image_size
+from .lily import LyProgress, LyRun, LyRunner, timing_report
+from .pdfopt import optimize_pdfs
 from .validate import Validator, DBValidator, in_repository
 from .tagedit import tag_header, tag_file
-from .rdfu import NS, MuRDF
+from .rdfu import MuRDF, read_rdf, export_rdf
+from .catalog import Catalog
+from .telemetry import Telemetry
 from .utils import resolve_input,resolve_lysfile
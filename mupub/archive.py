@@ -0,0 +1,454 @@
+"""Incremental archive maintenance.
+
+Rebuilding an unchanged zip or gzip bumps its modification time and
+makes mirrors transfer it again. A manifest of the content hash of
+every archive member is kept per piece so that collection can,
+
+ - keep an archive whose inputs are unchanged as it is,
+ - rebuild a changed zip by copying the already compressed data of
+   its unchanged members and compressing only new or changed ones,
+ - remove an archive, such as ``-mids.zip``, once newly built scores
+   no longer produce its inputs.
+
+A rebuilt archive is only moved into place when its content differs
+from the existing one.
+
+The SHA-256 and size of each archive are computed while it is
+written and kept in the same manifest. Together with the other
+outputs of a piece they are published in a digest file,
+``<base>-digests.json``, that mirrors can compare against their own
+copy to skip unchanged transfers.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import zipfile
+import mupub
+
+_BLOCKSIZE = 1 << 16
+
+
+def manifest_path(basefnm):
+    """Return the name of the archive manifest for a piece.
+
+    :param str basefnm: base filename used for asset naming.
+    :rtype: str
+
+    """
+    return basefnm + '-archives.json'
+
+
+def digest_path(basefnm):
+    """Return the name of the published digest file for a piece.
+
+    :param str basefnm: base filename used for asset naming.
+    :rtype: str
+
+    """
+    return basefnm + '-digests.json'
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file as a hexadecimal string."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(_BLOCKSIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ArchiveManifest():
+    """Member hashes of the archives of a piece.
+
+    Each entry maps an archive name to the compression policy it was
+    written with, a table of member name to content hash and the
+    SHA-256 and size of the archive itself. Updates
+    are thread safe so that archives may be built concurrently.
+
+    """
+    def __init__(self, basefnm):
+        self.path = manifest_path(basefnm)
+        self._archives = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as mfile:
+                    self._archives = json.load(mfile)
+            except ValueError:
+                logger = logging.getLogger(__name__)
+                logger.warning('Ignoring unreadable manifest %s' % self.path)
+
+
+    def get(self, archive):
+        """Return the recorded entry for an archive, None if absent."""
+        with self._lock:
+            return self._archives.get(archive)
+
+
+    def set(self, archive, policy, members, digest=None):
+        """Record the policy and member hashes of an archive.
+
+        :param str archive: archive name.
+        :param str policy: compression policy written with.
+        :param dict members: member name to content hash.
+        :param tuple digest: (sha256, size) of the archive.
+
+        """
+        entry = {'policy': policy, 'members': members}
+        if digest:
+            entry['sha256'], entry['size'] = digest
+        with self._lock:
+            self._archives[archive] = entry
+
+
+    def digest(self, archive):
+        """Return the recorded (sha256, size) of an archive.
+
+        None is returned if the archive is not recorded, has no
+        digest, or its size no longer matches the file.
+
+        """
+        with self._lock:
+            entry = self._archives.get(archive)
+        if not entry or 'sha256' not in entry:
+            return None
+        if not os.path.exists(archive) or os.path.getsize(archive) != entry['size']:
+            return None
+        return entry['sha256'], entry['size']
+
+
+    def remove(self, archive):
+        """Forget an archive, returns True if it was recorded."""
+        with self._lock:
+            return self._archives.pop(archive, None) is not None
+
+
+    def save(self):
+        """Write the manifest."""
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as mfile:
+                json.dump(self._archives, mfile, indent=2, sort_keys=True)
+
+
+# Private zipfile names used by _copy_raw.
+_ZIPFILE_NAMES = ('structFileHeader', 'sizeFileHeader',
+                  '_FH_FILENAME_LENGTH', '_FH_EXTRA_FIELD_LENGTH')
+_ZIP_ATTRIBUTES = ('fp', 'start_dir', 'filelist', 'NameToInfo',
+                   '_didModify', '_seekable')
+
+
+def _can_copy_raw(dest):
+    """True if this zipfile has the internals _copy_raw relies on."""
+    return (all(hasattr(zipfile, n) for n in _ZIPFILE_NAMES)
+            and all(hasattr(dest, n) for n in _ZIP_ATTRIBUTES))
+
+
+def _copy_raw(src, dest, info):
+    """Copy a member's compressed data from one zip to another.
+
+    :class:`zipfile.ZipFile` has no public interface for this, the
+    local header is skipped and the data appended to the destination
+    along with a fresh header. Check :py:func:`_can_copy_raw` first,
+    members are otherwise compressed again. The copies are read back
+    by :py:func:`update_zip` before the archive is used.
+
+    """
+    src.fp.seek(info.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader,
+                            src.fp.read(zipfile.sizeFileHeader))
+    name_len = fheader[zipfile._FH_FILENAME_LENGTH]
+    extra_len = fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+    src.fp.seek(name_len + extra_len, os.SEEK_CUR)
+    raw = src.fp.read(info.compress_size)
+
+    new_info = copy.copy(info)
+    # sizes and CRC go in the local header, no data descriptor
+    new_info.flag_bits &= ~0x08
+    if dest._seekable:
+        dest.fp.seek(dest.start_dir)
+    new_info.header_offset = dest.fp.tell()
+    dest.fp.write(new_info.FileHeader())
+    dest.fp.write(raw)
+    dest.start_dir = dest.fp.tell()
+    dest.filelist.append(new_info)
+    dest.NameToInfo[new_info.filename] = new_info
+    dest._didModify = True
+
+
+def _replace_archive(tmp_name, name, digest, manifest):
+    """Move a new archive into place unless its content is unchanged.
+
+    The recorded digest of the existing archive decides, only an
+    archive without one is compared byte by byte.
+
+    """
+    recorded = manifest.digest(name)
+    if recorded is None:
+        return mupub.utils.replace_if_changed(tmp_name, name)
+    if recorded == digest:
+        os.unlink(tmp_name)
+        return False
+    os.replace(tmp_name, name)
+    return True
+
+
+def replace_output(new_path, path, published):
+    """Move a renamed output into place unless its content is unchanged.
+
+    The new file is hashed once, its digest decides against the one
+    last published for path and is returned so that it need not be
+    computed again for the digest file. Without a published digest
+    the files are compared byte by byte.
+
+    :param str new_path: the new content, removed or renamed.
+    :param str path: the output to replace.
+    :param dict published: the table of :py:func:`read_digests`.
+    :returns: (True if path was replaced, (sha256, size) of path)
+    :rtype: tuple
+
+    """
+    digest = (file_hash(new_path), os.path.getsize(new_path))
+    entry = published.get(path)
+    if (not entry or not os.path.exists(path)
+            or os.path.getsize(path) != entry.get('size')):
+        return mupub.utils.replace_if_changed(new_path, path), digest
+    if entry.get('sha256') == digest[0]:
+        os.unlink(new_path)
+        return False, digest
+    os.replace(new_path, path)
+    return True, digest
+
+
+def _write_zip(tmp_name, zip_name, files, members, previous, asset_type,
+               raw):
+    """Write an archive of files to tmp_name.
+
+    Unchanged members of the previous archive are copied without
+    compressing them again if raw is True and zipfile allows it.
+
+    :returns: ((sha256, size) of the archive, names of copied members)
+    :rtype: tuple
+
+    """
+    method, _ = mupub.compress.compression_policy(asset_type)
+    copied = []
+    old_zip = None
+    try:
+        if raw:
+            old_zip = zipfile.ZipFile(zip_name, 'r')
+        # Written to a seekable file, zipfile puts sizes and CRC in
+        # each local header rather than a data descriptor, which some
+        # streaming readers reject for stored members.
+        with open(tmp_name, 'wb') as tmpfile:
+            writer = mupub.compress.ZipHashingWriter(tmpfile)
+            with mupub.compress.open_zip(writer, asset_type) as outzip:
+                raw = raw and _can_copy_raw(outzip)
+                for member in sorted(files):
+                    info = None
+                    if raw and previous['members'].get(member) == members[member]:
+                        try:
+                            info = old_zip.getinfo(member)
+                        except KeyError:
+                            info = None
+                    if info is not None and info.compress_type == method:
+                        _copy_raw(old_zip, outzip, info)
+                        copied.append(member)
+                    else:
+                        outzip.write(member)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    finally:
+        if old_zip:
+            old_zip.close()
+
+    digest = writer.digest()
+    if digest is None:
+        digest = (file_hash(tmp_name), os.path.getsize(tmp_name))
+    return digest, copied
+
+
+def _copies_intact(path, names):
+    """True if the copied members of an archive read back.
+
+    zipfile checks the CRC of each member as it is read, a copy made
+    wrong by a change of zipfile internals fails.
+
+    """
+    try:
+        with zipfile.ZipFile(path, 'r') as check:
+            for name in names:
+                with check.open(name) as member:
+                    while member.read(_BLOCKSIZE):
+                        pass
+    except Exception:
+        return False
+    return True
+
+
+def update_zip(zip_name, files, asset_type, manifest):
+    """Create or update a zip archive of files.
+
+    Members copied from the previous archive are read back, checking
+    their CRC, before the archive is moved into place. Should one
+    fail the archive is written again compressing every member.
+
+    :param str zip_name: the archive to write.
+    :param files: the files to archive.
+    :param str asset_type: asset type for the compression policy.
+    :param manifest: an :py:class:`ArchiveManifest`.
+    :returns: True if the archive changed, False if kept.
+    :rtype: boolean
+
+    """
+    logger = logging.getLogger(__name__)
+    method, level = mupub.compress.compression_policy(asset_type)
+    policy = '{0}:{1}'.format(method, level)
+    members = dict((f, file_hash(f)) for f in files)
+
+    previous = manifest.get(zip_name)
+    if previous and os.path.exists(zip_name):
+        if previous['policy'] == policy and previous['members'] == members:
+            logger.info('%s is up to date' % zip_name)
+            return False
+    else:
+        previous = None
+
+    tmp_name = zip_name + '.tmp'
+    raw = previous is not None and previous['policy'] == policy
+    digest, copied = _write_zip(tmp_name, zip_name, files, members,
+                                previous, asset_type, raw)
+    if copied and not _copies_intact(tmp_name, copied):
+        logger.warning('%s: copied members failed to read back, '
+                       'compressing all members' % zip_name)
+        digest, copied = _write_zip(tmp_name, zip_name, files, members,
+                                    previous, asset_type, False)
+
+    changed = _replace_archive(tmp_name, zip_name, digest, manifest)
+    manifest.set(zip_name, policy, members, digest)
+    if changed:
+        logger.info('%s written, %d of %d members reused'
+                    % (zip_name, len(copied), len(members)))
+    else:
+        logger.info('%s is unchanged' % zip_name)
+    return changed
+
+
+def update_gzip(gz_name, in_path, asset_type, manifest):
+    """Create or update a gzip of a single file.
+
+    :param str gz_name: the gzip file to write.
+    :param str in_path: the file to compress.
+    :param str asset_type: asset type for the compression policy.
+    :param manifest: an :py:class:`ArchiveManifest`.
+    :returns: True if the gzip changed, False if kept.
+    :rtype: boolean
+
+    """
+    level = mupub.compress.gzip_level(asset_type)
+    policy = 'gzip:{0}'.format(level)
+    members = {os.path.basename(in_path): file_hash(in_path)}
+    previous = manifest.get(gz_name)
+    if previous and os.path.exists(gz_name):
+        if previous['policy'] == policy and previous['members'] == members:
+            logger = logging.getLogger(__name__)
+            logger.info('%s is up to date' % gz_name)
+            return False
+
+    tmp_name = gz_name + '.tmp'
+    try:
+        digest = mupub.compress.gzip_file(in_path, tmp_name, level)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    changed = _replace_archive(tmp_name, gz_name, digest, manifest)
+    manifest.set(gz_name, policy, members, digest)
+    return changed
+
+
+def recorded_archive(name, manifest):
+    """Return name if it is a recorded archive that still exists.
+
+    Used when the inputs of an archive are no longer present, as in a
+    repeated collection, so that the existing archive is reported.
+
+    """
+    if manifest.get(name) and os.path.exists(name):
+        return name
+    return None
+
+
+def discard_archive(name, manifest):
+    """Remove an archive whose inputs are no longer built.
+
+    :param str name: the archive.
+    :param manifest: an :py:class:`ArchiveManifest`.
+    :returns: True if the archive was recorded.
+    :rtype: boolean
+
+    """
+    if not manifest.remove(name):
+        return False
+    if os.path.exists(name):
+        logger = logging.getLogger(__name__)
+        logger.info('%s removed, it has no inputs' % name)
+        os.unlink(name)
+    return True
+
+
+def read_digests(basefnm):
+    """Read the published digest table of a piece.
+
+    :param str basefnm: base filename used for asset naming.
+    :returns: file name to sha256 and size, empty if there is no
+              readable digest file.
+    :rtype: dict
+
+    """
+    try:
+        with open(digest_path(basefnm), 'r', encoding='utf-8') as dfile:
+            return json.load(dfile)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_digests(basefnm, names, manifest, known=None):
+    """Write the digest file for the outputs of a piece.
+
+    Archives use the digest recorded when they were written and
+    renamed outputs the one found by :py:func:`replace_output`.
+    Other outputs are hashed here.
+
+    :param str basefnm: base filename used for asset naming.
+    :param names: output file names, missing files are ignored.
+    :param manifest: an :py:class:`ArchiveManifest`.
+    :param dict known: output name to (sha256, size) already found.
+    :returns: the digest table, file name to sha256 and size.
+    :rtype: dict
+
+    The digest file itself is only rewritten when it changes.
+
+    """
+    digests = {}
+    for name in names:
+        if not os.path.isfile(name):
+            continue
+        digest = manifest.digest(name)
+        if digest is None and known:
+            digest = known.get(name)
+        if digest is None:
+            digest = (file_hash(name), os.path.getsize(name))
+        digests[name] = {'sha256': digest[0], 'size': digest[1]}
+    data = json.dumps(digests, indent=2, sort_keys=True)
+    mupub.utils.write_if_changed(digest_path(basefnm), data.encode('utf-8'))
+    return digests
@@ -16,56 +16,118 @@ necessary) large multi-file compositions.
 __docformat__ = 'reStructuredText'
 
 
+import concurrent.futures
 import glob
-import gzip
+import logging
 import os
-from PIL import Image
-import shutil
-import zipfile
+import xml.etree.ElementTree as ET
 import mupub
 
-def _collect_lyfile(basefnm):
+def _collect_lyfile(basefnm, manifest):
     dir_name = basefnm + '-lys'
     if os.path.exists(dir_name):
         zip_name = dir_name+'.zip'
-        with zipfile.ZipFile(zip_name, 'w') as lyzip:
-            zip_list = mupub.utils.find_files(dir_name)
-            for zip_entry in zip_list:
-                lyzip.write(zip_entry)
+        mupub.archive.update_zip(zip_name,
+                                 mupub.utils.find_files(dir_name),
+                                 'ly',
+                                 manifest)
         return zip_name
     else:
         return basefnm + '.ly'
 
 
-def _zip_maybe(basefnm, tail, ziptail):
+def _zip_maybe(basefnm, tail, ziptail, asset_type, manifest, rebuilt,
+               published, renamed):
     files = glob.glob('*'+tail)
     if len(files) < 1:
+        archives = [basefnm+tail+'.gz', basefnm+ziptail]
+        if rebuilt:
+            # the scores no longer produce this set
+            for name in archives:
+                mupub.archive.discard_archive(name, manifest)
+            return 'empty'
+        # Inputs are removed once archived, a repeated collection
+        # reports the archive made last time.
+        for name in archives:
+            if mupub.archive.recorded_archive(name, manifest):
+                return name
         return 'empty'
     if len(files) == 1:
+        # the set was zipped while it had more files
+        mupub.archive.discard_archive(basefnm+ziptail, manifest)
         single_file = basefnm+tail
         if files[0] != single_file:
-            os.rename(files[0], single_file)
+            _, renamed[single_file] = mupub.archive.replace_output(
+                files[0], single_file, published)
         # single ps files get compressed
         if tail.endswith('.ps'):
             gzipped_name = single_file+'.gz'
-            with open(single_file, 'rb') as ps_in:
-                with gzip.open(gzipped_name, 'wb') as gz_out:
-                    shutil.copyfileobj(ps_in, gz_out)
+            mupub.archive.update_gzip(gzipped_name, single_file,
+                                      asset_type, manifest)
             os.unlink(single_file)
             return gzipped_name
         else:
             return single_file
     else:
+        mupub.archive.discard_archive(basefnm+tail+'.gz', manifest)
         zip_name = basefnm+ziptail
-        with zipfile.ZipFile(zip_name, 'w') as outzip:
-            for file_to_zip in files:
-                outzip.write(file_to_zip)
+        mupub.archive.update_zip(zip_name, files, asset_type, manifest)
         for zipped_file in files:
             os.unlink(zipped_file)
         return zip_name
 
 
-def collect_assets(basefnm):
+# Multi-file asset sets: (asset name, file tail, zip tail, asset type)
+_ASSET_SETS = [
+    ('midFile', '.mid', '-mids.zip', 'midi'),
+    ('psFileA4', '-a4.ps', '-a4-pss.zip', 'ps'),
+    ('psFileLet', '-let.ps', '-let-pss.zip', 'ps'),
+    ('pdfFileA4', '-a4.pdf', '-a4-pdfs.zip', 'pdf'),
+    ('pdfFileLet', '-let.pdf', '-let-pdfs.zip', 'pdf'),
+]
+
+
+# Asset names that refer to output files
+_OUTPUTS = ['lyFile'] + [a[0] for a in _ASSET_SETS] + ['pngFile']
+
+
+def _collect_preview(basefnm, svgfiles, pngfiles, preview_widths,
+                     published, renamed):
+    logger = logging.getLogger(__name__)
+    preview = {}
+    if len(svgfiles) > 0:
+        preview_name = basefnm+'-preview.svg'
+        built_name = svgfiles[0]
+    else:
+        preview_name = basefnm+'-preview.png'
+        built_name = pngfiles[0]
+        # crop before comparing with the published preview
+        try:
+            cropped = mupub.preview.crop_preview(built_name,
+                                                 basefnm+'-preview-{}w.png',
+                                                 preview_widths)
+        except OSError as err:
+            logger.warning('Preview %s not cropped: %s' % (built_name, err))
+            cropped = None
+        if cropped and cropped[1]:
+            preview['pngSrcset'] = ', '.join('{0} {1}w'.format(name, width)
+                                             for name, width in cropped[1])
+    if built_name != preview_name:
+        _, renamed[preview_name] = mupub.archive.replace_output(
+            built_name, preview_name, published)
+    try:
+        width, height = mupub.preview.image_size(preview_name)
+    except (ValueError, ET.ParseError) as err:
+        logger.warning(err)
+        width, height = 0, 0
+    preview.update({'pngWidth': str(width),
+                    'pngHeight': str(height),
+                    'pngFile': preview_name})
+    return preview
+
+
+def collect_assets(basefnm, max_workers=None, preview_widths=None,
+                   changed=None, rebuilt=False, preview_rebuilt=True):
     """After a build, collect all assets into their publishable
     components.
 
@@ -76,42 +138,144 @@ def collect_assets(basefnm):
      - multiple midi files are zipped.
      - all PostScript files are zipped.
      - multiple PDF files are zipped.
-     - preview image details are determined.
+     - a PNG preview is cropped to its ink and scaled variants are
+       made for a ``srcset`` (given as the ``pngSrcset`` asset).
+     - preview image details are determined, those of the cropped
+       full size preview are reported.
+
+    Compression follows the per-asset-type policy of
+    :py:mod:`mupub.compress`. Archives whose inputs are unchanged are
+    kept as they are, see :py:mod:`mupub.archive`. The SHA-256 and
+    size of every output are written to ``<base>-digests.json``.
+    Renamed and rebuilt outputs only replace a published file when
+    their content differs, so unchanged outputs keep their
+    modification time. Renamed outputs are hashed once, the digest
+    deciding whether they replace the published file.
+
+    Each asset set works on its own files so the compression stages
+    run concurrently on a thread pool (zlib releases the GIL while
+    compressing) while the preview is processed in this thread.
+
+    The preview image is located first; if it is missing
+    :py:class:`~mupub.exceptions.IncompleteBuild` is raised before
+    any of the built files are modified.
 
     :param str basefnm: base filename used for asset naming.
+    :param int max_workers: size of the compression thread pool,
+                            defaults to one thread per asset set.
+    :param preview_widths: widths of the scaled PNG preview variants,
+                           defaults to
+                           :py:data:`~mupub.preview.PREVIEW_WIDTHS`.
+    :param list changed: if given, the names of outputs whose digest
+                         differs from the one last published are
+                         appended.
+    :param bool rebuilt: the scores were just built by LilyPond, an
+                         archive without inputs is then removed
+                         rather than reported.
+    :param bool preview_rebuilt: the preview was just built by
+                                 |LilyPond|, when False and no preview
+                                 was built the one published last
+                                 time is collected again.
     :returns: asset dictionary, useful for RDF creation.
     :rtype: dictionary containing name:value pairs of assets.
 
     """
-    assets = {}
-    assets['lyFile'] = _collect_lyfile(basefnm)
-    assets['midFile'] = _zip_maybe(basefnm, '.mid', '-mids.zip')
-    assets['psFileA4'] = _zip_maybe(basefnm, '-a4.ps', '-a4-pss.zip')
-    assets['psFileLet'] = _zip_maybe(basefnm, '-let.ps', '-let-pss.zip')
-    assets['pdfFileA4'] = _zip_maybe(basefnm, '-a4.pdf', '-a4-pdfs.zip')
-    assets['pdfFileLet'] = _zip_maybe(basefnm, '-let.pdf', '-let-pdfs.zip')
-
-    # process the preview image
-    preview_name = ''
+    # Find the preview image before anything is zipped or renamed so
+    # that a missing preview leaves the built scores untouched.
     svgfiles = glob.glob('*.preview.svg')
-    if len(svgfiles) > 0:
-        preview_name = basefnm+'-preview.svg'
-        os.rename(svgfiles[0], preview_name)
-        assets['pngWidth'] = '0'
-        assets['pngHeight'] = '0'
-
-    if preview_name == '':
-        pngfiles = glob.glob('*.preview.png')
-        if len(pngfiles) > 0:
-            preview_name = basefnm+'-preview.png'
-            os.rename(pngfiles[0], preview_name)
-            with Image.open(preview_name, 'rb') as png_file:
-                assets['pngWidth'] = str(png_file.width)
-                assets['pngHeight'] = str(png_file.height)
-
-    if preview_name == '':
+    pngfiles = glob.glob('*.preview.png')
+    if len(svgfiles) < 1 and len(pngfiles) < 1 and not preview_rebuilt:
+        svgfiles = [n for n in [basefnm+'-preview.svg'] if os.path.exists(n)]
+        pngfiles = [n for n in [basefnm+'-preview.png'] if os.path.exists(n)]
+    if len(svgfiles) < 1 and len(pngfiles) < 1:
         raise mupub.IncompleteBuild('No preview image found.')
 
-    assets['pngFile'] = preview_name
+    manifest = mupub.archive.ArchiveManifest(basefnm)
+    published = mupub.archive.read_digests(basefnm)
+    # digests of renamed outputs, each set adds its own name
+    renamed = {}
+    if preview_widths is None:
+        preview_widths = mupub.preview.PREVIEW_WIDTHS
+    if not max_workers:
+        max_workers = len(_ASSET_SETS) + 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [('lyFile', pool.submit(_collect_lyfile, basefnm, manifest))]
+        for name, tail, ziptail, asset_type in _ASSET_SETS:
+            futures.append((name, pool.submit(_zip_maybe, basefnm,
+                                              tail, ziptail, asset_type,
+                                              manifest, rebuilt,
+                                              published, renamed)))
+
+        # process the preview image alongside compression
+        preview = _collect_preview(basefnm, svgfiles, pngfiles,
+                                   preview_widths, published, renamed)
+
+        assets = {}
+        for name, future in futures:
+            assets[name] = future.result()
+
+    assets.update(preview)
+    outputs = [assets[name] for name in _OUTPUTS]
+    if 'pngSrcset' in assets:
+        outputs += [v.split()[0] for v in assets['pngSrcset'].split(', ')]
+    digests = mupub.archive.write_digests(basefnm, outputs, manifest,
+                                          renamed)
+    manifest.save()
+    if changed is not None:
+        changed.extend(name for name in sorted(digests)
+                       if published.get(name) != digests[name])
+    return assets
+
+
+def existing_assets(basefnm, folder='.'):
+    """Find the assets of a piece that has already been collected.
+
+    Nothing is built, renamed or compressed, the names follow those
+    made by :py:func:`collect_assets`. Used to regenerate an RDF
+    without running LilyPond.
+
+    :param str basefnm: base filename used for asset naming.
+    :param str folder: the piece folder.
+    :returns: asset dictionary of the files found, preview
+              dimensions are included if the preview is readable,
+              as is the ``pngSrcset`` of scaled PNG variants.
+    :rtype: dict
+
+    """
+    logger = logging.getLogger(__name__)
+
+    def _exists(name):
+        return os.path.exists(os.path.join(folder, name))
+
+    assets = {}
+    if _exists(basefnm+'-lys'):
+        assets['lyFile'] = basefnm+'-lys.zip'
+    elif _exists(basefnm+'.ly'):
+        assets['lyFile'] = basefnm+'.ly'
+    for name, tail, ziptail, _ in _ASSET_SETS:
+        for candidate in [basefnm+tail+'.gz', basefnm+ziptail, basefnm+tail]:
+            if _exists(candidate):
+                assets[name] = candidate
+                break
 
+    for preview_name in [basefnm+'-preview.svg', basefnm+'-preview.png']:
+        if not _exists(preview_name):
+            continue
+        assets['pngFile'] = preview_name
+        variants = []
+        for variant in glob.glob(os.path.join(folder, basefnm+'-preview-*w.png')):
+            width = os.path.basename(variant)[len(basefnm+'-preview-'):-len('w.png')]
+            if width.isdigit():
+                variants.append((int(width), os.path.basename(variant)))
+        if variants and preview_name.endswith('.png'):
+            assets['pngSrcset'] = ', '.join('{0} {1}w'.format(name, width)
+                                            for width, name in sorted(variants))
+        try:
+            width, height = mupub.preview.image_size(os.path.join(folder,
+                                                                  preview_name))
+            assets['pngWidth'] = str(width)
+            assets['pngHeight'] = str(height)
+        except (ValueError, ET.ParseError) as err:
+            logger.warning(err)
+        break
     return assets
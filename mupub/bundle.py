@@ -0,0 +1,179 @@
+"""Single-file publication bundles.
+
+A bundle carries every published file of a piece, so that moving it
+to the web server is one transfer. It is an ordinary POSIX tar
+archive, extractable with ``tar``, written in a single streaming
+pass. Its last member, ``.mupub-index.json``, records the offset,
+size and SHA-256 of the data of every other member, ::
+
+    {"version": 1,
+     "members": [{"name": "piece.rdf", "offset": 512,
+                  "size": 1834, "sha256": "..."}, ...]}
+
+A reader finds the index by scanning backwards from the end of the
+bundle for its tar header, then seeks directly to the members it
+wants without reading the rest of the archive.
+
+Member times are kept to whole seconds and the index is dated with
+the newest member, so bundling unchanged files gives an identical
+bundle, which is then left in place.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import mupub
+
+INDEX_NAME = '.mupub-index.json'
+INDEX_VERSION = 1
+
+_BLOCK = tarfile.BLOCKSIZE
+_COPY_SIZE = 1 << 20
+# bytes read per step while scanning for the index
+_SCAN_SIZE = 64 * 1024
+
+
+def bundle_path(basefnm):
+    """Return the name of the bundle for a piece.
+
+    :param str basefnm: base filename used for asset naming.
+    :rtype: str
+
+    """
+    return basefnm + '-bundle.tar'
+
+
+class _HashingReader():
+    """Read-through file wrapper computing the SHA-256 of the data."""
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.sha.update(data)
+        return data
+
+
+def write_bundle(bundle_name, files, changed=None):
+    """Write a bundle of files.
+
+    :param str bundle_name: the bundle to write.
+    :param files: the files to bundle, stored under their given
+                  (relative) names.
+    :param list changed: if given, the bundle name is appended when
+                         its content changed.
+    :returns: the index entries of the members.
+    :rtype: list
+
+    """
+    members = []
+    newest = 0
+    tmp_name = bundle_name + '.tmp'
+    with open(tmp_name, 'wb') as outfile:
+        with tarfile.open(fileobj=outfile, mode='w|',
+                          format=tarfile.PAX_FORMAT) as tar:
+            for name in files:
+                info = tar.gettarinfo(name)
+                # a fractional mtime would cost an extended header
+                info.mtime = int(info.mtime)
+                newest = max(newest, info.mtime)
+                with open(name, 'rb') as infile:
+                    reader = _HashingReader(infile)
+                    tar.addfile(info, reader)
+                # tar.offset is past the padded data of the member
+                padded = -(-info.size // _BLOCK) * _BLOCK
+                members.append({'name': info.name,
+                                'offset': tar.offset - padded,
+                                'size': info.size,
+                                'sha256': reader.sha.hexdigest()})
+
+            index = json.dumps({'version': INDEX_VERSION,
+                                'members': members},
+                               indent=1, sort_keys=True).encode('utf-8')
+            info = tarfile.TarInfo(INDEX_NAME)
+            info.size = len(index)
+            info.mtime = newest
+            tar.addfile(info, io.BytesIO(index))
+    if mupub.utils.replace_if_changed(tmp_name, bundle_name) and changed is not None:
+        changed.append(bundle_name)
+    return members
+
+
+def _index_header(block):
+    try:
+        info = tarfile.TarInfo.frombuf(block, tarfile.ENCODING,
+                                       'surrogateescape')
+    except tarfile.HeaderError:
+        return None
+    if info.name == INDEX_NAME and info.isfile():
+        return info
+    return None
+
+
+def read_index(bundle):
+    """Read the index of a bundle.
+
+    Only the tail of the bundle is read: blocks are examined from the
+    end until the header of the index member is found.
+
+    :param bundle: the bundle, an open binary file.
+    :returns: index entries keyed by member name.
+    :rtype: dict
+    :raises: ValueError if the file is not a bundle.
+
+    """
+    end = bundle.seek(0, os.SEEK_END)
+    # headers are block aligned relative to the start of the file
+    pos = (end // _BLOCK) * _BLOCK
+    while pos > 0:
+        start = max(0, pos - _SCAN_SIZE)
+        bundle.seek(start)
+        data = bundle.read(pos - start)
+        for offset in range(len(data) - _BLOCK, -1, -_BLOCK):
+            info = _index_header(data[offset:offset+_BLOCK])
+            if info is None:
+                continue
+            bundle.seek(start + offset + _BLOCK)
+            index = json.loads(bundle.read(info.size).decode('utf-8'))
+            if index.get('version') != INDEX_VERSION:
+                raise ValueError('Unsupported bundle version {}'
+                                 .format(index.get('version')))
+            return dict((m['name'], m) for m in index['members'])
+        pos = start
+    raise ValueError('No bundle index found')
+
+
+def extract_member(bundle, entry, dest):
+    """Copy a member out of a bundle, verifying its SHA-256.
+
+    :param bundle: the bundle, an open binary file.
+    :param dict entry: the member's index entry.
+    :param str dest: file to write, its folder is created if needed.
+    :raises: ValueError if the data does not match its hash.
+
+    """
+    folder = os.path.dirname(dest)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    sha = hashlib.sha256()
+    remaining = entry['size']
+    bundle.seek(entry['offset'])
+    tmp_name = dest + '.tmp'
+    with open(tmp_name, 'wb') as outfile:
+        while remaining > 0:
+            data = bundle.read(min(remaining, _COPY_SIZE))
+            if not data:
+                break
+            sha.update(data)
+            outfile.write(data)
+            remaining -= len(data)
+    if remaining or sha.hexdigest() != entry['sha256']:
+        os.unlink(tmp_name)
+        raise ValueError('{} is damaged in the bundle'.format(entry['name']))
+    os.replace(tmp_name, dest)
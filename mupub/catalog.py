@@ -0,0 +1,166 @@
+"""A local catalog of the published archive.
+
+The published RDF files are the authoritative record of what the
+archive contains. They are read into an SQLite catalog in the
+configuration folder so that the archive can be searched without
+parsing thousands of XML files each time. The catalog is updated
+incrementally: only RDF files whose modification time has changed
+since they were last read are parsed again.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import logging
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+import mupub
+
+# Catalog columns for the RDF fields, 'for' is an SQL keyword.
+_COLUMNS = dict((key, 'instrument' if key == 'for' else key)
+                for key in mupub.rdfu._MU_KEYS)
+
+_CREATE_PIECES = """CREATE TABLE IF NOT EXISTS
+   pieces (
+      path TEXT PRIMARY KEY,
+      mtime REAL,
+      {}
+   )
+""".format(',\n      '.join('"{}" TEXT'.format(c) for c in _COLUMNS.values()))
+
+_CREATE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS pieces_composer ON pieces (composer)',
+    'CREATE INDEX IF NOT EXISTS pieces_version ON pieces (lilypondVersion)',
+]
+
+_REPLACE_PIECE = 'INSERT OR REPLACE INTO pieces (path, mtime, {0}) VALUES ({1})'.format(
+    ', '.join('"{}"'.format(c) for c in _COLUMNS.values()),
+    ', '.join('?' * (len(_COLUMNS) + 2)))
+
+# Query filters, the value is bound to each placeholder as is or,
+# for a LIKE pattern, escaped.
+_FILTERS = {
+    'composer': ('composer = ? COLLATE NOCASE', [False]),
+    'instrument': ("instrument LIKE '%' || ? || '%' ESCAPE '\\'", [True]),
+    'version': ("(lilypondVersion = ? OR lilypondVersion LIKE ? || '.%' ESCAPE '\\')",
+                [False, True]),
+    'licence': ("licence LIKE '%' || ? || '%' ESCAPE '\\'", [True]),
+    'title': ("title LIKE '%' || ? || '%' ESCAPE '\\'", [True]),
+}
+
+
+def _like_escape(value):
+    """Escape the wildcards of a LIKE pattern."""
+    return (value.replace('\\', '\\\\')
+            .replace('%', '\\%').replace('_', '\\_'))
+
+
+def getCatalogPath():
+    """Return the catalog database path from configuration.
+    """
+    return os.path.join(mupub.CONFIG_DIR,
+                        mupub.CONFIG_DICT['common'].get('catalog_db',
+                                                        'mu-catalog.db'))
+
+
+class Catalog():
+    """The catalog of published pieces.
+
+    :param str path: database path, defaults to the configured path.
+
+    """
+    def __init__(self, path=None):
+        self.conn = sqlite3.connect(path or getCatalogPath())
+        with self.conn:
+            self.conn.execute(_CREATE_PIECES)
+            # a catalog made before a field was added to the RDF
+            present = set(row[1] for row in
+                          self.conn.execute('PRAGMA table_info(pieces)'))
+            for column in _COLUMNS.values():
+                if column not in present:
+                    self.conn.execute(
+                        'ALTER TABLE pieces ADD COLUMN "{}" TEXT'.format(column))
+            for index in _CREATE_INDEXES:
+                self.conn.execute(index)
+
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+
+    def update(self, top=None):
+        """Bring the catalog up to date with the RDF files.
+
+        New and modified RDF files are parsed, entries for removed
+        files are deleted.
+
+        :param str top: folder to search, defaults to
+                        :py:data:`~mupub.core.FTP_BASE`.
+        :returns: (files read, entries removed, files unchanged)
+        :rtype: tuple
+
+        """
+        logger = logging.getLogger(__name__)
+        top = top or mupub.FTP_BASE
+        known = dict(self.conn.execute('SELECT path, mtime FROM pieces'))
+        read = unchanged = 0
+        with self.conn:
+            for rdf_path in mupub.rdfu.rdf_files(top):
+                path = os.path.relpath(rdf_path, top)
+                mtime = os.stat(rdf_path).st_mtime
+                if known.pop(path, None) == mtime:
+                    unchanged += 1
+                    continue
+                try:
+                    values = mupub.read_rdf(rdf_path)
+                except ET.ParseError as err:
+                    logger.warning('%s: %s' % (rdf_path, err))
+                    continue
+                self.conn.execute(_REPLACE_PIECE,
+                                  [path, mtime] + [values.get(k) for k in _COLUMNS])
+                read += 1
+            # whatever is left was not found
+            self.conn.executemany('DELETE FROM pieces WHERE path = ?',
+                                  [(path,) for path in known])
+        return read, len(known), unchanged
+
+
+    def query(self, **filters):
+        """Find pieces.
+
+        Filters are combined, all must match,
+
+         - ``composer``, the composer name, e.g. ``SorF``.
+         - ``instrument``, part of the instrument (``for``) field.
+         - ``version``, a |LilyPond| version or version prefix,
+           ``2.18`` matches ``2.18.2``.
+         - ``licence``, part of the licence.
+         - ``title``, part of the title.
+
+        :returns: rows of dictionaries of RDF field to value, with
+                  the RDF path as ``path``.
+        :rtype: list
+        :raises: ValueError on an unknown filter.
+
+        """
+        conditions = []
+        params = []
+        for name, value in sorted(filters.items()):
+            if value is None:
+                continue
+            if name not in _FILTERS:
+                raise ValueError('Unknown filter - {}'.format(name))
+            condition, escaped = _FILTERS[name]
+            conditions.append(condition)
+            params += [_like_escape(value) if like else value for like in escaped]
+        sql = 'SELECT * FROM pieces'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY path'
+        cursor = self.conn.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        fields = dict((c, k) for k, c in _COLUMNS.items())
+        return [dict((fields.get(n, n), v) for n, v in zip(names, row))
+                for row in cursor]
@@ -0,0 +1,207 @@
+"""Per-piece build checkpoints.
+
+Building a piece is a sequence of stages: build scores, build
+preview, collect assets, and write the RDF. Each stage that
+completes is recorded in a checkpoint file in the piece folder along
+with a fingerprint of its inputs. A build that is interrupted, or
+that fails part way through, can then be resumed at the first stage
+that failed or whose inputs have changed rather than starting over.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+import mupub
+
+STAGES = ('scores', 'preview', 'collect', 'rdf',)
+
+_BLOCKSIZE = 1 << 16
+
+
+def checkpoint_path(basefnm):
+    """Return the name of the checkpoint file for a piece.
+
+    :param str basefnm: base filename used for asset naming.
+    :rtype: str
+
+    """
+    return basefnm + '-checkpoint.json'
+
+
+def fingerprint(paths=(), *extras):
+    """Compute a fingerprint for a set of input files.
+
+    The content of each file is hashed in sorted path order, followed
+    by any extra values (compiler version, options, ...) that
+    influence the result of a stage.
+
+    :param paths: iterable of file paths.
+    :param extras: additional values to include.
+    :returns: hexadecimal digest.
+    :rtype: str
+
+    """
+    sha = hashlib.sha256()
+    for path in sorted(set(paths)):
+        sha.update(path.encode('utf-8'))
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(_BLOCKSIZE), b''):
+                sha.update(block)
+    for extra in extras:
+        sha.update(b'\0')
+        sha.update(str(extra).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def source_files(basefnm, infile=(), header_file=None):
+    """Collect the |LilyPond| sources that make up a piece.
+
+    The sources are the given input files, the header file, any
+    |LilyPond| files in the current folder, and everything under a
+    ``-lys`` folder.
+
+    :param str basefnm: base filename used for asset naming.
+    :param infile: list of |LilyPond| files being built.
+    :param str header_file: optional file holding the header.
+    :returns: list of source file paths.
+    :rtype: [str]
+
+    """
+    sources = set([f for f in infile if f])
+    if header_file:
+        sources.add(header_file)
+    for pattern in ['*.ly', '*.ily', '*.lyi']:
+        sources.update(glob.glob(pattern))
+    if os.path.isdir(basefnm+'-lys'):
+        sources.update(mupub.utils.find_files(basefnm+'-lys'))
+    return [src for src in sources if os.path.isfile(src)]
+
+
+class Checkpoint():
+    """The recorded state of a piece's publication stages.
+
+    The file is rewritten after each change so that the state on disk
+    always reflects the last completed stage.
+
+    """
+    def __init__(self, basefnm):
+        self.path = checkpoint_path(basefnm)
+        self._stages = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as ckfile:
+                    self._stages = json.load(ckfile).get('stages', {})
+            except (ValueError, AttributeError):
+                logger = logging.getLogger(__name__)
+                logger.warning('Ignoring unreadable checkpoint %s' % self.path)
+                self._stages = {}
+
+
+    def _save(self):
+        with open(self.path, 'w', encoding='utf-8') as ckfile:
+            json.dump({'stages': self._stages}, ckfile, indent=2, sort_keys=True)
+
+
+    def is_current(self, stage, fprint):
+        """Test whether a stage can be skipped.
+
+        :param str stage: stage name, one of :py:data:`STAGES`.
+        :param str fprint: fingerprint of the stage's current inputs.
+        :returns: True if the stage completed with the same inputs and
+                  all of its recorded outputs still exist.
+        :rtype: boolean
+
+        """
+        entry = self._stages.get(stage)
+        if not entry or entry.get('status') != 'done':
+            return False
+        if entry.get('fingerprint') != fprint:
+            return False
+        for output in entry.get('outputs', []):
+            if not os.path.exists(output):
+                return False
+        return True
+
+
+    def complete(self, stage, fprint, outputs=None, data=None):
+        """Record the successful completion of a stage.
+
+        :param str stage: stage name, one of :py:data:`STAGES`.
+        :param str fprint: fingerprint of the stage's inputs.
+        :param outputs: files produced by the stage.
+        :param data: JSON serializable results of the stage.
+
+        """
+        self._stages[stage] = {
+            'status': 'done',
+            'fingerprint': fprint,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'outputs': list(outputs or []),
+            'data': data,
+        }
+        self._save()
+
+
+    def published(self, stage, outputs):
+        """Replace the recorded outputs of a completed stage.
+
+        Asset collection renames, compresses or removes the files the
+        |LilyPond| stages produce. Recording the published files in
+        their place keeps those stages current.
+
+        :param str stage: stage name, one of :py:data:`STAGES`.
+        :param outputs: files the stage's outputs were collected into.
+
+        """
+        entry = self._stages.get(stage)
+        if not entry or entry.get('status') != 'done':
+            return
+        entry['outputs'] = list(outputs)
+        self._save()
+
+
+    def fail(self, stage):
+        """Record the failure of a stage.
+
+        :param str stage: stage name, one of :py:data:`STAGES`.
+
+        """
+        self._stages[stage] = {
+            'status': 'failed',
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self._save()
+
+
+    def data(self, stage):
+        """Return the results recorded for a completed stage.
+
+        :param str stage: stage name, one of :py:data:`STAGES`.
+        :returns: recorded data or None.
+
+        """
+        entry = self._stages.get(stage)
+        if entry:
+            return entry.get('data')
+        return None
+
+
+    def status(self, stage):
+        """Return 'done', 'failed' or None if the stage never ran."""
+        entry = self._stages.get(stage)
+        if entry:
+            return entry.get('status')
+        return None
+
+
+    def clear(self):
+        """Forget all recorded stages and remove the checkpoint file."""
+        self._stages = {}
+        if os.path.exists(self.path):
+            os.unlink(self.path)
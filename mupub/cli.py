@@ -24,6 +24,12 @@ commands within this utility:
     tag   - Modifies the header with MutopiaProject fields.
     build - Builds a complete set of output files for publication.
     clean - Clears all build products.
+    rdf   - Regenerates RDF files without rebuilding.
+    query - Searches the catalog of published pieces.
+    stats - Reports on recorded build telemetry.
+    bench-compilers - Compares LilyPond versions building one piece.
+    unbundle - Lists or extracts files of a publication bundle.
+    compilers - Installs ahead of time the compilers pieces need.
 """
 
 
@@ -0,0 +1,205 @@
+"""Compiler benchmark module, implementing the bench-compilers entry point.
+
+Builds one piece with several |LilyPond| versions at once so that
+build time, memory and output sizes can be compared before a new
+compiler release is adopted for the archive. ::
+
+  $ mupub bench-compilers PIECE --versions 2.18.2,2.22.1,2.24.3
+
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import logging
+import os
+import shutil
+import tempfile
+from clint.textui import colored, puts, indent
+import mupub
+
+
+def _resolve_piece(piece):
+    """Find the base name and main LilyPond file of a piece.
+
+    :param str piece: piece folder or LilyPond file.
+    :returns: (base, infile), infile is None if not found.
+
+    """
+    piece = os.path.abspath(piece)
+    if os.path.isfile(piece):
+        return os.path.basename(piece).rsplit('.', 1)[0], piece
+    base = os.path.basename(piece)
+    for candidate in [os.path.join(piece, base+'.ly'),
+                      os.path.join(piece, base+'-lys', base+'.ly')]:
+        if os.path.exists(candidate):
+            return base, candidate
+    return base, None
+
+
+def split_versions(versions):
+    """Split a comma separated list of LilyPond versions.
+
+    Repeated versions, including those differing only in a build
+    number such as ``2.18.2`` and ``2.18.2-1``, are given once, in
+    the order first seen. Invalid versions are skipped.
+
+    :param str versions: comma separated list of versions.
+    :rtype: list
+
+    """
+    logger = logging.getLogger(__name__)
+    seen = set()
+    unique = []
+    for version in [v.strip() for v in versions.split(',') if v.strip()]:
+        try:
+            key = mupub.LyVersion(version)
+        except ValueError:
+            logger.warning('Invalid version %s, skipping' % version)
+            continue
+        if key not in seen:
+            seen.add(key)
+            unique.append(version)
+    return unique
+
+
+def _output_size(workdir, pattern):
+    return sum(os.path.getsize(f) for f in glob.glob(os.path.join(workdir, pattern)))
+
+
+def _bench_one(version, lily_path, infile, workdir, timeout):
+    """Build the piece with one compiler in its own folder.
+
+    :returns: (version, LyRun, pdf bytes, ps bytes)
+
+    """
+    command = [lily_path,
+               '-dno-point-and-click',
+               '--format=pdf',
+               '--format=ps',
+               '-dpaper-size="a4"',
+               '--include=' + os.path.dirname(infile),
+               infile]
+    lyrun = mupub.LyRunner().run(command, label=version,
+                                 cwd=workdir, timeout=timeout)
+    return (version, lyrun,
+            _output_size(workdir, '*.pdf'),
+            _output_size(workdir, '*.ps'))
+
+
+def _report(results):
+    fmt = '{0:<10} {1:>8} {2:>8} {3:>10} {4:>5} {5:>10} {6:>10} {7:>6}'
+    puts(fmt.format('version', 'wall', 'cpu', 'rss (KB)', 'pages',
+                    'pdf', 'ps', 'status'))
+    for version, lyrun, pdf_size, ps_size in results:
+        if lyrun.timed_out:
+            status = 'timeout'
+        elif lyrun.succeeded():
+            status = 'ok'
+        else:
+            status = 'failed'
+        puts(fmt.format(version,
+                        '%.2f' % lyrun.wall,
+                        '%.2f' % (lyrun.cpu_user + lyrun.cpu_sys),
+                        lyrun.max_rss,
+                        lyrun.progress.pages,
+                        pdf_size,
+                        ps_size,
+                        status))
+
+
+def bench_compilers(piece, versions, jobs=0, timeout=None, keep=False):
+    """Build a piece with several compiler versions concurrently.
+
+    :param str piece: piece folder or LilyPond file.
+    :param str versions: comma separated list of LilyPond versions.
+    :param int jobs: maximum concurrent builds, 0 for one per version.
+    :param int timeout: seconds allowed for each build.
+    :param bool keep: keep the build folders for inspection.
+
+    Each version is resolved through :py:class:`~mupub.lily.LyLocator`,
+    installing it if necessary. The piece is then built (A4, PDF and
+    PostScript) by each compiler in its own temporary folder and a
+    comparison table is printed.
+
+    """
+    logger = logging.getLogger(__name__)
+    base, infile = _resolve_piece(piece)
+    if not infile:
+        logger.error('Failed to find a LilyPond file for %s' % piece)
+        return
+
+    compilers = []
+    for version in split_versions(versions):
+        try:
+            lily_path = mupub.LyLocator(version, progress_bar=True).working_path()
+        except mupub.BadConfiguration as bc:
+            logger.warning(bc)
+            continue
+        if not lily_path:
+            puts(colored.red('No compiler available for %s, skipping.' % version))
+            continue
+        compilers.append((version, lily_path))
+
+    if len(compilers) < 1:
+        return
+
+    topdir = tempfile.mkdtemp(prefix='mubench_')
+    puts(colored.green('Building {0} with {1} compilers in {2}'
+                       .format(base, len(compilers), topdir)))
+    results = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs or len(compilers)) as pool:
+            futures = []
+            for version, lily_path in compilers:
+                workdir = os.path.join(topdir, version)
+                os.mkdir(workdir)
+                futures.append(pool.submit(_bench_one, version, lily_path,
+                                           infile, workdir, timeout))
+            for future in futures:
+                results.append(future.result())
+    finally:
+        if not keep:
+            shutil.rmtree(topdir, ignore_errors=True)
+
+    with indent(4):
+        _report(results)
+
+
+def main(args):
+    """Entry point for bench-compilers command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub bench-compilers')
+    parser.add_argument(
+        'piece',
+        help='Piece folder or LilyPond file to build'
+    )
+    parser.add_argument(
+        '--versions',
+        required=True,
+        help='Comma separated list of LilyPond versions'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=0,
+        help='Maximum concurrent builds (default, one per version)'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=None,
+        help='Seconds allowed for each build'
+    )
+    parser.add_argument(
+        '--keep',
+        action='store_true',
+        help='Keep the build folders'
+    )
+
+    args = parser.parse_args(args)
+    bench_compilers(**vars(args))
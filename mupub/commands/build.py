@@ -13,7 +13,7 @@ import logging
 import os
 import sys
 import shutil
-import subprocess
+import zipfile
 from clint.textui import colored, puts
 import mupub
 
@@ -27,9 +27,84 @@ def _stripped_base(infile):
     return basefnm[:basefnm.rfind('.')]
 
 
-def _build_scores(base_params, infile):
+def _log_failure(lyrun):
+    logger = logging.getLogger(__name__)
+    for error in lyrun.progress.errors():
+        logger.error(str(error))
+    logger.error('LilyPond returned an error code of %d' % lyrun.returncode)
+
+
+def _report_timings(runner):
+    puts(colored.green('LilyPond timings (seconds)'))
+    for line in mupub.timing_report(runner.runs):
+        puts(line)
+
+
+def _optimize_pdfs(tool_name):
+    """Post-process built PDFs, reporting the size of each.
+
+    :param tool_name: 'qpdf' or 'gs', None for any available.
+
+    """
+    logger = logging.getLogger(__name__)
+    pdfs = sorted(glob.glob('*.pdf'))
+    if len(pdfs) < 1:
+        return
+    tool = mupub.pdfopt.find_tool(tool_name)
+    if not tool:
+        puts(colored.yellow('No PDF optimizer found, PDFs are not post-processed'))
+        return
+    puts(colored.green('Optimizing {0} PDF files with {1}'.format(len(pdfs), tool[0])))
+    saved = 0
+    for result in mupub.pdfopt.optimize_pdfs(pdfs, tool):
+        logger.info(str(result))
+        puts(str(result))
+        saved += result.saved()
+    puts(colored.green('{} bytes saved'.format(saved)))
+
+
+def _unzip_pdfs(base):
+    """Restore the zipped PDFs of a piece for optimization.
+
+    Used when the scores were not built again, their published
+    archives are then the only copy. Collection zips them again.
+
+    :param str base: piece base name.
+
+    """
+    for ziptail in ['-a4-pdfs.zip', '-let-pdfs.zip']:
+        if os.path.exists(base+ziptail):
+            with zipfile.ZipFile(base+ziptail) as pdfzip:
+                pdfzip.extractall()
+
+
+def _optimize_previews(base):
+    """Losslessly shrink the preview image, reporting the saving.
+
+    A preview that was not built again is shrunk where it was
+    published.
+
+    :param str base: piece base name, for the report.
+
+    """
+    before = after = 0
+    previews = glob.glob('*.preview.svg') + glob.glob('*.preview.png')
+    if len(previews) < 1:
+        previews = [n for n in [base+'-preview.svg', base+'-preview.png']
+                    if os.path.exists(n)]
+    for preview in previews:
+        size_before, size_after = mupub.preview.optimize_preview(preview)
+        before += size_before
+        after += size_after
+    if before > 0:
+        puts(colored.green('{0} preview: {1} -> {2} bytes, {3} saved'
+                           .format(base, before, after, before - after)))
+
+
+def _build_scores(runner, base_params, infile):
     """Build scores in the required page sizes.
 
+    :param runner: The LyRunner used to run LilyPond.
     :param base_params: List of LilyPond command and params.
     :param infile: The file to compile.
 
@@ -46,29 +121,31 @@ def _build_scores(base_params, infile):
         command.append('-dpaper-size="{}"'.format(psize))
         command.append('--include=' + os.path.dirname(infile))
         command.append(infile)
-        try:
-            subprocess.check_output(command)
-        except subprocess.CalledProcessError as cpe:
-            logging.error('LilyPond returned an error code of %d' % cpe.returncode)
+        lyrun = runner.run(command, label='{0} ({1})'.format(basefnm, psize))
+        if not lyrun.succeeded():
+            _log_failure(lyrun)
             return False
 
         # rename the pdf and ps files to include their page size
         pdf_fnm = basefnm + '.pdf'
         if os.path.exists(pdf_fnm):
             sized_pdf = basefnm + '-{0}.pdf'.format(pagedef[psize])
-            os.rename(pdf_fnm, sized_pdf)
+            mupub.utils.replace_if_changed(pdf_fnm, sized_pdf)
+            lyrun.outputs.append(sized_pdf)
 
         ps_fnm = basefnm + '.ps'
         if os.path.exists(ps_fnm):
             sized_ps = basefnm + '-{0}.ps'.format(pagedef[psize])
-            os.rename(ps_fnm, sized_ps)
+            mupub.utils.replace_if_changed(ps_fnm, sized_ps)
+            lyrun.outputs.append(sized_ps)
 
     return True
 
 
-def _build_preview(base_params, lpversion, infile, force_png_preview=False):
+def _build_preview(runner, base_params, lpversion, infile, force_png_preview=False):
     """Build a preview file
 
+    :param runner: The LyRunner used to run LilyPond.
     :param base_params: Starting list of LilyPond command and parameters.
     :param lpversion: The LilyPond version of the source file.
     :param infile: LilyPond file to compile.
@@ -115,65 +192,182 @@ def _build_preview(base_params, lpversion, infile, force_png_preview=False):
     command = base_params + preview_params
     command.append(infile)
     puts(colored.green('Building preview and midi files'))
-    try:
-        subprocess.check_output(command)
-    except subprocess.CalledProcessError as cpe:
-        logging.error('LilyPond returned an error code of %d' % cpe.returncode)
+    lyrun = runner.run(command,
+                       label='{0} (preview)'.format(_stripped_base(infile)))
+    if not lyrun.succeeded():
+        _log_failure(lyrun)
         return False
 
+    lyrun.outputs.extend(glob.glob(_stripped_base(infile) + '.preview.*'))
     return True
 
 
-def _build_one(infile,
-               lily_path,
-               lpversion,
-               do_preview,
-               force_png_preview=False):
-    """Build a single lilypond file.
+def _score_outputs():
+    outputs = []
+    for pattern in ['*-a4.pdf', '*-let.pdf', '*-a4.ps', '*-let.ps']:
+        outputs.extend(glob.glob(pattern))
+    return outputs
 
-    :param infile: LilyPond file to build, might be None
-    :param lily_path: Path to LilyPond build script
-    :param do_preview: Boolean to flag additional preview build
-    :param force_png_preview: Force use of PNG format in preview
 
-    """
+def _preview_outputs():
+    return glob.glob('*.preview.svg') + glob.glob('*.preview.png')
 
-    base, infile = mupub.utils.resolve_input(infile)
-    if not infile:
-        puts(colored.red('Failed to resolve infile %s' % infile))
-        return False
 
-    base_params = [lily_path, '-dno-point-and-click',]
-    if not _build_scores(base_params, infile):
-        return False
-    if do_preview:
-        return _build_preview(base_params,
-                              lpversion,
-                              infile,
-                              force_png_preview)
-    return True
+def _asset_outputs(assets):
+    return [v for k,v in assets.items() if k.endswith('File') and v != 'empty']
+
 
+def _score_assets(assets):
+    return [v for k,v in assets.items()
+            if k.endswith('File') and k not in ('lyFile', 'pngFile')
+            and v != 'empty']
 
-def _lily_build(infile, header, force_png_preview=False, skip_preview=False):
-    lpversion = mupub.LyVersion(header.get_value('lilypondVersion'))
+
+def _write_bundle(base, assets, changed):
+    """Write the bundle of all published files of the piece."""
+    files = _asset_outputs(assets)
+    if 'pngSrcset' in assets:
+        files += [v.split()[0] for v in assets['pngSrcset'].split(', ')]
+    files.append(base+'.rdf')
+    if os.path.exists(base+'.jsonld'):
+        files.append(base+'.jsonld')
+    bundle_name = mupub.bundle.bundle_path(base)
+    mupub.bundle.write_bundle(bundle_name, files, changed)
+    puts(colored.green('Wrote {0} files to {1}'.format(len(files), bundle_name)))
+
+
+def _find_parts(base, parts_folder):
+    """Find part scores in the given folder.
+
+    :param base: Base name of the piece.
+    :param parts_folder: Folder name given on the command line.
+    :returns: List of part scores, None if the folder was not found.
+
+    """
+    # User may fully specify the folder name
+    parts_path = parts_folder
+    if not os.path.exists(parts_path):
+        # ... or we'll try to find it here
+        parts_path = os.path.join(base+'-lys', parts_folder)
+        if not os.path.exists(parts_path):
+            return None
+    parts_list = []
+    for fnm in os.listdir(path=parts_path):
+        if fnm.endswith('.ly'):
+            parts_list.append(os.path.join(parts_path,fnm))
+    return sorted(parts_list)
+
+
+def _resolve_compiler(lpversion):
     locator = mupub.LyLocator(str(lpversion), progress_bar=True)
     lily_path = locator.working_path()
     if not lily_path:
         # No compiler (too old?) installed for this revision.
         sys.exit(-2)
+    return lily_path
 
-    # Build each score, doing a preview on the first one only (unless skipping)
-    do_preview = not skip_preview
+
+def _lily_build_scores(runner, infile, lily_path):
+    """Build the scores of each file in infile.
+
+    :param runner: The LyRunner used to run LilyPond.
+    :param infile: List of LilyPond files to build.
+    :param lily_path: Path to LilyPond build script
+    :returns: True if all scores were built.
+
+    """
+    base_params = [lily_path, '-dno-point-and-click',]
     count = 0
     for ly_file in infile:
         count += 1
         puts(colored.green('Processing LilyPond file {} of {}'.format(count,len(infile))))
-        _build_one(ly_file,
-                   lily_path,
-                   lpversion,
-                   do_preview,
-                   force_png_preview)
-        do_preview = False
+        _, ly_file = mupub.utils.resolve_input(ly_file)
+        if not ly_file:
+            puts(colored.red('Failed to resolve infile %s' % ly_file))
+            return False
+        if not _build_scores(runner, base_params, ly_file):
+            return False
+    return True
+
+
+def _lily_build_preview(runner, infile, lily_path, lpversion, force_png_preview=False):
+    """Build the preview from the first file in infile.
+
+    :param runner: The LyRunner used to run LilyPond.
+    :param infile: List of LilyPond files being built.
+    :param lily_path: Path to LilyPond build script
+    :param lpversion: The LilyPond version of the source file.
+    :param force_png_preview: Force use of PNG format in preview
+    :returns: True if the preview was built.
+
+    """
+    _, ly_file = mupub.utils.resolve_input(infile[0])
+    if not ly_file:
+        puts(colored.red('Failed to resolve infile %s' % infile[0]))
+        return False
+    base_params = [lily_path, '-dno-point-and-click',]
+    return _build_preview(runner,
+                          base_params,
+                          lpversion,
+                          ly_file,
+                          force_png_preview)
+
+
+def _lily_build_stages(checkpoint,
+                       runner,
+                       infile,
+                       parts_list,
+                       lpversion,
+                       scores_print,
+                       preview_print,
+                       force_png_preview):
+    """Run the score and preview stages that are not current.
+
+    :param checkpoint: The piece's build checkpoint.
+    :param runner: The LyRunner used to run LilyPond.
+    :param infile: List of LilyPond files to build.
+    :param parts_list: List of part scores to build.
+    :param lpversion: The LilyPond version of the source file.
+    :param scores_print: Input fingerprint of the scores stage.
+    :param preview_print: Input fingerprint of the preview stage.
+    :param force_png_preview: Force use of PNG format in preview
+    :returns: False if a stage failed and the build must stop.
+
+    """
+    lily_path = None
+    if checkpoint.is_current('scores', scores_print):
+        puts(colored.green('Scores are up to date, skipping score build'))
+    else:
+        lily_path = _resolve_compiler(lpversion)
+        # build infile collection first
+        if not _lily_build_scores(runner, infile, lily_path):
+            checkpoint.fail('scores')
+            return False
+        # Build all parts if requested.
+        if len(parts_list) > 0:
+            puts(colored.green('Found {} part scores'.format(len(parts_list))))
+            if not _lily_build_scores(runner, parts_list, lily_path):
+                checkpoint.fail('scores')
+                return False
+        checkpoint.complete('scores', scores_print, _score_outputs())
+
+    if checkpoint.is_current('preview', preview_print):
+        puts(colored.green('Preview is up to date, skipping preview build'))
+        return True
+
+    if not lily_path:
+        lily_path = _resolve_compiler(lpversion)
+    if not _lily_build_preview(runner, infile, lily_path, lpversion,
+                               force_png_preview):
+        checkpoint.fail('preview')
+        return False
+    outputs = _preview_outputs()
+    if len(outputs) > 0:
+        checkpoint.complete('preview', preview_print, outputs)
+    else:
+        # Leave it to asset collection to report the missing preview.
+        checkpoint.fail('preview')
+    return True
 
 
 def build(infile,
@@ -181,7 +375,14 @@ def build(infile,
           parts_folder,
           collect_only=False,
           skip_header_check=False,
-          force_png_preview=False ):
+          force_png_preview=False,
+          rebuild=False,
+          timings=False,
+          optimize_pdf=False,
+          pdf_tool=None,
+          optimize_preview=False,
+          bundle=False,
+          jsonld=False):
 
     """Build one or more |LilyPond| files, generate publication assets.
 
@@ -191,12 +392,23 @@ def build(infile,
     :param collect_only: Skip building, just collect assets and build RDF.
     :param skip_header_check: Skip header validation.
     :param force_png_preview: Coerce PNG format in preview
+    :param rebuild: Ignore the checkpoint and run every stage.
+    :param timings: Report where LilyPond spent its time.
+    :param optimize_pdf: Linearize and shrink PDFs before collection.
+    :param pdf_tool: PDF optimizer to use, 'qpdf' or 'gs'.
+    :param optimize_preview: Minify the SVG or PNG preview.
+    :param bundle: Also write all assets and the RDF to one bundle.
+    :param jsonld: Also write the RDF description as JSON-LD.
 
     This command presumes your current working directory is the
     location where the contributed source files live in the
     MutopiaProject hierarchy. A successful build will create all
     necessary assets for publication.
 
+    Each completed stage (scores, preview, collect, RDF) is recorded
+    in a checkpoint file. A subsequent build resumes at the first
+    stage that failed or whose inputs have changed.
+
     """
     logger = logging.getLogger(__name__)
     logger.info('build command starting')
@@ -238,39 +450,101 @@ def build(infile,
             logger.debug('Incorrect or incomplete header.')
             return
 
+    checkpoint = mupub.Checkpoint(base)
+    if rebuild:
+        checkpoint.clear()
+
     # The user can opt to build manually and then use this application
     # to collect all the publication assets.
+    collect_print = None
+    # archives of outputs the scores no longer make are removed
+    scores_rebuilt = False
+    # a preview that is not built again is collected as published
+    preview_rebuilt = True
+    scores_skipped = False
     if not collect_only:
-        # build infile collection first
-        _lily_build(infile, header, force_png_preview)
-
-        # Build all parts if requested.
+        parts_list = []
         if parts_folder:
-            # User may fully specify the folder name
-            parts_path = parts_folder
-            if not os.path.exists(parts_path):
-                # ... or we'll try to find it here
-                parts_path = os.path.join(base+'-lys', parts_folder)
-                if not os.path.exists(parts_path):
-                    puts(colored.red('Failed to find parts folder - {}'.format(parts_folder)))
-                    puts(colored.red('Skipping asset collection'))
-                    return
-            parts_list = []
-            for fnm in os.listdir(path=parts_path):
-                if fnm.endswith('.ly'):
-                    parts_list.append(os.path.join(parts_path,fnm))
-            if len(parts_list) > 0:
-                puts(colored.green('Found {} part scores'.format(len(parts_list))))
-                _lily_build(parts_list, header, False, True)
-
-    # rename all .midi files to .mid
+            parts_list = _find_parts(base, parts_folder)
+            if parts_list is None:
+                puts(colored.red('Failed to find parts folder - {}'.format(parts_folder)))
+                puts(colored.red('Skipping asset collection'))
+                return
+
+        lpversion = mupub.LyVersion(header.get_value('lilypondVersion'))
+        sources = mupub.source_files(base, infile+parts_list, header_file)
+        scores_print = mupub.fingerprint(sources, 'scores', lpversion,
+                                         *(infile+parts_list))
+        preview_print = mupub.fingerprint(sources, 'preview', lpversion,
+                                          infile[0], force_png_preview)
+        # options changing the collected files
+        collect_extras = []
+        if optimize_pdf:
+            collect_extras += ['optimize-pdf', pdf_tool or 'auto']
+        if optimize_preview:
+            collect_extras.append('optimize-preview')
+        collect_print = mupub.fingerprint((), scores_print, preview_print,
+                                          *collect_extras)
+        if checkpoint.is_current('collect', collect_print):
+            puts(colored.green('Assets are up to date, skipping LilyPond builds'))
+        else:
+            runner = mupub.LyRunner()
+            scores_rebuilt = not checkpoint.is_current('scores', scores_print)
+            scores_skipped = not scores_rebuilt
+            preview_rebuilt = not checkpoint.is_current('preview', preview_print)
+            built = _lily_build_stages(checkpoint, runner, infile, parts_list,
+                                       lpversion, scores_print, preview_print,
+                                       force_png_preview)
+            mupub.telemetry.record_runs(runner.runs, base, lpversion)
+            if timings and len(runner.runs) > 0:
+                _report_timings(runner)
+            if not built:
+                return
+
+    # rename all .midi files to .mid, keeping unchanged ones
     for mid in glob.glob('*.midi'):
-        os.rename(mid, mid[:len(mid)-1])
+        mupub.utils.replace_if_changed(mid, mid[:len(mid)-1])
 
+    # published files whose content changed
+    changed = []
     try:
-        assets = mupub.collect_assets(base)
-        puts(colored.green('Creating RDF file'))
-        header.write_rdf(base+'.rdf', assets)
+        if collect_print and checkpoint.is_current('collect', collect_print):
+            puts(colored.green('Assets are up to date, skipping collection'))
+            assets = checkpoint.data('collect')
+        else:
+            if optimize_pdf:
+                if scores_skipped:
+                    _unzip_pdfs(base)
+                _optimize_pdfs(pdf_tool)
+            if optimize_preview:
+                _optimize_previews(base)
+            assets = mupub.collect_assets(base, changed=changed,
+                                          rebuilt=scores_rebuilt,
+                                          preview_rebuilt=preview_rebuilt)
+            checkpoint.complete('collect', collect_print,
+                                _asset_outputs(assets), assets)
+            # what LilyPond made is now renamed, compressed or removed
+            checkpoint.published('scores', _score_assets(assets))
+            checkpoint.published('preview', [assets['pngFile']])
+
+        header_sources = mupub.source_files(base, infile, header_file)
+        rdf_extras = ['jsonld'] if jsonld else []
+        rdf_print = mupub.fingerprint(header_sources, 'rdf', collect_print,
+                                      *rdf_extras)
+        if collect_print and checkpoint.is_current('rdf', rdf_print):
+            puts(colored.green('RDF is up to date'))
+        else:
+            puts(colored.green('Creating RDF file'))
+            if header.write_rdf(base+'.rdf', assets, sidecar=jsonld):
+                changed.append(base+'.rdf')
+            checkpoint.complete('rdf', rdf_print,
+                                [base+'.rdf'] + [base+'.'+e for e in rdf_extras])
+
+        if bundle:
+            _write_bundle(base, assets, changed)
+        puts(colored.green('{} outputs changed'.format(len(changed))))
+        for name in sorted(changed):
+            logger.info('%s changed' % name)
 
         # remove by-products of build
         _remove_if_exists(base+'.ps')
@@ -281,8 +555,9 @@ def build(infile,
         logger.info('Publishing build complete.')
     except mupub.IncompleteBuild as exc:
         logger.warning(exc)
+        checkpoint.fail('collect')
         puts(colored.red('Rebuild needed, assets were not completely built.'))
-        puts(colored.red('Do a "mupub clean" before next build.'))
+        puts(colored.red('Completed stages are kept, run "mupub build" again to resume.'))
 
 
 def main(args):
@@ -321,6 +596,41 @@ def main(args):
         action='store_true',
         help='Force a preview with PNG format instead of default SVG'
     )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='Ignore the build checkpoint and run every stage'
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Report time spent in each LilyPond phase'
+    )
+    parser.add_argument(
+        '--optimize-pdf',
+        action='store_true',
+        help='Linearize and shrink PDFs with qpdf or Ghostscript'
+    )
+    parser.add_argument(
+        '--pdf-tool',
+        choices=mupub.pdfopt.TOOLS,
+        help='PDF optimizer to use (default, the first installed)'
+    )
+    parser.add_argument(
+        '--optimize-preview',
+        action='store_true',
+        help='Minify the SVG or PNG preview image'
+    )
+    parser.add_argument(
+        '--bundle',
+        action='store_true',
+        help='Write all published files to a single bundle'
+    )
+    parser.add_argument(
+        '--jsonld',
+        action='store_true',
+        help='Also write the RDF description as JSON-LD'
+    )
 
     args = parser.parse_args(args)
     build(**vars(args))
@@ -7,15 +7,59 @@ import argparse
 import logging
 import os
 import sqlite3
+import tempfile
 from clint.textui import colored, puts, indent
 import mupub
 
 
-def check(infile, header_file):
+def _compile_check(lily_path, infile, timeout):
+    """Compile infile without producing any output.
+
+    The null backend skips page output and Ghostscript conversion so
+    the compile is a fraction of the cost of a build. The compile is
+    done in a temporary folder so that MIDI files are not left behind.
+
+    :param str lily_path: Path to the LilyPond script.
+    :param str infile: The LilyPond file to compile.
+    :param int timeout: Seconds before the compile is abandoned.
+    :returns: True if the file compiled without errors.
+
+    """
+    infile = os.path.abspath(infile)
+    command = [lily_path,
+               '-dno-point-and-click',
+               '-dbackend=null',
+               '--include=' + os.path.dirname(infile),
+               infile]
+    puts(colored.green('Compiling %s with the null backend' % os.path.basename(infile)))
+    with tempfile.TemporaryDirectory(prefix='mupub_') as workdir:
+        lyrun = mupub.LyRunner().run(command, cwd=workdir, timeout=timeout)
+
+    with indent(4):
+        for msg in lyrun.progress.messages:
+            if msg.is_error():
+                puts(colored.red(str(msg)))
+            else:
+                puts(colored.yellow(str(msg)))
+
+    if lyrun.timed_out:
+        puts(colored.red('Compile abandoned after %d seconds.' % timeout))
+    elif lyrun.succeeded():
+        puts(colored.green('Compiled in %.1f seconds with %d warning(s).'
+                           % (lyrun.wall, len(lyrun.progress.warnings()))))
+    else:
+        puts(colored.red('Compile failed with %d error(s).'
+                         % len(lyrun.progress.errors())))
+    return lyrun.succeeded()
+
+
+def check(infile, header_file, do_compile=False, timeout=300):
     """Check sanity for a given contributed file.
 
     :param [str] infile: Input file list.
     :param str header_file: The file containing the header.
+    :param bool do_compile: Also compile the file with the null backend.
+    :param int timeout: Seconds before a compile is abandoned.
 
     The routine does not return True or False, but simply reports
     information on various checks made to the input files. This should
@@ -67,6 +111,8 @@ def check(infile, header_file):
             path = locator.working_path()
             if path:
                 puts(colored.green('LilyPond compiler will be %s' % path))
+                if do_compile and not _compile_check(path, infile, timeout):
+                    return
             else:
                 puts(colored.red('Failed to determine (or install) compiler.'))
         except mupub.BadConfiguration as bc:
@@ -89,6 +135,18 @@ def main(args):
         '--header-file',
         help='lilypond file that contains the header'
     )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        dest='do_compile',
+        help='Compile the file with the null backend to find errors'
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=300,
+        help='Seconds to allow for a compile (default 300)'
+    )
 
     args = parser.parse_args(args)
 
@@ -11,6 +11,7 @@ import mupub
 _DEATHROW = [
     '*.preview.*',
     '*-preview.*',
+    '*-preview-*w.png',
     '*.mid',
     '*.midi',
     '*-mids.zip',
@@ -20,7 +21,12 @@ _DEATHROW = [
     '*-pss.zip',
     '*-lys.zip',
     '*.rdf',
+    '*.jsonld',
     '*.log',
+    '*-checkpoint.json',
+    '*-archives.json',
+    '*-digests.json',
+    '*-bundle.tar',
 ]
 
 
@@ -0,0 +1,221 @@
+"""Compilers module, implementing the compilers entry point.
+
+Manages the local cache of |LilyPond| compilers. ``prefetch``
+installs, ahead of any build, every compiler the pieces under a
+folder need, so that a fresh build node does not stall on the first
+build of an old piece. ``list`` reports what is cached. ::
+
+  $ mupub compilers prefetch ~/MutopiaProject/ftp
+  $ mupub compilers list
+
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import os
+import threading
+import time
+from clint.textui import colored, puts, indent
+import mupub
+
+
+def _piece_version(folder):
+    """Find the |LilyPond| version of a piece, None if not given.
+
+    The main file is read first, then the files of a ``-lys``
+    folder.
+
+    """
+    base = os.path.basename(folder)
+    candidates = [os.path.join(folder, base+'.ly')]
+    lys = os.path.join(folder, base+'-lys')
+    if os.path.isdir(lys):
+        candidates += [path for path in sorted(mupub.utils.find_files(lys))
+                       if path.endswith(('.ly', '.ily'))]
+    loader = mupub.VersionLoader()
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        try:
+            version = loader.load(path).get('lilypondVersion')
+        except (OSError, UnicodeDecodeError):
+            continue
+        if version:
+            return version
+    return None
+
+
+def needed_versions(top):
+    """Collect the compiler versions needed by the pieces in a folder.
+
+    :param str top: folder to search for pieces.
+    :returns: version to the number of pieces needing it. Versions
+              differing only in a build number are counted together.
+    :rtype: dict
+
+    """
+    logger = logging.getLogger(__name__)
+    needed = {}
+    for folder in mupub.utils.find_pieces(top):
+        version = _piece_version(folder)
+        if not version:
+            continue
+        try:
+            lyversion = mupub.LyVersion(version)
+        except ValueError:
+            logger.warning('%s: invalid version %s, skipped' % (folder, version))
+            continue
+        if lyversion.is_valid():
+            needed[lyversion] = needed.get(lyversion, 0) + 1
+    return needed
+
+
+def _report():
+    """List the cached compilers."""
+    registry = mupub.lyregistry.compiler_registry()
+    fmt = '{0:<12} {1:<20} {2}'
+    with indent(4):
+        puts(fmt.format('version', 'installed', 'script'))
+        for version in registry.versions():
+            entry = registry.get(version)
+            installed = ''
+            if 'installed' in entry:
+                installed = datetime.datetime.fromtimestamp(
+                    entry['installed']).strftime('%Y-%m-%d %H:%M')
+            puts(fmt.format(entry['folder'], installed,
+                            os.path.basename(entry.get('script', ''))))
+    puts(colored.green('{} compilers cached in {}'.format(
+        len(registry), registry.cache)))
+
+
+def prefetch(top, jobs=4, installs=1):
+    """Install the compilers needed by the pieces under a folder.
+
+    Install scripts are downloaded concurrently. Running them
+    unpacks a few hundred megabytes each, so at most ``installs``
+    run at once, each queued as soon as its download completes. The
+    installs have a pool of their own so that downloads never wait
+    for them.
+
+    The connections of all downloads, ``jobs`` times the ranges of
+    each, are kept within the pool of the shared HTTP session,
+    :py:data:`~mupub.utils.HTTP_POOL_SIZE`.
+
+    :param str top: folder to search for pieces.
+    :param int jobs: concurrent downloads.
+    :param int installs: concurrent installs.
+    :returns: the versions that could not be installed.
+    :rtype: list
+
+    """
+    logger = logging.getLogger(__name__)
+    sysname = os.uname().sysname.lower()
+    if sysname not in ['linux', 'freebsd']:
+        raise mupub.BadConfiguration('%s is not supported' % sysname)
+
+    start = time.time()
+    needed = needed_versions(top)
+    registry = mupub.lyregistry.compiler_registry()
+    missing = sorted(v for v in needed if v not in registry)
+    puts(colored.green('{0} pieces need {1} compilers, {2} to install'.format(
+        sum(needed.values()), len(needed), len(missing))))
+
+    pool_size = mupub.utils.HTTP_POOL_SIZE
+    jobs = min(max(jobs, 1), pool_size)
+    workers = min(mupub.CONFIG_DICT['common'].getint('download_workers', 4),
+                  pool_size // jobs)
+    installer = mupub.lily.LinuxInstaller(progress_bar=False,
+                                          workers=max(workers, 1))
+    failed = []
+    lock = threading.Lock()
+
+    def _result(version, future):
+        try:
+            return future.result()
+        except Exception as exc:
+            logger.warning('%s: %s' % (version, exc))
+            return None
+
+    def _done(version, installed):
+        with lock:
+            if installed:
+                puts(colored.green('Installed {}'.format(version)))
+            else:
+                puts(colored.red('Failed to install {}'.format(version)))
+                failed.append(version)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(installs, 1)) as install_pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            downloads = dict((pool.submit(installer.fetch_script, v), v)
+                             for v in missing)
+            for future in concurrent.futures.as_completed(downloads):
+                version = downloads[future]
+                fetched = _result(version, future)
+                if not fetched:
+                    _done(version, False)
+                    continue
+                install = install_pool.submit(installer.run_script,
+                                              version, fetched)
+                install.add_done_callback(
+                    lambda f, version=version: _done(version, _result(version, f)))
+
+    _report()
+    puts(colored.green('{0} installed, {1} failed, {2:.1f} seconds'.format(
+        len(missing) - len(failed), len(failed), time.time() - start)))
+    return sorted(failed)
+
+
+def compilers(action, top='.', jobs=4, installs=1):
+    """Manage the compiler cache.
+
+    :param str action: ``prefetch`` or ``list``.
+    :param str top: folder of pieces for ``prefetch``.
+    :param int jobs: concurrent downloads.
+    :param int installs: concurrent installs.
+
+    """
+    if action == 'prefetch':
+        try:
+            prefetch(top, jobs, installs)
+        except mupub.BadConfiguration as exc:
+            puts(colored.red(str(exc)))
+    else:
+        _report()
+
+
+def main(args):
+    """Entry point for compilers command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub compilers')
+    parser.add_argument(
+        'action',
+        choices=['prefetch', 'list'],
+        help='Install the compilers needed by pieces, or list those cached'
+    )
+    parser.add_argument(
+        'top',
+        nargs='?',
+        default='.',
+        help='Folder of pieces to prefetch for (default, current folder)'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=4,
+        help='Concurrent downloads (default, 4)'
+    )
+    parser.add_argument(
+        '--installs',
+        type=int,
+        default=1,
+        help='Concurrent installs (default, 1)'
+    )
+
+    args = parser.parse_args(args)
+    compilers(**vars(args))
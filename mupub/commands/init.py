@@ -78,7 +78,7 @@ def _update_tracker(conn):
     url = urllib.parse.urljoin(common['mutopia_url'],
                                'latestadditions.html')
     try:
-        req = requests.get(url)
+        req = mupub.utils.http_session().get(url)
         req.raise_for_status()
     except requests.RequestException as err:
         print("Request failure", err)
@@ -0,0 +1,112 @@
+"""Query module, implementing the query entry point.
+
+Searches the catalog of published pieces, built from the RDF files
+of the archive, ::
+
+  $ mupub query --composer SorF --instrument guitar
+  $ mupub query --version 2.18 --count
+
+"""
+
+import argparse
+import logging
+import os
+from clint.textui import colored, puts, indent
+import mupub
+
+
+def query(composer=None, instrument=None, version=None, licence=None,
+          title=None, top=None, no_update=False, count=False):
+    """Search the catalog of published pieces.
+
+    :param str composer: composer name, e.g. SorF.
+    :param str instrument: part of the instrument field.
+    :param str version: LilyPond version or version prefix.
+    :param str licence: part of the licence.
+    :param str title: part of the title.
+    :param str top: archive folder holding the RDF files, defaults to
+                    :py:data:`~mupub.core.FTP_BASE`.
+    :param bool no_update: search without updating the catalog.
+    :param bool count: only report the number of matching pieces.
+
+    The catalog is updated before the search, reading only the RDF
+    files that changed since the last update.
+
+    """
+    logger = logging.getLogger(__name__)
+    top = top or mupub.FTP_BASE
+    catalog = mupub.Catalog()
+    try:
+        if not no_update:
+            if not os.path.isdir(top):
+                logger.warning('Archive not found - %s' % top)
+            else:
+                read, removed, _ = catalog.update(top)
+                if read or removed:
+                    logger.info('Catalog updated, %d read, %d removed'
+                                % (read, removed))
+        rows = catalog.query(composer=composer,
+                             instrument=instrument,
+                             version=version,
+                             licence=licence,
+                             title=title)
+    finally:
+        catalog.close()
+
+    if not count:
+        fmt = '{0:<40} {1:<12} {2:<32} {3:<16} {4:>8}'
+        with indent(4):
+            puts(fmt.format('piece', 'composer', 'title', 'for', 'version'))
+            for row in rows:
+                puts(fmt.format(os.path.dirname(row['path'])[:40],
+                                (row['composer'] or '')[:12],
+                                (row['title'] or '')[:32],
+                                (row['for'] or '')[:16],
+                                row['lilypondVersion'] or ''))
+    puts(colored.green('{} pieces found'.format(len(rows))))
+
+
+def main(args):
+    """Entry point for query command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub query')
+    parser.add_argument(
+        '--composer',
+        help='Composer, e.g. SorF'
+    )
+    parser.add_argument(
+        '--instrument',
+        help='Part of the instrument (for) field'
+    )
+    parser.add_argument(
+        '--version',
+        help='LilyPond version, or prefix such as 2.18'
+    )
+    parser.add_argument(
+        '--licence',
+        help='Part of the licence'
+    )
+    parser.add_argument(
+        '--title',
+        help='Part of the title'
+    )
+    parser.add_argument(
+        '--top',
+        help='Archive folder (default, $MUTOPIA_BASE/ftp)'
+    )
+    parser.add_argument(
+        '--no-update',
+        action='store_true',
+        help='Search without updating the catalog'
+    )
+    parser.add_argument(
+        '--count',
+        action='store_true',
+        help='Only report the number of pieces found'
+    )
+
+    args = parser.parse_args(args)
+    query(**vars(args))
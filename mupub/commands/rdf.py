@@ -0,0 +1,215 @@
+"""RDF module, implementing the rdf entry point.
+
+Regenerates the RDF of pieces from their headers and the assets
+already present, without running |LilyPond|. Use it after the RDF
+layout changes or a header field is corrected, ::
+
+  $ mupub rdf            # the piece in the current folder
+  $ mupub rdf --all      # every piece in the archive
+
+The descriptions of every piece can also be exported in bulk, as
+N-Triples or JSON Lines of JSON-LD records, ::
+
+  $ mupub rdf --all --export jsonld --output pieces.jsonl
+
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from clint.textui import colored, puts
+import mupub
+
+# RDF elements describing assets, taken from the current RDF when
+# the asset itself is not in the piece folder.
+_ASSET_FIELDS = ['lyFile', 'midFile',
+                 'psFileA4', 'pdfFileA4',
+                 'psFileLet', 'pdfFileLet',
+                 'pngFile', 'pngHeight', 'pngWidth', 'pngSrcset']
+
+
+def _recorded_assets(rdf_path):
+    """Read the asset fields of an existing RDF."""
+    if not os.path.exists(rdf_path):
+        return {}
+    values = mupub.rdfu.read_rdf(rdf_path)
+    return dict((k, values[k]) for k in _ASSET_FIELDS if values.get(k))
+
+
+def _piece_header(folder, base):
+    """Find the valid header of a piece, None if there is none.
+
+    The header may be split over the source files or, as with the
+    build's ``--header-file``, kept alone in an include file.
+
+    """
+    srcdir = base+'-lys'
+    if not os.path.isdir(os.path.join(folder, srcdir)):
+        srcdir = '.'
+    candidates = [srcdir]
+    for name in sorted(os.listdir(os.path.join(folder, srcdir))):
+        if name.endswith(('.ily', '.lyi')):
+            candidates.append(os.path.join(srcdir, name))
+    for relpath in candidates:
+        header = mupub.find_header(relpath, folder)
+        if header and header.is_valid():
+            return header
+    return None
+
+
+def regenerate_rdf(folder):
+    """Regenerate the RDF of one piece.
+
+    The header is read from the piece's source files. Assets found
+    in the folder are used, others are kept from the existing RDF.
+    Any error is reported as a failure of the piece so that one bad
+    piece does not stop a run over the archive.
+
+    :param str folder: the piece folder.
+    :returns: (folder, error message or None, True if the RDF changed)
+    :rtype: tuple
+
+    """
+    try:
+        return _regenerate_rdf(folder)
+    except Exception as err:
+        return folder, '{0}: {1}'.format(type(err).__name__, err), False
+
+
+def _regenerate_rdf(folder):
+    logger = logging.getLogger(__name__)
+    base = os.path.basename(os.path.abspath(folder))
+    try:
+        header = _piece_header(folder, base)
+    except (OSError, UnicodeDecodeError) as err:
+        return folder, str(err), False
+    if not header:
+        return folder, 'invalid or missing header', False
+
+    rdf_path = os.path.join(folder, base+'.rdf')
+    try:
+        assets = _recorded_assets(rdf_path)
+    except ET.ParseError as err:
+        assets = {}
+        logger.warning('%s: %s' % (rdf_path, err))
+    assets.update(mupub.existing_assets(base, folder))
+    for field in _ASSET_FIELDS:
+        assets.setdefault(field, 'empty')
+    try:
+        changed = header.write_rdf(rdf_path, assets)
+    except OSError as err:
+        return folder, str(err), False
+    return folder, None, changed
+
+
+def _export(top, fmt, output):
+    """Export the RDF files below top to output, stdout if None."""
+    start = time.time()
+    if output:
+        with open(output, 'w', encoding='utf-8') as outfile:
+            exported, failed = mupub.rdfu.export_rdf(top, outfile, fmt)
+    else:
+        exported, failed = mupub.rdfu.export_rdf(top, sys.stdout, fmt)
+    # keep the report off an exported stream
+    sys.stderr.write('{0} pieces exported, {1} failed, {2:.1f} seconds\n'
+                     .format(exported, failed, time.time() - start))
+
+
+def rdf(folders, all_pieces=False, jobs=None, export=None, output=None):
+    """Regenerate or export RDF files.
+
+    :param folders: piece folders, the current folder if empty.
+    :param bool all_pieces: regenerate every piece in the archive,
+                            :py:data:`~mupub.core.FTP_BASE`.
+    :param int jobs: worker processes, defaults to the CPU count.
+    :param str export: instead of regenerating, export the RDF files
+                       in this format, one of
+                       :py:data:`~mupub.rdfu.EXPORT_FORMATS`. The
+                       archive is exported with ``all_pieces``,
+                       otherwise the pieces below the given folder.
+    :param str output: export file, defaults to standard output.
+
+    Pieces are processed on a pool of worker processes since header
+    parsing is pure Python work.
+
+    """
+    logger = logging.getLogger(__name__)
+    if all_pieces:
+        # the archive searched by the query command
+        top = mupub.FTP_BASE
+        if not os.path.isdir(top):
+            logger.error('Archive not found - %s' % top)
+            return
+        if export:
+            _export(top, export, output)
+            return
+        folders = mupub.utils.find_pieces(top)
+    elif export:
+        if len(folders) > 1:
+            logger.error('Export one folder, or the archive with --all')
+            return
+        _export(folders[0] if folders else '.', export, output)
+        return
+    elif len(folders) < 1:
+        folders = ['.']
+
+    start = time.time()
+    failures = changes = 0
+    if len(folders) == 1:
+        results = [regenerate_rdf(folders[0])]
+    else:
+        puts(colored.green('Regenerating {} RDF files'.format(len(folders))))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(regenerate_rdf, folders, chunksize=16))
+    for folder, error, changed in results:
+        if error:
+            failures += 1
+            puts(colored.red('{0}: {1}'.format(folder, error)))
+        elif changed:
+            changes += 1
+    puts(colored.green('{0} RDF files written, {1} changed, {2} failed, {3:.1f} seconds'
+                       .format(len(results) - failures, changes, failures,
+                               time.time() - start)))
+
+
+def main(args):
+    """Entry point for rdf command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub rdf')
+    parser.add_argument(
+        'folders',
+        nargs='*',
+        default=[],
+        help='Piece folders (default, the current folder)'
+    )
+    parser.add_argument(
+        '--all',
+        dest='all_pieces',
+        action='store_true',
+        help='Regenerate every piece in the archive ($MUTOPIA_BASE/ftp)'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='Worker processes (default, one per CPU)'
+    )
+    parser.add_argument(
+        '--export',
+        choices=mupub.rdfu.EXPORT_FORMATS,
+        help='Export the RDF files instead of regenerating them'
+    )
+    parser.add_argument(
+        '--output',
+        help='Export file (default, standard output)'
+    )
+
+    args = parser.parse_args(args)
+    rdf(**vars(args))
@@ -0,0 +1,107 @@
+"""Stats module, implementing the stats entry point.
+
+Reports on the build telemetry recorded by the build command.
+
+"""
+
+import argparse
+import logging
+import os
+from clint.textui import colored, puts, indent
+import mupub
+
+
+def _report_slowest(store, limit):
+    puts(colored.green('Slowest pieces (average seconds per LilyPond run)'))
+    with indent(4):
+        fmt = '{0:<32} {1:>5} {2:>8} {3:>8} {4:>10}'
+        puts(fmt.format('run', 'runs', 'avg', 'max', 'rss (KB)'))
+        for piece, label, runs, avg_wall, max_wall, max_rss in store.slowest(limit):
+            puts(fmt.format(label[:32], runs, '%.2f' % avg_wall,
+                            '%.2f' % max_wall, max_rss))
+
+
+def _report_regressions(store, threshold):
+    puts(colored.green('Regressions between compiler versions'))
+    with indent(4):
+        rows = store.regressions(threshold)
+        if len(rows) < 1:
+            puts('None found.')
+            return
+        fmt = '{0:<32} {1:>10} {2:>10} {3:>8} {4:>8} {5:>6}'
+        puts(fmt.format('run', 'from', 'to', 'old', 'new', 'ratio'))
+        for piece, label, old, new, old_wall, new_wall, ratio in rows:
+            puts(fmt.format(label[:32], old, new, '%.2f' % old_wall,
+                            '%.2f' % new_wall, '%.2f' % ratio))
+
+
+def _report_trends(store):
+    puts(colored.green('Time per page by month'))
+    with indent(4):
+        fmt = '{0:<8} {1:>10} {2:>5} {3:>10}'
+        puts(fmt.format('month', 'compiler', 'runs', 'sec/page'))
+        for month, compiler, runs, per_page in store.page_trends():
+            puts(fmt.format(month, compiler, runs, '%.3f' % per_page))
+
+
+def stats(slowest, regressions, trends, threshold):
+    """Report on recorded build telemetry.
+
+    :param int slowest: number of slowest pieces to list.
+    :param bool regressions: only list compiler regressions.
+    :param bool trends: only list time per page trends.
+    :param float threshold: slow-down ratio considered a regression.
+
+    With no report selected, all reports are shown.
+
+    """
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(mupub.telemetry.getTelemetryPath()):
+        logger.warning('No telemetry has been recorded yet.')
+        return
+
+    show_all = not (regressions or trends)
+    store = mupub.Telemetry()
+    try:
+        if show_all:
+            _report_slowest(store, slowest)
+        if show_all or regressions:
+            _report_regressions(store, threshold)
+        if show_all or trends:
+            _report_trends(store)
+    finally:
+        store.close()
+
+
+def main(args):
+    """Entry point for stats command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub stats')
+    parser.add_argument(
+        '--slowest',
+        type=int,
+        default=10,
+        help='Number of slowest pieces to list'
+    )
+    parser.add_argument(
+        '--regressions',
+        action='store_true',
+        help='Only report slow-downs between compiler versions'
+    )
+    parser.add_argument(
+        '--trends',
+        action='store_true',
+        help='Only report time per page trends'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.1,
+        help='Slow-down ratio reported as a regression (default 1.1)'
+    )
+
+    args = parser.parse_args(args)
+    stats(**vars(args))
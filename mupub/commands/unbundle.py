@@ -0,0 +1,87 @@
+"""Unbundle module, implementing the unbundle entry point.
+
+Lists or extracts members of a publication bundle made by ``mupub
+build --bundle``. Members are located through the bundle's index so
+extracting one file reads only that file's data, ::
+
+  $ mupub unbundle piece-bundle.tar piece.rdf
+
+"""
+
+import argparse
+import logging
+import os
+from clint.textui import colored, puts, indent
+import mupub
+
+
+def unbundle(bundle, members, dest='.', list_only=False):
+    """Extract members of a bundle.
+
+    :param str bundle: the bundle file.
+    :param members: names of members to extract, all if empty.
+    :param str dest: folder to extract into, created if needed.
+    :param bool list_only: list the members instead of extracting.
+
+    """
+    logger = logging.getLogger(__name__)
+    with open(bundle, 'rb') as bfile:
+        try:
+            index = mupub.bundle.read_index(bfile)
+        except ValueError as err:
+            logger.error('%s: %s' % (bundle, err))
+            return
+
+        if list_only:
+            with indent(4):
+                for entry in sorted(index.values(), key=lambda e: e['offset']):
+                    puts('{0:>10} {1}'.format(entry['size'], entry['name']))
+            return
+
+        os.makedirs(dest, exist_ok=True)
+        if len(members) < 1:
+            members = sorted(index, key=lambda name: index[name]['offset'])
+        for name in members:
+            if name not in index:
+                puts(colored.red('{} is not in the bundle'.format(name)))
+                continue
+            # never write outside of dest
+            target = os.path.join(dest, os.path.basename(name))
+            try:
+                mupub.bundle.extract_member(bfile, index[name], target)
+                puts(colored.green('extracted {}'.format(target)))
+            except ValueError as err:
+                logger.error(err)
+
+
+def main(args):
+    """Entry point for unbundle command.
+
+    :param args: unparsed arguments from the command line.
+
+    """
+    parser = argparse.ArgumentParser(prog='mupub unbundle')
+    parser.add_argument(
+        'bundle',
+        help='Bundle file to read'
+    )
+    parser.add_argument(
+        'members',
+        nargs='*',
+        default=[],
+        help='Members to extract (default, all)'
+    )
+    parser.add_argument(
+        '--dest',
+        default='.',
+        help='Folder to extract into'
+    )
+    parser.add_argument(
+        '--list',
+        dest='list_only',
+        action='store_true',
+        help='List the members and their sizes'
+    )
+
+    args = parser.parse_args(args)
+    unbundle(**vars(args))
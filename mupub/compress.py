@@ -0,0 +1,363 @@
+"""Compression policy for published assets.
+
+The method and level used to compress each type of asset is set in
+the ``[compression]`` section of the configuration file. Each entry
+is a method name optionally followed by a level, ::
+
+    [compression]
+      ly = deflate:9
+      midi = deflate:9
+      ps = deflate:6
+      pdf = store
+
+Methods are ``store``, ``deflate``, ``bzip2`` and ``lzma``. Note that
+many unzip tools do not support ``bzip2`` or ``lzma`` members.
+Single PostScript files are gzipped, which always uses deflate; only
+the level applies.
+
+Large files are gzipped in parallel: the input is split into blocks
+that are deflated on a thread pool and concatenated into a single
+standard gzip member, in the manner of pigz. The size above which
+this is done is set with ``parallel_threshold`` (bytes) in the same
+section.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import concurrent.futures
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import time
+import zipfile
+import zlib
+import mupub
+
+METHODS = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+# PDFs are already compressed internally.
+DEFAULT_POLICY = {
+    'ly': 'deflate:9',
+    'midi': 'deflate:9',
+    'ps': 'deflate:6',
+    'pdf': 'store',
+}
+
+_DEFAULT_GZIP_LEVEL = 9
+
+PARALLEL_THRESHOLD = 16 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+# Each block is primed with the tail of its predecessor.
+_DICT_SIZE = 32 * 1024
+# Largest zip member hashed as written, see ZipHashingWriter.
+HOLD_LIMIT = 64 * 1024 * 1024
+
+
+def parse_policy(value):
+    """Parse a policy entry.
+
+    :param str value: method name, optionally followed by ``:level``.
+    :returns: (zipfile method, level) where level may be None.
+    :rtype: tuple
+    :raises: ValueError on an unknown method or bad level.
+
+    """
+    method, _, level = value.strip().partition(':')
+    method = method.strip().lower()
+    if method not in METHODS:
+        raise ValueError('Unknown compression method - {}'.format(method))
+    if level.strip():
+        return METHODS[method], int(level)
+    return METHODS[method], None
+
+
+def compression_policy(asset_type):
+    """Return the configured compression for an asset type.
+
+    :param str asset_type: one of 'ly', 'midi', 'ps', 'pdf'.
+    :returns: (zipfile method, level) where level may be None.
+    :rtype: tuple
+
+    """
+    value = DEFAULT_POLICY.get(asset_type, 'deflate')
+    if 'compression' in mupub.CONFIG_DICT:
+        value = mupub.CONFIG_DICT['compression'].get(asset_type, value)
+    try:
+        return parse_policy(value)
+    except ValueError as err:
+        logger = logging.getLogger(__name__)
+        logger.warning('%s, check [compression] %s in config.' % (err, asset_type))
+        return parse_policy(DEFAULT_POLICY.get(asset_type, 'deflate'))
+
+
+def open_zip(zip_name, asset_type):
+    """Open a zip file for writing with the asset type's policy.
+
+    :param zip_name: zip file name, or binary file object, to write.
+    :param str asset_type: one of 'ly', 'midi', 'ps', 'pdf'.
+    :rtype: zipfile.ZipFile
+
+    """
+    method, level = compression_policy(asset_type)
+    return zipfile.ZipFile(zip_name, 'w',
+                           compression=method,
+                           compresslevel=level)
+
+
+def gzip_level(asset_type):
+    """Return the gzip level for an asset type.
+
+    gzip only supports deflate, ``store`` maps to level 0.
+
+    :param str asset_type: one of 'ly', 'midi', 'ps', 'pdf'.
+    :rtype: int
+
+    """
+    method, level = compression_policy(asset_type)
+    if method == zipfile.ZIP_STORED:
+        return 0
+    if method != zipfile.ZIP_DEFLATED or level is None:
+        return _DEFAULT_GZIP_LEVEL
+    return level
+
+
+def _deflate_block(block, level, zdict, last):
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # A sync flush ends the block on a byte boundary so that the next
+    # block's deflate stream can simply be appended.
+    flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(flush)
+
+
+class HashingWriter():
+    """A write-through file wrapper computing SHA-256 and size.
+
+    The wrapper is deliberately not seekable, so that a writer such
+    as :class:`gzip.GzipFile` produces its output strictly in order,
+    allowing the digest to be computed without reading the file back.
+    It is not used for zip files, which :class:`zipfile.ZipFile`
+    then writes with a data descriptor after every member, see
+    :py:class:`ZipHashingWriter`.
+
+    """
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._sha = hashlib.sha256()
+        self.size = 0
+        self.name = getattr(fileobj, 'name', '')
+
+    def write(self, data):
+        self._sha.update(data)
+        self.size += len(data)
+        return self._fileobj.write(data)
+
+    def tell(self):
+        return self.size
+
+    def seek(self, *args):
+        raise OSError('HashingWriter is not seekable')
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def hexdigest(self):
+        """Return the SHA-256 of everything written."""
+        return self._sha.hexdigest()
+
+
+class ZipHashingWriter():
+    """A seekable write-through file wrapper computing SHA-256 and size.
+
+    Writing to a seekable file, :class:`zipfile.ZipFile` seeks back
+    once each member is written to fill in the CRC and sizes of its
+    local header, then seeks to the end of the file to carry on.
+    Only the bytes written since the last seek to the end of the file
+    can still change, these are held until the next such seek and
+    everything before them is hashed.
+
+    At most one member is held in memory. A member larger than
+    ``limit``, or a seek back before the held bytes, gives up the
+    digest; :py:meth:`digest` then returns None and the file must be
+    read back.
+
+    """
+    def __init__(self, fileobj, limit=HOLD_LIMIT):
+        self._fileobj = fileobj
+        self._sha = hashlib.sha256()
+        self._hashed = 0
+        self._held = bytearray()
+        self._limit = limit
+        self._pos = fileobj.tell()
+        self._valid = self._pos == 0
+        self.size = self._pos
+        self.name = getattr(fileobj, 'name', '')
+
+    def _hash_held(self):
+        self._sha.update(self._held)
+        self._hashed += len(self._held)
+        self._held = bytearray()
+
+    def write(self, data):
+        if self._valid:
+            if self._pos < self._hashed:
+                self._valid = False
+            else:
+                start = self._pos - self._hashed
+                self._held[start:start+len(data)] = data
+                if len(self._held) > self._limit:
+                    self._valid = False
+            if not self._valid:
+                self._held = bytearray()
+        written = self._fileobj.write(data)
+        self._pos += len(data)
+        self.size = max(self.size, self._pos)
+        return written
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._pos = self._fileobj.seek(offset, whence)
+        if self._valid and self._pos == self.size:
+            self._hash_held()
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def truncate(self, size=None):
+        size = self._fileobj.truncate(size)
+        if size < self.size:
+            if size < self._hashed:
+                self._valid = False
+                self._held = bytearray()
+            else:
+                del self._held[size-self._hashed:]
+            self.size = size
+        return size
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def digest(self):
+        """Return the SHA-256 and size of everything written.
+
+        :returns: (sha256, size), None if the digest was given up.
+        :rtype: tuple
+
+        """
+        if not self._valid:
+            return None
+        self._hash_held()
+        return self._sha.hexdigest(), self.size
+
+
+def _parallel_gzip(infile, outfile, fname, level, block_size, max_workers,
+                   mtime):
+    header = struct.pack('<BBBBLBB', 0x1f, 0x8b, 8, 0x08,
+                         int(mtime), 0, 255) + fname + b'\0'
+    crc = 0
+    size = 0
+    pending = []
+    outfile.write(header)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        zdict = b''
+        block = infile.read(block_size)
+        while True:
+            next_block = infile.read(block_size)
+            last = len(next_block) == 0
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pending.append(pool.submit(_deflate_block, block, level,
+                                       zdict, last))
+            # Bound the amount of data held in memory.
+            while len(pending) > max_workers * 2:
+                outfile.write(pending.pop(0).result())
+            if last:
+                break
+            zdict = block[-_DICT_SIZE:]
+            block = next_block
+        for future in pending:
+            outfile.write(future.result())
+    outfile.write(struct.pack('<LL', crc & 0xffffffff, size & 0xffffffff))
+
+
+def parallel_gzip(in_path, out_path, level=_DEFAULT_GZIP_LEVEL,
+                  block_size=BLOCK_SIZE, max_workers=None, mtime=None):
+    """Gzip a file using a thread pool.
+
+    The file is read in blocks that are compressed independently as
+    raw deflate streams and written, in order, as the body of a single
+    gzip member. The CRC is computed on the reading thread. The
+    result is readable by any gzip implementation.
+
+    :param str in_path: file to compress.
+    :param out_path: gzip file name, or binary file object, to write.
+    :param int level: deflate level.
+    :param int block_size: uncompressed bytes per block.
+    :param int max_workers: threads to use, defaults to the CPU count.
+    :param int mtime: header timestamp, defaults to the current time.
+
+    """
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    if mtime is None:
+        mtime = time.time()
+    fname = os.path.basename(in_path).encode('latin-1', 'replace')
+    with open(in_path, 'rb') as infile:
+        if hasattr(out_path, 'write'):
+            _parallel_gzip(infile, out_path, fname, level,
+                           block_size, max_workers, mtime)
+        else:
+            with open(out_path, 'wb') as outfile:
+                _parallel_gzip(infile, outfile, fname, level,
+                               block_size, max_workers, mtime)
+
+
+def gzip_file(in_path, out_path, level=_DEFAULT_GZIP_LEVEL):
+    """Gzip a file, in parallel if it is large.
+
+    The header timestamp is left zero so that the same input always
+    gives the same gzip file.
+
+    :param str in_path: file to compress.
+    :param str out_path: gzip file to write.
+    :param int level: deflate level.
+    :returns: SHA-256 and size of the gzip file, computed as written.
+    :rtype: tuple
+
+    """
+    threshold = PARALLEL_THRESHOLD
+    if 'compression' in mupub.CONFIG_DICT:
+        threshold = mupub.CONFIG_DICT['compression'].getint('parallel_threshold',
+                                                            threshold)
+    with open(out_path, 'wb') as outfile:
+        writer = HashingWriter(outfile)
+        # Threads only pay off with more than one processor.
+        if (os.cpu_count() or 1) > 1 and os.path.getsize(in_path) >= threshold:
+            parallel_gzip(in_path, writer, level, mtime=0)
+        else:
+            with open(in_path, 'rb') as f_in:
+                with gzip.GzipFile(filename=os.path.basename(in_path),
+                                   mode='wb',
+                                   compresslevel=level,
+                                   fileobj=writer,
+                                   mtime=0) as gz_out:
+                    shutil.copyfileobj(f_in, gz_out)
+    return writer.hexdigest(), writer.size
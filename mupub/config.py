@@ -11,6 +11,7 @@ import os
 import logging
 import configparser
 import mupub
+from .compress import DEFAULT_POLICY, PARALLEL_THRESHOLD
 
 CONFIG_DIR = os.path.expanduser('~/.mupub')
 _CONFIG_FNM = os.path.join(CONFIG_DIR, 'mu-config.cfg')
@@ -26,6 +27,10 @@ _CONFIG_DEFAULT = """
   download_url_fallback = http://lilypond.org/downloads/binaries/
   mutopia_url = http://www.mutopiaproject.org/
   preview_fnm = preview.svg
+  telemetry_db = mu-telemetry.db
+  catalog_db = mu-catalog.db
+  index_ttl = 86400
+  download_workers = 4
 [logging]
   log_to_file = True
   logfilename = mupub-errors.log
@@ -35,6 +40,17 @@ _CONFIG_DEFAULT = """
 # This is a hack to add new keys to the configuration.
 _new_common = {
     'download_url_fallback': 'http://lilypond.org/downloads/binaries/',
+    'telemetry_db': 'mu-telemetry.db',
+    'catalog_db': 'mu-catalog.db',
+    'index_ttl': '86400',
+    'download_workers': '4',
+}
+
+# New sections are added with their defaults, to a new configuration
+# as well.
+_new_sections = {
+    'compression': dict(DEFAULT_POLICY,
+                        parallel_threshold=str(PARALLEL_THRESHOLD)),
 }
 
 def _configure():
@@ -63,6 +79,10 @@ def _configure():
         if ckey not in config['common']:
             config['common'][ckey] = _new_common[ckey]
             config_dirty = True
+    for section in iter(_new_sections):
+        if section not in config:
+            config.read_dict({section: _new_sections[section]})
+            config_dirty = True
 
     if config_dirty:
         with open(_CONFIG_FNM, 'w') as configfile:
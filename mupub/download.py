@@ -0,0 +1,296 @@
+"""Resumable downloads of large files.
+
+Compiler installers are over 100 MB. They are streamed to a
+``<name>.part`` file in 1 MiB blocks and hashed as they are
+written. An interrupted download leaves the partial file behind. The
+next attempt asks the server for the rest of it with an HTTP
+``Range`` request, and hashes the part already on disk first. The
+``ETag``, or ``Last-Modified`` time, of the file is kept next to the
+partial file in ``<name>.part.validator`` and sent as ``If-Range``,
+so that a file changed on the server since is fetched again whole
+rather than spliced onto stale data. Only a complete file, whose
+size matches the one announced by the server, is moved to its final
+name.
+
+When the server accepts ranges, a large file can also be fetched as
+several ranges at once, each written at its offset in the partial
+file, and hashed once complete. If any range fails, the file is
+fetched again as a single, resumable, stream.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+import threading
+import requests
+import mupub
+
+CHUNK_SIZE = 1 << 20
+# smallest file worth fetching as parallel ranges
+PARALLEL_THRESHOLD = 16 * CHUNK_SIZE
+# times a download is resumed after an interruption
+ATTEMPTS = 3
+
+# content encoding would change the size and break ranges
+_IDENTITY = {'Accept-Encoding': 'identity'}
+_CONTENT_RANGE_RE = re.compile(r'bytes (?:(\d+)-\d+|\*)/(\d+)')
+
+
+def file_digest(path, sha=None):
+    """Return the SHA-256 object of a file's content.
+
+    :param str path: the file.
+    :param sha: a hash object to update, a new SHA-256 if None.
+
+    """
+    sha = sha or hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(CHUNK_SIZE), b''):
+            sha.update(block)
+    return sha
+
+
+def verify(path, sha256):
+    """Check a file against its SHA-256.
+
+    :param str path: the file.
+    :param str sha256: expected hexadecimal digest.
+    :rtype: boolean
+
+    """
+    return file_digest(path).hexdigest() == sha256
+
+
+def _total_size(resp):
+    """The full size of the resource from a response, None if unknown."""
+    match = _CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(2))
+    if resp.status_code == 200 and 'Content-Length' in resp.headers:
+        return int(resp.headers['Content-Length'])
+    return None
+
+
+def _range_start(resp):
+    """The first byte of a partial response, None if unknown."""
+    match = _CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+    if match and match.group(1) is not None:
+        return int(match.group(1))
+    return None
+
+
+def _validator(resp):
+    """The value identifying this version of a resource for ``If-Range``.
+
+    Weak entity tags cannot be used with ``If-Range``.
+
+    """
+    etag = resp.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return resp.headers.get('Last-Modified')
+
+
+def _read_validator(part):
+    try:
+        with open(part + '.validator', 'r') as vfile:
+            return vfile.read().strip() or None
+    except OSError:
+        return None
+
+
+def _discard(part):
+    for path in (part, part + '.validator'):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _range_size(session, url):
+    """The size and validator of a resource if the server accepts
+    byte ranges, (None, None) otherwise."""
+    resp = session.head(url, headers=_IDENTITY, allow_redirects=True)
+    if resp.status_code != 200 or resp.headers.get('Accept-Ranges') != 'bytes':
+        return None, None
+    try:
+        return int(resp.headers['Content-Length']), _validator(resp)
+    except (KeyError, ValueError):
+        return None, None
+
+
+class _Progress():
+    """Thread safe byte count feeding a progress callback."""
+    def __init__(self, callback, total):
+        self.callback = callback
+        self.total = total
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.done += count
+            if self.callback:
+                self.callback(self.done, self.total)
+
+
+def _fetch_range(session, url, part, start, end, validator, progress):
+    headers = dict(_IDENTITY, Range='bytes={0}-{1}'.format(start, end))
+    if validator:
+        headers['If-Range'] = validator
+    with session.get(url, headers=headers, stream=True) as resp:
+        if resp.status_code != 206 or _range_start(resp) != start:
+            raise ValueError('{0}: range not served, status {1}'
+                             .format(url, resp.status_code))
+        fd = os.open(part, os.O_WRONLY)
+        try:
+            offset = start
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                progress.add(len(chunk))
+        finally:
+            os.close(fd)
+    if offset != end + 1:
+        raise ValueError('{0}: short range {1}-{2}'.format(url, start, end))
+
+
+def _fetch_ranges(session, url, part, total, validator, workers, progress):
+    """Fetch a resource as parallel ranges, returns its SHA-256."""
+    with open(part, 'wb') as outfile:
+        outfile.truncate(total)
+    step = -(-total // workers)
+    ranges = [(start, min(start + step, total) - 1)
+              for start in range(0, total, step)]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fetch_range, session, url, part,
+                                   start, end, validator, progress)
+                       for start, end in ranges]
+            for future in futures:
+                future.result()
+    except BaseException:
+        # the gaps of a failed parallel fetch cannot be resumed
+        os.unlink(part)
+        raise
+    return file_digest(part)
+
+
+def _fetch_stream(session, url, part, progress):
+    """Fetch, or resume, a resource in one stream.
+
+    :returns: (SHA-256 object, size, total size or None)
+
+    """
+    done = os.path.getsize(part) if os.path.exists(part) else 0
+    validator = _read_validator(part)
+    headers = dict(_IDENTITY)
+    if done and validator:
+        # a changed file is sent whole rather than as the range
+        headers['Range'] = 'bytes={}-'.format(done)
+        headers['If-Range'] = validator
+    with session.get(url, headers=headers, stream=True) as resp:
+        total = _total_size(resp)
+        if 'Range' in headers and resp.status_code == 416:
+            if total == done:
+                # the partial file was already complete
+                return file_digest(part), done, total
+            # the partial file is not of this resource, start again
+            _discard(part)
+            return None, 0, total
+        if ('Range' in headers and resp.status_code == 206
+                and _range_start(resp) != done):
+            logger = logging.getLogger(__name__)
+            logger.warning('%s: range not at %d, starting again' % (url, done))
+            _discard(part)
+            return None, 0, total
+        if 'Range' in headers and resp.status_code == 206:
+            logger = logging.getLogger(__name__)
+            logger.info('Resuming %s at %d bytes' % (url, done))
+            sha = file_digest(part)
+            mode = 'ab'
+        else:
+            resp.raise_for_status()
+            sha = hashlib.sha256()
+            done = 0
+            mode = 'wb'
+            validator = _validator(resp)
+            if validator:
+                with open(part + '.validator', 'w') as vfile:
+                    vfile.write(validator + '\n')
+            elif os.path.exists(part + '.validator'):
+                os.unlink(part + '.validator')
+        progress.total = total
+        progress.add(done)
+        with open(part, mode) as outfile:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                outfile.write(chunk)
+                sha.update(chunk)
+                done += len(chunk)
+                progress.add(len(chunk))
+    return sha, done, total
+
+
+def fetch(url, path, session=None, workers=1, callback=None,
+          attempts=ATTEMPTS):
+    """Download a file, resuming a previous partial download.
+
+    :param str url: the file to get.
+    :param str path: where to put it.
+    :param session: a requests compatible session, defaults to the
+                    shared :py:func:`~mupub.utils.http_session`.
+    :param int workers: ranges fetched at once for a new download of a
+                        large file from a server accepting ranges.
+    :param callback: called with (bytes done, total bytes or None) as
+                     data arrives, possibly from several threads.
+    :param int attempts: times the stream is requested, each attempt
+                         resuming where the last stopped.
+    :returns: (SHA-256 hex digest, size) of the file.
+    :rtype: tuple
+    :raises: requests.RequestException when the server cannot be
+             reached, ValueError if the file is incomplete.
+
+    """
+    session = session or mupub.utils.http_session()
+    part = path + '.part'
+    progress = _Progress(callback, None)
+    sha = None
+    if workers > 1 and not os.path.exists(part):
+        try:
+            total, validator = _range_size(session, url)
+            if total and total >= PARALLEL_THRESHOLD:
+                progress.total = total
+                sha = _fetch_ranges(session, url, part, total, validator,
+                                    workers, progress)
+                done = total
+        except (requests.RequestException, ValueError) as err:
+            logger = logging.getLogger(__name__)
+            logger.warning('%s: ranges failed, %s' % (url, err))
+            _discard(part)
+
+    attempt = 0
+    while sha is None:
+        attempt += 1
+        progress.done = 0
+        try:
+            sha, done, total = _fetch_stream(session, url, part, progress)
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as err:
+            if attempt >= attempts:
+                raise
+            logger = logging.getLogger(__name__)
+            logger.warning('%s interrupted, %s' % (url, err))
+            continue
+        if total is not None and done != total:
+            # the partial file is kept to resume from
+            if attempt >= attempts:
+                raise ValueError('{0}: incomplete, {1} of {2} bytes'
+                                 .format(url, done, total))
+            sha = None
+
+    os.replace(part, path)
+    _discard(part)
+    return sha.hexdigest(), done
@@ -314,12 +314,16 @@ class Header(object):
 
 
 
-    def write_rdf(self, path, assets=None):
+    def write_rdf(self, path, assets=None, sidecar=False):
         """Write the RDF to an XML file.
 
         :param str path: File path to write.
         :param assets: Dictionary block of name:value pairs containing
                        asset names.
+        :param bool sidecar: also write the description as JSON-LD,
+                             to the path with a ``.jsonld`` extension.
+        :returns: True if a file was written, False if unchanged.
+        :rtype: boolean
 
         """
         rdf = mupub.MuRDF()
@@ -336,7 +340,11 @@ class Header(object):
         if assets:
             for name,value in assets.items():
                 rdf.update_description(name, value)
-        rdf.write_xml(path)
+        changed = rdf.write_xml(path)
+        if sidecar:
+            jsonld_path = os.path.splitext(path)[0] + '.jsonld'
+            changed = rdf.write_jsonld(jsonld_path) or changed
+        return changed
 
 
 _LILYENDS = ('.ly', '.ily', '.lyi',)
@@ -367,7 +375,7 @@ def find_header(relpath, prefix='.'):
         # that may be header assignments in a file included from
         # another file.
         rawp = os.path.abspath(os.path.join(prefix, relpath))
-        if os.path.exists(rawp):
+        if os.path.isfile(rawp):
             logger.warning('Using raw loader')
             hdr.use(RawLoader())
             hdr.load_table(rawp)
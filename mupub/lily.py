@@ -4,14 +4,17 @@
 __docformat__ = 'reStructuredText'
 
 import abc
+import codecs
+import functools
 import logging
 import os
 import re
+import selectors
 import subprocess
 import tarfile
-import requests
+import time
 import http.client
-from bs4 import BeautifulSoup
+import requests
 from clint.textui import progress
 import mupub
 
@@ -21,22 +24,15 @@ COMPFMT = r'lilypond-.*\.sh'
 RE_SCRIPT = re.compile(r'lilypond-([\d\.\-]+)\..*\.sh')
 RE_VERSION = re.compile(r'(\d+)\.(\d+)\.(\d+)(-\d+)?')
 
-def _cached_compilers():
-    cache = []
-    for folder in os.listdir(LYCACHE):
-        if not os.path.isdir(os.path.join(LYCACHE, folder)):
-            continue
-        if RE_VERSION.match(folder):
-            cache.append(folder)
-    return cache
-
-
 _vfact = [100000, 100, 1, 0]
+@functools.total_ordering
 class LyVersion():
     """LilyPond version class.
 
     This class attempts to simplify version compares so that versions
-    can be easily sorted and managed.
+    can be easily sorted and managed. Versions are totally ordered
+    and hashable, equal versions (ignoring any trailing build number)
+    have equal hashes so that they can be used as dictionary keys.
 
     """
     def __init__(self, lp_version):
@@ -56,18 +52,30 @@ class LyVersion():
     def __str__(self):
         return self.version
 
+    def __repr__(self):
+        return 'LyVersion({!r})'.format(self.version)
+
     def __gt__(self, other):
         """Evaluate this > other using internal integer sortval."""
+        if not isinstance(other, LyVersion):
+            return NotImplemented
         return self.sortval > other.sortval
 
     def __lt__(self, other):
         """Evaluate this < other using internal integer sortval."""
+        if not isinstance(other, LyVersion):
+            return NotImplemented
         return self.sortval < other.sortval
 
     def __eq__(self, other):
         """Evaluate this == other using internal integer sortval."""
+        if not isinstance(other, LyVersion):
+            return NotImplemented
         return self.sortval == other.sortval
 
+    def __hash__(self):
+        return hash(self.sortval)
+
     def match(self, other):
         """Evaluate this == other using a simple string match."""
         return self.sortval == other.sortval
@@ -81,14 +89,18 @@ class LyVersion():
         return os.path.join(LYCACHE, self.version)
 
 
-    def get_install_script(self, cpu_descr):
+    def get_install_script(self, cpu_descr, index=None):
         """Retrieve the LilyPond installation script for this processor.
 
         Gets the name of the script on the LilyPond download
         repository. This routine does not perform download nor the
-        installation.
+        installation. The download listings are read through a
+        :py:class:`~mupub.lyindex.ListingCache`. If no script is
+        found, the cached listings are revalidated once and the
+        search repeated if any changed.
 
         :param cpu_descr: The name in the appropriate format.
+        :param index: listing cache, the default cache if None.
         :returns: A URL using HTTP protocol for the download script,
                   None if not found.
         :rtype: string
@@ -97,42 +109,337 @@ class LyVersion():
         logger = logging.getLogger(__name__)
         if not self.is_valid():
             return None
+        if index is None:
+            index = mupub.lyindex.ListingCache()
+
+        listings = []
+        script = self._find_script(cpu_descr, index, listings)
+        if script is None and any([index.revalidate(url) for url in listings]):
+            logger.info('Listings changed, searching again for %s' % self)
+            script = self._find_script(cpu_descr, index, [])
+        return script
+
 
+    def _find_script(self, cpu_descr, index, listings):
+        logger = logging.getLogger(__name__)
         # Check download_url then download_url_fallback
         for urltag in ['download_url', 'download_url_fallback',]:
             if urltag not in mupub.CONFIG_DICT['common']:
                 continue
             binurl = mupub.CONFIG_DICT['common'][urltag]
-            req = requests.get(binurl)
-            if req.status_code != 200:
+            links = index.links(binurl)
+            if links is None:
                 continue
+            listings.append(binurl)
             logger.info('Trying %s' % binurl)
 
-            compiler_page = BeautifulSoup(req.content, 'html.parser')
-            # Find the first link in the page that matches given cpu.
-            tlink = compiler_page.find(href=cpu_descr+'/')
-            if not tlink:
+            # The listing must have a folder for the given cpu.
+            if cpu_descr+'/' not in links:
                 continue
 
             bin_archive = binurl+cpu_descr+'/'
-            comp_page = BeautifulSoup(requests.get(bin_archive).content, 'html.parser')
-            # Filter to get only lilypond install scripts, then search for
-            # a match on the version.
-            href_re = re.compile(COMPFMT.format(cpu_descr))
-            for script in comp_page.find_all(href=href_re):
-                script_ref = script.contents[0]
-                script_m = RE_SCRIPT.match(script_ref)
-                if script_m and self.match(LyVersion(script_m.group(1))):
+            listings.append(bin_archive)
+            for version, script_ref in index.scripts(bin_archive).items():
+                if self.match(LyVersion(version)):
                     return bin_archive + script_ref
 
         return None
 
 
+# Progress markers LilyPond writes to stderr, one group per phase.
+_PHASE_RE = re.compile(
+    r'(?P<parsing>Parsing\.\.\.)'
+    r'|(?P<interpreting>Interpreting music\.\.\.)'
+    r'|(?P<preprocessing>Preprocessing graphical objects\.\.\.)'
+    r'|(?P<fitting>Finding the ideal number of pages\.\.\.'
+    r'|Fitting music on (?P<pages>\d+)(?: or \d+)? pages?\.\.\.)'
+    r'|(?P<drawing>Drawing systems\.\.\.)'
+    r'|(?P<output>Layout output to )'
+    r'|(?P<converting>Converting to )'
+)
+_MESSAGE_RE = re.compile(
+    r'^(?:(?P<file>[^:\n]+):(?P<line>\d+):(?P<column>\d+): )?'
+    r'(?P<kind>warning|error|fatal error|programming error): (?P<text>.*)$'
+)
+
+# Phases grouped for reporting, conversion is Ghostscript's share.
+LAYOUT_PHASES = ('preprocessing', 'fitting', 'drawing', 'output',)
+CONVERSION_PHASES = ('converting',)
+
+
+class LyMessage():
+    """A warning or error reported by LilyPond.
+
+    :ivar kind: 'warning', 'error', 'fatal error' or 'programming error'
+    :ivar file: source file, may be None.
+    :ivar line: line number in file, 0 if unknown.
+    :ivar column: column number in file, 0 if unknown.
+    :ivar text: message text.
+
+    """
+    def __init__(self, kind, text, file=None, line=0, column=0):
+        self.kind = kind
+        self.text = text
+        self.file = file
+        self.line = line
+        self.column = column
+
+    def is_error(self):
+        """True if this message is any type of error."""
+        return self.kind != 'warning'
+
+    def __str__(self):
+        if self.file:
+            return '{0}:{1}:{2}: {3}: {4}'.format(self.file, self.line,
+                                                 self.column, self.kind,
+                                                 self.text)
+        return '{0}: {1}'.format(self.kind, self.text)
+
+
+class LyProgress():
+    """Parse the LilyPond progress stream.
+
+    Text from LilyPond's stderr is passed to :py:meth:`feed` as it
+    arrives. Phase markers are timestamped when first seen, even on
+    a partial line, since LilyPond only ends a line like
+    ``Interpreting music...[8][16]`` when the phase is over. Warnings
+    and errors are parsed from complete lines.
+
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.end = None
+        self.phases = []
+        self.pages = 0
+        self.messages = []
+        self._line = ''
+        self._marks = 0
+
+    def _scan(self, line, when):
+        marks = list(_PHASE_RE.finditer(line))
+        for mark in marks[self._marks:]:
+            name = mark.lastgroup
+            if mark.group('pages'):
+                self.pages = int(mark.group('pages'))
+            # consecutive markers of the same phase are merged
+            if len(self.phases) < 1 or self.phases[-1][0] != name:
+                self.phases.append((name, when))
+        self._marks = len(marks)
+
+    def _message(self, line):
+        msg = _MESSAGE_RE.match(line.strip())
+        if msg:
+            self.messages.append(LyMessage(msg.group('kind'),
+                                           msg.group('text'),
+                                           msg.group('file'),
+                                           int(msg.group('line') or 0),
+                                           int(msg.group('column') or 0)))
+
+    def feed(self, text, when=None):
+        """Feed a chunk of the progress stream.
+
+        :param str text: stream text, need not end on a line boundary.
+        :param float when: time of arrival, defaults to the clock.
+
+        """
+        if when is None:
+            when = self.clock()
+        lines = (self._line + text).split('\n')
+        self._line = lines.pop()
+        for line in lines:
+            self._scan(line, when)
+            self._message(line)
+            self._marks = 0
+        self._scan(self._line, when)
+
+    def close(self, when=None):
+        """Mark the end of the stream."""
+        if when is None:
+            when = self.clock()
+        if self._line:
+            self._scan(self._line, when)
+            self._message(self._line)
+            self._line = ''
+        self.end = when
+
+    def durations(self):
+        """Return time spent in each phase.
+
+        Time before the first marker is reported as 'startup'. Phases
+        that repeat (several books or scores in one file) are summed.
+
+        :returns: phase name to seconds.
+        :rtype: dict
+
+        """
+        end = self.end if self.end is not None else self.clock()
+        marks = [('startup', self.start)] + self.phases + [(None, end)]
+        totals = {}
+        for (name, began), (_, ended) in zip(marks, marks[1:]):
+            totals[name] = totals.get(name, 0.0) + (ended - began)
+        return totals
+
+    def warnings(self):
+        """Return the warnings that were reported."""
+        return [m for m in self.messages if not m.is_error()]
+
+    def errors(self):
+        """Return the errors that were reported."""
+        return [m for m in self.messages if m.is_error()]
+
+
+class LyRun():
+    """The record of a single LilyPond invocation.
+
+    :ivar command: the command list that was run.
+    :ivar label: a short description of the run.
+    :ivar returncode: process exit status.
+    :ivar started: start time, seconds since the epoch.
+    :ivar wall: elapsed time in seconds.
+    :ivar progress: the parsed :py:class:`LyProgress`.
+    :ivar cpu_user: user CPU seconds of the child.
+    :ivar cpu_sys: system CPU seconds of the child.
+    :ivar max_rss: peak resident set size of the child in kilobytes.
+    :ivar outputs: files produced by the run, filled in by the caller.
+    :ivar timed_out: True if the run was killed for taking too long.
+
+    """
+    def __init__(self, command, label, returncode, wall, progress):
+        self.command = command
+        self.label = label
+        self.returncode = returncode
+        self.started = time.time() - wall
+        self.wall = wall
+        self.progress = progress
+        self.cpu_user = 0.0
+        self.cpu_sys = 0.0
+        self.max_rss = 0
+        self.outputs = []
+        self.timed_out = False
+
+    def succeeded(self):
+        """True if LilyPond completed with a zero status."""
+        return self.returncode == 0 and not self.timed_out
+
+
+def _exit_code(status):
+    """Decode a wait status as a return code, as subprocess does.
+
+    A process killed by a signal gives the negated signal number.
+
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+class LyRunner():
+    """Run LilyPond, parsing its progress stream as it runs.
+
+    Every invocation is kept in :py:attr:`runs` so that a command can
+    report on all the runs it made.
+
+    """
+    def __init__(self):
+        self.runs = []
+
+    def run(self, command, label=None, cwd=None, timeout=None):
+        """Run a LilyPond command.
+
+        :param command: command and arguments.
+        :param str label: short description for reports.
+        :param str cwd: working folder for the process.
+        :param float timeout: seconds to wait before killing the
+                              process, None to wait forever.
+        :returns: the record of the run.
+        :rtype: :py:class:`LyRun`
+
+        """
+        logger = logging.getLogger(__name__)
+        progress = LyProgress()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        proc = subprocess.Popen(command,
+                                cwd=cwd,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        timed_out = False
+        with proc, selectors.DefaultSelector() as selector:
+            stderr_fd = proc.stderr.fileno()
+            selector.register(stderr_fd, selectors.EVENT_READ)
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not selector.select(remaining):
+                        logger.warning('Killing LilyPond after %d seconds'
+                                       % timeout)
+                        proc.kill()
+                        timed_out = True
+                        break
+                chunk = os.read(stderr_fd, 8192)
+                if not chunk:
+                    break
+                progress.feed(decoder.decode(chunk))
+            progress.feed(decoder.decode(b'', final=True))
+            # Reap the child ourselves to get its resource usage.
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = _exit_code(status)
+        progress.close()
+
+        for msg in progress.messages:
+            logger.debug(str(msg))
+        lyrun = LyRun(command, label or os.path.basename(command[-1]),
+                      proc.returncode, progress.end - progress.start, progress)
+        lyrun.cpu_user = rusage.ru_utime
+        lyrun.cpu_sys = rusage.ru_stime
+        lyrun.max_rss = rusage.ru_maxrss
+        lyrun.timed_out = timed_out
+        self.runs.append(lyrun)
+        return lyrun
+
+
+def timing_report(runs):
+    """Summarize where time went across a set of LilyPond runs.
+
+    :param runs: list of :py:class:`LyRun` records.
+    :returns: report lines.
+    :rtype: [str]
+
+    """
+    lines = []
+    fmt = '{0:<28} {1:>8} {2:>8} {3:>8} {4:>8} {5:>5} {6:>5}'
+    lines.append(fmt.format('run', 'wall', 'music', 'layout',
+                            'convert', 'pages', 'warn'))
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for lyrun in runs:
+        phases = lyrun.progress.durations()
+        layout = sum(phases.get(p, 0.0) for p in LAYOUT_PHASES)
+        convert = sum(phases.get(p, 0.0) for p in CONVERSION_PHASES)
+        music = lyrun.wall - layout - convert
+        for i, val in enumerate([lyrun.wall, music, layout, convert]):
+            totals[i] += val
+        lines.append(fmt.format(lyrun.label[:28],
+                                '%.2f' % lyrun.wall,
+                                '%.2f' % music,
+                                '%.2f' % layout,
+                                '%.2f' % convert,
+                                lyrun.progress.pages,
+                                len(lyrun.progress.warnings())))
+    lines.append(fmt.format('total', *['%.2f' % t for t in totals], '', ''))
+    return lines
+
+
 class LyInstaller(metaclass=abc.ABCMeta):
     """Abstract class, defines protocol for installers.
     """
-    def __init__(self, progress_bar=False):
+    def __init__(self, progress_bar=False, workers=None):
         self.progress_bar = progress_bar
+        self.workers = workers
 
     @abc.abstractmethod
     def do_install(self, target, lyversion):
@@ -157,9 +464,8 @@ class LyInstaller(metaclass=abc.ABCMeta):
         if not lp_version.is_valid():
             return False
 
-        for folder in _cached_compilers():
-            if lp_version == LyVersion(folder):
-                return True
+        if lp_version in mupub.lyregistry.compiler_registry():
+            return True
 
         return self.do_install(lp_version)
 
@@ -167,26 +473,34 @@ class LyInstaller(metaclass=abc.ABCMeta):
     def download(self, script_url, output_path):
         """Download an installation script/tarfile
 
+        The download is resumed if a previous one was interrupted
+        and, for a large file on a server that accepts ranges, fetched
+        as parallel ranges, ``download_workers`` of them unless the
+        installer was given ``workers``. See
+        :py:func:`mupub.download.fetch`.
+
         :param script_url: location of the script
         :param output_path: output path
+        :returns: SHA-256 and size of the file, computed as it was
+                  written.
+        :rtype: tuple
 
         """
-        request = requests.get(script_url, stream=True)
-        print(request.status_code)
-        with open(output_path, 'wb') as out_script:
-            if self.progress_bar:
-                total_len = int(request.headers.get('content-length'))
-                for chunk in progress.bar(request.iter_content(chunk_size=1024),
-                                          expected_size=(total_len/1024) + 1):
-                    if chunk:
-                        out_script.write(chunk)
-                        out_script.flush()
-            else:
-                for chunk in request.iter_content(chunk_size=1024):
-                    if chunk:
-                        out_script.write(chunk)
-                        out_script.flush()
-
+        workers = self.workers
+        if not workers:
+            workers = mupub.CONFIG_DICT['common'].getint('download_workers', 4)
+        if not self.progress_bar:
+            return mupub.download.fetch(script_url, output_path,
+                                        workers=workers)
+
+        bar = progress.Bar(expected_size=1)
+        def _show(done, total):
+            bar.show(done >> 10, count=((total or done) >> 10) + 1)
+        try:
+            return mupub.download.fetch(script_url, output_path,
+                                        workers=workers, callback=_show)
+        finally:
+            bar.done()
 
 
     # cpu_type needs to be one of,
@@ -208,37 +522,88 @@ class LyInstaller(metaclass=abc.ABCMeta):
         return sys_info.sysname.lower(), cpu_type
 
 
+def _verified(path, digest_file):
+    """True if a file matches the SHA-256 recorded for it."""
+    if not (os.path.exists(path) and os.path.exists(digest_file)):
+        return False
+    with open(digest_file, 'r') as dfile:
+        return mupub.download.verify(path, dfile.read().strip())
+
+
 class LinuxInstaller(LyInstaller):
 
-    def __init__(self, progress_bar):
-        super().__init__(progress_bar)
+    def __init__(self, progress_bar, workers=None):
+        super().__init__(progress_bar, workers)
 
-    def do_install(self, lyversion):
-        """Concrete method of abstract parent.
+    def fetch_script(self, lyversion):
+        """Get the install script for a version.
 
-        Perform a linux install.
+        A script kept from an earlier install is used if it still
+        matches the digest recorded when it was downloaded.
 
         :param lyversion: LilyPond version
+        :returns: (script URL, local path, SHA-256), None if there is
+                  no script or the download failed.
+        :rtype: tuple
 
         """
         logger = logging.getLogger(__name__)
 
         install_script = lyversion.get_install_script('-'.join(self.system_details()))
         if not install_script:
-            logger.warn('No install scripts found for %s' % lyversion.version)
-            return False
+            logger.warning('No install scripts found for %s' % lyversion.version)
+            return None
 
         local_script = os.path.join(LYCACHE, os.path.basename(install_script))
-        logger.info('Downloading build script')
-        self.download(install_script, local_script)
+        digest_file = local_script + '.sha256'
+        if not _verified(local_script, digest_file):
+            logger.info('Downloading build script')
+            try:
+                sha, _ = self.download(install_script, local_script)
+            except (requests.RequestException, ValueError) as err:
+                logger.warning('Download failed, %s' % err)
+                return None
+            with open(digest_file, 'w') as dfile:
+                dfile.write(sha + '\n')
+        with open(digest_file, 'r') as dfile:
+            sha = dfile.read().strip()
+        return install_script, local_script, sha
+
+
+    def run_script(self, lyversion, fetched):
+        """Run an install script got by :py:meth:`fetch_script`.
+
+        The script is checked against its SHA-256 again right before
+        it is run, as it may wait in a queue of installs. This only
+        detects a script changed or truncated in the local cache
+        since it was fetched; the digest was computed from the
+        download, so a bad file served upstream passes.
 
-        # execute script after downloading
+        :param lyversion: LilyPond version
+        :param fetched: (script URL, local path, SHA-256)
+        :returns: True if successful
+
+        """
+        logger = logging.getLogger(__name__)
+        install_script, local_script, sha = fetched
+        try:
+            verified = mupub.download.verify(local_script, sha)
+        except OSError as err:
+            logger.warning('Cannot read %s, %s' % (local_script, err))
+            return False
+        if not verified:
+            logger.warning('%s no longer matches its SHA-256, not run'
+                           % local_script)
+            return False
         prefix = '--prefix=' + lyversion.cache_folder()
         command = ['/bin/sh', local_script, '--batch', prefix]
         logger.info('Installing with %s' % prefix)
         try:
             subprocess.check_call(command)
             logger.info('(Linux) Installed %s' % str(lyversion))
+            registry = mupub.lyregistry.compiler_registry()
+            registry.add(lyversion, lyversion.version,
+                         script=install_script, sha256=sha)
             return True
         except subprocess.CalledProcessError as cpe:
             logger.warning('Installation failed, return code=%d'
@@ -246,6 +611,20 @@ class LinuxInstaller(LyInstaller):
             return False
 
 
+    def do_install(self, lyversion):
+        """Concrete method of abstract parent.
+
+        Perform a linux install.
+
+        :param lyversion: LilyPond version
+
+        """
+        fetched = self.fetch_script(lyversion)
+        if not fetched:
+            return False
+        return self.run_script(lyversion, fetched)
+
+
 class LyLocator():
     """Locate services for LilyPond files.
 
@@ -283,12 +662,9 @@ class LyLocator():
         """
         logger = logging.getLogger(__name__)
 
-        for folder in _cached_compilers():
-            candidate = LyVersion(folder)
-            if self.version.match(candidate):
-                # folder matches this version, return the path to
-                # its binary.
-                return os.path.join(LYCACHE, folder, *self.app_path)
+        folder = mupub.lyregistry.compiler_registry().folder(self.version)
+        if folder:
+            return os.path.join(folder, *self.app_path)
 
         # here if there is no match.
         logger.info('Compiler installation needed for %s' % self.version)
@@ -0,0 +1,211 @@
+"""A cached index of the LilyPond binary download listings.
+
+Finding the install script for a compiler means reading the listing
+of the download site and then the listing of the folder for the
+processor. The links of each listing are kept in a small JSON file
+under :py:data:`~mupub.lily.LYCACHE` together with the ``ETag`` and
+``Last-Modified`` headers it was served with. Within the time to
+live (the ``index_ttl`` configuration value, in seconds) a listing is
+used without asking the server, after it the listing is revalidated
+with a conditional request that is answered with an empty ``304``
+when nothing changed. A lookup that misses in a listing still within
+its time to live revalidates it once, see
+:py:meth:`ListingCache.revalidate`, so that a newly published
+compiler is found without waiting for the listing to expire.
+
+Listings are plain directory indexes, so links are found with a
+regular expression rather than a full HTML parse. The install scripts
+of a listing are mapped to their version once, when the listing is
+fetched.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+import requests
+import mupub
+
+DEFAULT_TTL = 86400
+
+_HREF_RE = re.compile(r'<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))',
+                      re.IGNORECASE)
+
+
+def parse_links(page):
+    """Return the link targets of an HTML page, in page order.
+
+    :param str page: the page text.
+    :rtype: list
+
+    """
+    return [html.unescape(m.group(1) or m.group(2) or m.group(3))
+            for m in _HREF_RE.finditer(page)]
+
+
+def install_scripts(links):
+    """Map versions to the install scripts in a listing.
+
+    :param links: link targets of a listing.
+    :returns: version string to script name, in listing order.
+    :rtype: dict
+
+    """
+    scripts = {}
+    for link in links:
+        name = urllib.parse.unquote(link.rsplit('/', 1)[-1])
+        script_m = mupub.lily.RE_SCRIPT.match(name)
+        if script_m:
+            scripts.setdefault(script_m.group(1), name)
+    return scripts
+
+
+def _index_folder():
+    return os.path.join(mupub.lily.LYCACHE, 'index')
+
+
+def _ttl():
+    try:
+        return mupub.CONFIG_DICT['common'].getint('index_ttl', DEFAULT_TTL)
+    except ValueError:
+        return DEFAULT_TTL
+
+
+class ListingCache():
+    """Download listings, cached on disk.
+
+    :param str folder: cache folder, defaults to ``index`` under
+                       :py:data:`~mupub.lily.LYCACHE`.
+    :param int ttl: seconds a listing is used without revalidation,
+                    defaults to the ``index_ttl`` configuration value.
+    :param session: object with a requests compatible ``get``,
+                    defaults to the shared
+                    :py:func:`~mupub.utils.http_session`.
+
+    """
+    def __init__(self, folder=None, ttl=None, session=None):
+        self.folder = folder or _index_folder()
+        self.ttl = _ttl() if ttl is None else ttl
+        self.session = session or mupub.utils.http_session()
+        # listings this cache has asked the server for
+        self._asked = set()
+
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + '.json')
+
+
+    def _load(self, url):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+
+    def _save(self, entry):
+        os.makedirs(self.folder, exist_ok=True)
+        data = json.dumps(entry, indent=1, sort_keys=True).encode('utf-8')
+        mupub.utils.write_if_changed(self._path(entry['url']), data)
+
+
+    def entry(self, url, revalidate=False):
+        """Return the cache entry of a listing, fetching if needed.
+
+        :param str url: the listing URL.
+        :param bool revalidate: ask the server even if the listing is
+                                within its time to live.
+        :returns: dictionary with the listing's ``links`` and
+                  ``scripts``, None if it could not be read.
+        :rtype: dict
+
+        """
+        logger = logging.getLogger(__name__)
+        entry = self._load(url)
+        now = time.time()
+        if entry and not revalidate and now - entry['fetched'] < self.ttl:
+            return entry
+
+        self._asked.add(url)
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            req = self.session.get(url, headers=headers)
+        except requests.RequestException as err:
+            if entry:
+                logger.warning('Using cached listing of %s, %s' % (url, err))
+            return entry
+
+        if entry and req.status_code == 304:
+            entry['fetched'] = now
+        elif req.status_code == 200:
+            links = parse_links(req.text)
+            entry = {'url': url,
+                     'etag': req.headers.get('ETag'),
+                     'last_modified': req.headers.get('Last-Modified'),
+                     'fetched': now,
+                     'links': links,
+                     'scripts': install_scripts(links)}
+        elif entry and req.status_code >= 500:
+            logger.warning('Using cached listing of %s, status %d'
+                           % (url, req.status_code))
+            return entry
+        else:
+            logger.info('%s returned status %d' % (url, req.status_code))
+            return None
+        self._save(entry)
+        return entry
+
+
+    def revalidate(self, url):
+        """Revalidate a cached listing after a lookup in it missed.
+
+        A conditional request is made for a listing read from the
+        cache within its time to live, once per listing for this
+        cache. A listing this cache has already asked the server for
+        is current and is not requested again.
+
+        :param str url: the listing URL.
+        :returns: True if the links of the listing changed.
+        :rtype: boolean
+
+        """
+        if url in self._asked:
+            return False
+        previous = self._load(url)
+        if not previous:
+            return False
+        entry = self.entry(url, revalidate=True)
+        return entry is not None and entry['links'] != previous['links']
+
+
+    def links(self, url):
+        """Return the link targets of a listing, None if unreadable."""
+        entry = self.entry(url)
+        return entry['links'] if entry else None
+
+
+    def scripts(self, url):
+        """Return the version to install script map of a listing.
+
+        :returns: version string to script name, empty if the
+                  listing could not be read.
+        :rtype: dict
+
+        """
+        entry = self.entry(url)
+        return entry['scripts'] if entry else {}
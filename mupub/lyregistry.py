@@ -0,0 +1,227 @@
+"""The registry of installed LilyPond compilers.
+
+Each compiler is installed in a folder of
+:py:data:`~mupub.lily.LYCACHE` named for its version. Rather than
+listing and parsing the cache folder on every lookup, the installed
+compilers are recorded in ``registry/compilers.json`` in the cache, ::
+
+    {"version": 1,
+     "cache_mtime": 1700000000.0,
+     "compilers": {"2.18.2-1": {"folder": "2.18.2-1",
+                                "installed": 1700000000.0,
+                                "script": "http://...sh",
+                                "sha256": "..."}}}
+
+The modification time of the cache folder is recorded with it. A
+folder added or removed by hand changes that time, and the registry
+is then brought back in line with the folder: new compiler folders
+are added, entries for missing ones are dropped and the details of
+the others are kept.
+
+In memory, compilers are keyed by :py:class:`~mupub.lily.LyVersion`
+for direct lookup, and a sorted list of versions answers range
+queries by bisection.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import bisect
+import json
+import os
+import threading
+import time
+import mupub
+
+REGISTRY_NAME = os.path.join('registry', 'compilers.json')
+REGISTRY_VERSION = 1
+
+# Serializes updates to the registry file.
+_LOCK = threading.Lock()
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def compiler_registry(cache=None):
+    """Return the shared registry of a compiler cache.
+
+    The registry is read once and reused for as long as neither the
+    cache folder nor the registry file changes, checked with two
+    ``stat`` calls.
+
+    :param str cache: the compiler cache folder, defaults to
+                      :py:data:`~mupub.lily.LYCACHE`.
+    :rtype: CompilerRegistry
+
+    """
+    cache = cache or mupub.lily.LYCACHE
+    with _shared_lock:
+        registry = _shared.get(cache)
+        if registry is None or not registry.is_current():
+            registry = CompilerRegistry(cache)
+            _shared[cache] = registry
+        return registry
+
+
+class CompilerRegistry():
+    """Installed compilers.
+
+    :param str cache: the compiler cache folder, defaults to
+                      :py:data:`~mupub.lily.LYCACHE`.
+
+    """
+    def __init__(self, cache=None):
+        self.cache = cache or mupub.lily.LYCACHE
+        self.path = os.path.join(self.cache, REGISTRY_NAME)
+        self._compilers = {}
+        cache_mtime = self._load()
+        if cache_mtime is None or cache_mtime != self._folder_mtime():
+            self.sync()
+        self._stamp = self._current_stamp()
+
+
+    def _current_stamp(self):
+        try:
+            return self._folder_mtime(), os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+
+    def is_current(self):
+        """True if neither the cache nor the registry file changed."""
+        return self._stamp is not None and self._stamp == self._current_stamp()
+
+
+    def _folder_mtime(self):
+        try:
+            return os.stat(self.cache).st_mtime
+        except OSError:
+            return None
+
+
+    def _load(self):
+        """Read the registry, returns the recorded folder time."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as rfile:
+                data = json.load(rfile)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') != REGISTRY_VERSION:
+            self._set_compilers({})
+            return None
+        self._set_compilers(data.get('compilers', {}))
+        return data.get('cache_mtime')
+
+
+    def _set_compilers(self, compilers):
+        self._compilers = compilers
+        # Folders of the same version (2.18.2, 2.18.2-1) share a key,
+        # the first by name is used.
+        self._entries = {}
+        for name in sorted(compilers):
+            self._entries.setdefault(mupub.LyVersion(name), compilers[name])
+        self._versions = sorted(self._entries)
+
+
+    def _save(self):
+        # The registry is kept in a folder of its own so that writing
+        # it leaves the time of the cache folder alone.
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = json.dumps({'version': REGISTRY_VERSION,
+                           'cache_mtime': self._folder_mtime(),
+                           'compilers': self._compilers},
+                          indent=1, sort_keys=True)
+        mupub.utils.write_if_changed(self.path, data.encode('utf-8'))
+
+
+    def sync(self):
+        """Bring the registry in line with the cache folder.
+
+        Compiler folders are those named for a version. Details of
+        compilers already registered are kept.
+
+        """
+        if not os.path.isdir(self.cache):
+            self._set_compilers({})
+            return
+        with _LOCK:
+            compilers = {}
+            for name in os.listdir(self.cache):
+                if (mupub.lily.RE_VERSION.match(name)
+                        and os.path.isdir(os.path.join(self.cache, name))):
+                    compilers[name] = self._compilers.get(name, {'folder': name})
+            self._set_compilers(compilers)
+            self._save()
+            self._stamp = self._current_stamp()
+
+
+    def add(self, version, folder, **details):
+        """Register an installed compiler.
+
+        :param version: the :py:class:`~mupub.lily.LyVersion`.
+        :param str folder: its folder name in the cache.
+        :param details: other values to record, such as the install
+                        script and its SHA-256.
+
+        """
+        with _LOCK:
+            # another registry may have been updated meanwhile
+            self._load()
+            compilers = dict(self._compilers)
+            compilers[folder] = dict(details, folder=folder,
+                                     installed=time.time())
+            self._set_compilers(compilers)
+            self._save()
+            self._stamp = self._current_stamp()
+
+
+    def get(self, version):
+        """Return the details of the compiler for a version.
+
+        :param version: a :py:class:`~mupub.lily.LyVersion`.
+        :returns: details, with the ``folder`` name, None if the
+                  version is not installed.
+        :rtype: dict
+
+        """
+        return self._entries.get(version)
+
+
+    def folder(self, version):
+        """Return the install folder of a version, None if absent.
+
+        A folder removed since the registry was written is noticed
+        here and the registry synchronized.
+
+        """
+        entry = self._entries.get(version)
+        if not entry:
+            return None
+        path = os.path.join(self.cache, entry['folder'])
+        if not os.path.isdir(path):
+            self.sync()
+            return None
+        return path
+
+
+    def versions(self, low=None, high=None):
+        """Return the installed versions in a range, in order.
+
+        :param low: lowest version wanted, inclusive.
+        :param high: highest version wanted, inclusive.
+        :rtype: list
+
+        """
+        start = 0 if low is None else bisect.bisect_left(self._versions, low)
+        end = (len(self._versions) if high is None
+               else bisect.bisect_right(self._versions, high))
+        return self._versions[start:end]
+
+
+    def __contains__(self, version):
+        return version in self._entries
+
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,182 @@
+"""PDF post-processing.
+
+PDFs are published as LilyPond (through Ghostscript) produced them.
+Large scores often carry duplicated font subsets and are not
+linearized, so browsers must fetch the whole file before showing the
+first page. This module rewrites built PDFs with a locally installed
+tool,
+
+ - ``qpdf`` linearizes the file and packs objects into compressed
+   object streams,
+ - ``gs`` (Ghostscript) re-distills the file, merging duplicate fonts
+   and images, and linearizes it.
+
+``qpdf`` is preferred when both are available. The rewritten file
+replaces the original only if it verifies and is smaller.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import concurrent.futures
+import logging
+import os
+import shutil
+import subprocess
+
+TOOLS = ('qpdf', 'gs')
+
+# qpdf exits with 3 on warnings, the file is still usable.
+_QPDF_OK = (0, 3)
+
+
+def _ok_codes(tool):
+    return _QPDF_OK if tool[0] == 'qpdf' else (0,)
+
+
+def find_tool(name=None):
+    """Find a PDF optimizer.
+
+    :param str name: 'qpdf' or 'gs', None for the first available.
+    :returns: (tool name, executable path) or None if not installed.
+    :rtype: tuple
+
+    """
+    for tool in ([name] if name else TOOLS):
+        path = shutil.which(tool)
+        if path:
+            return tool, path
+    return None
+
+
+def _command(tool, src, dest):
+    name, path = tool
+    if name == 'qpdf':
+        return [path,
+                '--linearize',
+                '--object-streams=generate',
+                '--compress-streams=y',
+                '--recompress-flate',
+                src, dest]
+    return [path,
+            '-q', '-dBATCH', '-dNOPAUSE', '-dSAFER',
+            '-sDEVICE=pdfwrite',
+            '-dFastWebView=true',
+            '-dDetectDuplicateImages=true',
+            '-dCompressFonts=true',
+            '-dSubsetFonts=true',
+            '-o', dest, src]
+
+
+def _verify(tool, path):
+    """Check that a rewritten PDF is well formed."""
+    with open(path, 'rb') as pdf:
+        if pdf.read(5) != b'%PDF-':
+            return False
+        pdf.seek(max(0, os.path.getsize(path) - 1024))
+        if b'%%EOF' not in pdf.read():
+            return False
+    name, exe = tool
+    if name == 'qpdf':
+        command = [exe, '--check', path]
+    else:
+        command = [exe, '-q', '-dBATCH', '-dNOPAUSE', '-dSAFER',
+                   '-sDEVICE=nullpage', path]
+    proc = subprocess.run(command,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+    return proc.returncode in _ok_codes(tool)
+
+
+class PdfResult():
+    """The outcome of optimizing one PDF.
+
+    :ivar str path: the PDF.
+    :ivar int before: size in bytes before optimizing.
+    :ivar int after: size in bytes of the published file.
+    :ivar str status: 'optimized', 'kept' (result was not smaller)
+                      or 'failed' (tool or verification failed).
+
+    """
+    def __init__(self, path, before, after, status):
+        self.path = path
+        self.before = before
+        self.after = after
+        self.status = status
+
+    def saved(self):
+        """Bytes saved."""
+        return self.before - self.after
+
+    def __str__(self):
+        return '{0}: {1} -> {2} bytes ({3})'.format(self.path,
+                                                    self.before,
+                                                    self.after,
+                                                    self.status)
+
+
+def optimize_pdf(path, tool, timeout=None):
+    """Optimize a single PDF in place.
+
+    :param str path: the PDF to optimize.
+    :param tuple tool: (name, executable) as returned by
+                       :py:func:`find_tool`.
+    :param int timeout: seconds allowed for the tool.
+    :rtype: PdfResult
+
+    """
+    logger = logging.getLogger(__name__)
+    before = os.path.getsize(path)
+    tmp_name = path + '.opt'
+    try:
+        proc = subprocess.run(_command(tool, path, tmp_name),
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE,
+                              timeout=timeout)
+        if proc.returncode not in _ok_codes(tool) or not os.path.exists(tmp_name):
+            logger.warning('%s failed on %s: %s'
+                           % (tool[0], path, proc.stderr.decode(errors='replace')))
+            return PdfResult(path, before, before, 'failed')
+        if not _verify(tool, tmp_name):
+            logger.warning('%s output for %s failed verification' % (tool[0], path))
+            return PdfResult(path, before, before, 'failed')
+        after = os.path.getsize(tmp_name)
+        if after >= before:
+            return PdfResult(path, before, before, 'kept')
+        os.replace(tmp_name, path)
+        return PdfResult(path, before, after, 'optimized')
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logger.warning('%s failed on %s: %s' % (tool[0], path, err))
+        return PdfResult(path, before, before, 'failed')
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def optimize_pdfs(paths, tool=None, max_workers=None, timeout=None):
+    """Optimize several PDFs concurrently.
+
+    Each PDF is handled by its own tool process, the threads only
+    wait on them.
+
+    :param paths: PDF files to optimize.
+    :param tuple tool: (name, executable), found with
+                       :py:func:`find_tool` if not given.
+    :param int max_workers: concurrent tool processes, defaults to
+                            the CPU count.
+    :param int timeout: seconds allowed for each PDF.
+    :returns: results in the order of paths, empty if no tool is
+              installed.
+    :rtype: list of :py:class:`PdfResult`
+
+    """
+    if tool is None:
+        tool = find_tool()
+    if tool is None:
+        logger = logging.getLogger(__name__)
+        logger.warning('No PDF optimizer (%s) found' % ', '.join(TOOLS))
+        return []
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda p: optimize_pdf(p, tool, timeout), paths))
@@ -0,0 +1,419 @@
+"""Preview image handling.
+
+The RDF for a piece records the dimensions of its preview image. The
+dimensions are read directly from the file: the IHDR chunk of a PNG,
+or the root element attributes of an SVG, without loading an imaging
+library.
+
+Previews are served on every piece page of the website so they may
+also be optimized, losslessly,
+
+ - SVG is minified: whitespace is collapsed, numbers are written
+   without redundant zeros, and glyph paths that occur more than
+   once are defined once and placed with ``<use>``.
+ - PNG is reduced to greyscale, or to a palette when it has no more
+   than 256 colors, and recompressed. This requires Pillow, without
+   it PNG previews are left as they are.
+
+PNG previews are rendered with generous white margins at a single
+resolution. They are cropped to the ink and scaled to a set of
+smaller widths for the ``srcset`` of the web page. This requires
+NumPy and Pillow.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import logging
+import os
+import re
+import struct
+import xml.etree.ElementTree as ET
+import mupub
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# CSS pixels per unit
+_SVG_UNITS = {
+    '': 1.0,
+    'px': 1.0,
+    'pt': 96.0 / 72.0,
+    'pc': 16.0,
+    'mm': 96.0 / 25.4,
+    'cm': 96.0 / 2.54,
+    'in': 96.0,
+}
+_LENGTH_RE = re.compile(r'^\s*([0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*([a-z%]*)\s*$')
+
+_SVG_NS = 'http://www.w3.org/2000/svg'
+_XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+# Attributes holding numbers, lengths or path data.
+_NUMERIC_ATTRS = frozenset([
+    'd', 'transform', 'points', 'viewBox',
+    'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry',
+    'width', 'height', 'stroke-width', 'font-size',
+])
+# A decimal number standing alone, not part of another number or an
+# exponent form.
+_DECIMAL_RE = re.compile(r'(?<![\d.])(-?)(\d*)\.(\d+)(?![\d.eE])')
+
+# Widths of the scaled preview variants.
+PREVIEW_WIDTHS = (320, 640)
+
+# Paths shorter than this cost more as a <use> than they save.
+_MIN_SHARED_PATH = 32
+
+
+def png_size(path):
+    """Return the dimensions of a PNG image.
+
+    :param str path: PNG file.
+    :returns: (width, height) in pixels.
+    :rtype: tuple
+    :raises: ValueError if the file is not a PNG.
+
+    """
+    with open(path, 'rb') as pngfile:
+        head = pngfile.read(24)
+    if len(head) < 24 or head[:8] != _PNG_SIGNATURE or head[12:16] != b'IHDR':
+        raise ValueError('Not a PNG file - {}'.format(path))
+    return struct.unpack('>II', head[16:24])
+
+
+def _svg_length(value):
+    if not value:
+        return None
+    lmatch = _LENGTH_RE.match(value)
+    if not lmatch or lmatch.group(2) not in _SVG_UNITS:
+        return None
+    return float(lmatch.group(1)) * _SVG_UNITS[lmatch.group(2)]
+
+
+def svg_size(path):
+    """Return the dimensions of an SVG image.
+
+    Only the root element is parsed. The ``width`` and ``height``
+    attributes are converted to CSS pixels; if either is missing, or
+    relative, the ``viewBox`` is used.
+
+    :param str path: SVG file.
+    :returns: (width, height) in pixels, rounded.
+    :rtype: tuple
+    :raises: ValueError if no size can be determined.
+
+    """
+    root = None
+    with open(path, 'rb') as svgfile:
+        for _, elem in ET.iterparse(svgfile, events=('start',)):
+            root = elem
+            break
+    if root is None:
+        raise ValueError('Empty SVG file - {}'.format(path))
+
+    width = _svg_length(root.get('width'))
+    height = _svg_length(root.get('height'))
+    if width is None or height is None:
+        viewbox = root.get('viewBox', '').replace(',', ' ').split()
+        if len(viewbox) != 4:
+            raise ValueError('No SVG dimensions - {}'.format(path))
+        box_w, box_h = float(viewbox[2]), float(viewbox[3])
+        # keep a given dimension, scale the other by the aspect ratio
+        if width is not None and box_w > 0:
+            width, height = width, width * box_h / box_w
+        elif height is not None and box_h > 0:
+            width, height = height * box_w / box_h, height
+        else:
+            width, height = box_w, box_h
+    return int(round(width)), int(round(height))
+
+
+def image_size(path):
+    """Return the dimensions of a PNG or SVG preview image.
+
+    :param str path: image file, the type is taken from its extension.
+    :returns: (width, height) in pixels.
+    :rtype: tuple
+    :raises: ValueError for unsupported or unreadable images.
+
+    """
+    if path.lower().endswith('.svg'):
+        return svg_size(path)
+    return png_size(path)
+
+
+def _short_decimal(dmatch):
+    sign, whole, frac = dmatch.groups()
+    whole = whole.lstrip('0')
+    frac = frac.rstrip('0')
+    if not frac:
+        return sign + whole if whole else '0'
+    return sign + whole + '.' + frac
+
+
+def _short_numbers(value):
+    return _DECIMAL_RE.sub(_short_decimal, ' '.join(value.split()))
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _strip_whitespace(elem):
+    if _local(elem.tag) in ('text', 'tspan', 'style', 'title', 'desc'):
+        return
+    if elem.text is not None and not elem.text.strip():
+        elem.text = None
+    for child in elem:
+        if child.tail is not None and not child.tail.strip():
+            child.tail = None
+        _strip_whitespace(child)
+
+
+def _unqualify(root):
+    """Write namespaces as plain attributes.
+
+    ElementTree would otherwise name the SVG namespace ``ns0`` and
+    prefix every element with it.
+
+    """
+    namespace = ''
+    if root.tag.startswith('{'):
+        namespace = root.tag[:root.tag.index('}')+1]
+    xlink = '{%s}' % _XLINK_NS
+    for elem in root.iter():
+        if namespace and elem.tag.startswith(namespace):
+            elem.tag = elem.tag[len(namespace):]
+        for name in [n for n in elem.attrib if n.startswith(xlink)]:
+            elem.set('xlink:' + name[len(xlink):], elem.attrib.pop(name))
+    if namespace:
+        root.set('xmlns', namespace[1:-1])
+
+
+def _share_paths(root):
+    """Replace repeated paths by ``<use>`` of a single definition."""
+    parents = {}
+    counts = {}
+    for parent in root.iter():
+        for child in parent:
+            if child.tag != 'path' or len(child) or 'id' in child.attrib:
+                continue
+            if len(child.get('d', '')) < _MIN_SHARED_PATH:
+                continue
+            key = tuple(sorted((k, v) for k, v in child.attrib.items()
+                               if k != 'transform'))
+            counts[key] = counts.get(key, 0) + 1
+            parents[child] = parent
+
+    ids = set(elem.get('id') for elem in root.iter() if elem.get('id'))
+    defs = None
+    names = {}
+    for key, count in counts.items():
+        if count < 2:
+            continue
+        name = 'p{}'.format(len(names))
+        while name in ids:
+            name = '_' + name
+        names[key] = name
+        if defs is None:
+            defs = ET.Element('defs')
+            root.insert(0, defs)
+        ET.SubElement(defs, 'path', dict(key, id=name))
+
+    for child, parent in parents.items():
+        key = tuple(sorted((k, v) for k, v in child.attrib.items()
+                           if k != 'transform'))
+        if key not in names:
+            continue
+        use = ET.Element('use', {'xlink:href': '#' + names[key]})
+        if 'transform' in child.attrib:
+            use.set('transform', child.get('transform'))
+        use.tail = child.tail
+        index = list(parent).index(child)
+        parent.remove(child)
+        parent.insert(index, use)
+
+
+def minify_svg(data):
+    """Minify an SVG document, preserving its rendering.
+
+    :param bytes data: the SVG document.
+    :returns: the minified document.
+    :rtype: bytes
+    :raises: xml.etree.ElementTree.ParseError on malformed input.
+
+    """
+    root = ET.fromstring(data)
+    _unqualify(root)
+    _strip_whitespace(root)
+    for elem in root.iter():
+        for name, value in elem.attrib.items():
+            if name in _NUMERIC_ATTRS:
+                elem.set(name, _short_numbers(value))
+    _share_paths(root)
+    # links, kept or made by sharing paths, need their prefix bound
+    if any(name.startswith('xlink:')
+           for elem in root.iter() for name in elem.attrib):
+        root.set('xmlns:xlink', _XLINK_NS)
+    return ET.tostring(root, encoding='utf-8')
+
+
+def quantize_png(path, out_path):
+    """Losslessly reduce the colors of a PNG.
+
+    Grey images are stored as 8 bit greyscale, images of up to 256
+    colors with a palette. The result is checked pixel for pixel
+    against the original. Requires Pillow.
+
+    :param str path: PNG file to read.
+    :param str out_path: PNG file to write.
+    :returns: True if out_path was written.
+    :rtype: boolean
+
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        logger = logging.getLogger(__name__)
+        logger.info('Pillow is not installed, PNG preview not optimized')
+        return False
+
+    with Image.open(path) as img:
+        img.load()
+    if img.mode == 'RGBA' and img.getextrema()[3] == (255, 255):
+        img = img.convert('RGB')
+    if img.mode not in ('RGB', 'L', 'P'):
+        return False
+
+    target = img
+    if img.mode == 'RGB':
+        colors = img.getcolors(256)
+        if colors is not None:
+            if all(c[0] == c[1] == c[2] for _, c in colors):
+                target = img.convert('L')
+            else:
+                target = img.convert('P', palette=Image.Palette.ADAPTIVE,
+                                     colors=len(colors))
+            if target.convert('RGB').tobytes() != img.tobytes():
+                target = img
+    target.save(out_path, 'PNG', optimize=True)
+    return True
+
+
+def optimize_preview(path):
+    """Optimize a preview image in place.
+
+    The optimized image replaces the original only if it is smaller.
+
+    :param str path: SVG or PNG preview.
+    :returns: (size before, size after) in bytes.
+    :rtype: tuple
+
+    """
+    logger = logging.getLogger(__name__)
+    before = os.path.getsize(path)
+    tmp_name = path + '.tmp'
+    try:
+        if path.lower().endswith('.svg'):
+            with open(path, 'rb') as svgfile:
+                data = minify_svg(svgfile.read())
+            # never publish a document that no longer parses
+            ET.fromstring(data)
+            with open(tmp_name, 'wb') as svgfile:
+                svgfile.write(data)
+        elif not quantize_png(path, tmp_name):
+            return before, before
+        after = os.path.getsize(tmp_name)
+        if after >= before:
+            return before, before
+        os.replace(tmp_name, path)
+        return before, after
+    except (OSError, ValueError, ET.ParseError) as err:
+        logger.warning('Preview %s not optimized: %s' % (path, err))
+        return before, before
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def _ink_box(pixels, has_alpha, threshold, margin):
+    """Return the (top, bottom, left, right) slice bounds of the ink."""
+    import numpy
+    if pixels.ndim == 2:
+        value = pixels
+    else:
+        channels = pixels.shape[2] - (1 if has_alpha else 0)
+        value = pixels[..., :channels].min(axis=2)
+    ink = value < threshold
+    if has_alpha:
+        ink &= pixels[..., -1] > 0
+    rows = numpy.flatnonzero(ink.any(axis=1))
+    cols = numpy.flatnonzero(ink.any(axis=0))
+    height, width = pixels.shape[:2]
+    if rows.size == 0:
+        return 0, height, 0, width
+    return (max(int(rows[0]) - margin, 0),
+            min(int(rows[-1]) + margin + 1, height),
+            max(int(cols[0]) - margin, 0),
+            min(int(cols[-1]) + margin + 1, width))
+
+
+def crop_preview(path, variant_name, widths=PREVIEW_WIDTHS,
+                 margin=8, threshold=250):
+    """Crop a PNG preview to its ink and write scaled variants.
+
+    The image is decoded once. The bounding box of pixels darker than
+    the threshold is found with array reductions, the preview is
+    rewritten cropped to it (plus the margin), and a variant is
+    scaled from the cropped image, with Pillow's Lanczos filter, for
+    each width narrower than it.
+    A variant file is only replaced if its content changes.
+
+    :param str path: PNG preview, rewritten in place.
+    :param str variant_name: format for variant file names, given
+                             the width, e.g. ``'x-preview-{}w.png'``.
+    :param widths: widths of the variants in pixels.
+    :param int margin: pixels kept around the ink.
+    :param int threshold: grey level below which a pixel is ink.
+    :returns: ((width, height) of the cropped preview, list of
+              (variant name, width)), or None if NumPy or Pillow is
+              not installed.
+    :rtype: tuple
+
+    """
+    try:
+        import numpy
+        from PIL import Image
+    except ImportError:
+        logger = logging.getLogger(__name__)
+        logger.info('NumPy or Pillow not installed, PNG preview not cropped')
+        return None
+
+    with Image.open(path) as img:
+        img.load()
+    # palette images are analysed, and scaled, as RGBA but cropped
+    # in their own mode to keep the palette
+    rgb = img
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        rgb = img.convert('RGBA')
+    pixels = numpy.asarray(rgb)
+    top, bottom, left, right = _ink_box(pixels, rgb.mode.endswith('A'),
+                                        threshold, margin)
+    height, width = pixels.shape[:2]
+    if (top, bottom, left, right) != (0, height, 0, width):
+        box = (left, top, right, bottom)
+        img.crop(box).save(path, 'PNG', optimize=True)
+        rgb = rgb.crop(box)
+        width, height = right - left, bottom - top
+
+    variants = []
+    for variant_width in sorted(set(widths)):
+        if variant_width >= width:
+            continue
+        variant_height = max(int(round(height * variant_width / width)), 1)
+        name = variant_name.format(variant_width)
+        rgb.resize((variant_width, variant_height),
+                   Image.Resampling.LANCZOS).save(name+'.tmp', 'PNG', optimize=True)
+        mupub.utils.replace_if_changed(name+'.tmp', name)
+        variants.append((name, variant_width))
+    return (width, height), variants
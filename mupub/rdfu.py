@@ -3,30 +3,27 @@
 This is tailored for the MutopiaProject but has a few generic
 mechanisms that can be applied to other projects using RDF.
 
+Besides RDF/XML, the description of a piece can be written as
+JSON-LD and the descriptions of a whole archive exported in a single
+streaming pass as N-Triples or JSON Lines of JSON-LD records, see
+:py:func:`export_rdf`.
+
 """
 
 __docformat__ = 'reStructuredText'
 
+import json
+import logging
+import os
+import urllib.parse
 import xml.etree.ElementTree as ET
-
+import mupub
 
 RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
 MP_NS = 'http://www.mutopiaproject.org/piece-data/0.1/'
 
-# A simple class to simplify namespace usage.
-# From effbot (Fredrik Lundh)
-class NS:
-    def __init__(self, uri):
-        self.uri = '{'+uri+'}'
-    def __getattr__(self, tag):
-        return self.uri + tag
-    def __call__(self, path):
-        return "/".join(getattr(self, tag) for tag in path.split("/"))
-
-
-# Convenient namespace definitions for this module
-_MP = NS(MP_NS)
-_RDF = NS(RDF_NS)
+_RDF_PREFIX = '{' + RDF_NS + '}'
+_MP_PREFIX = '{' + MP_NS + '}'
 
 # This list sets the order for the RDF output. This is not strictly
 # necessary --- RDF parsers really don't care about order --- but it
@@ -38,27 +35,69 @@ _MU_KEYS = ['title', 'composer', 'opus',
             'lyFile', 'midFile',
             'psFileA4', 'pdfFileA4',
             'psFileLet', 'pdfFileLet',
-            'pngFile', 'pngHeight', 'pngWidth',
+            'pngFile', 'pngHeight', 'pngWidth', 'pngSrcset',
             'id',
             'maintainer', 'maintainerEmail', 'maintainerWeb',
             'moreInfo', 'lilypondVersion',
 ]
 
 
+# Keys only written when they have a value, so that descriptions
+# without them are unchanged.
+_OPTIONAL_KEYS = frozenset(['pngSrcset'])
+
+
+# Serialization pieces, built once. The layout is that of
+# ElementTree output indented two spaces per level.
+_XML_HEAD = ("<?xml version='1.0' encoding='UTF-8'?>\n"
+             '<rdf:RDF xmlns:mp="{0}" xmlns:rdf="{1}">\n'
+             '  <rdf:Description rdf:about=".">\n').format(MP_NS, RDF_NS)
+_XML_TAIL = '  </rdf:Description>\n</rdf:RDF>\n'
+_MU_TAGS = dict((key, ('    <mp:{}>'.format(key),
+                       '</mp:{}>\n'.format(key),
+                       '    <mp:{} />\n'.format(key)))
+                for key in _MU_KEYS)
+
+
+# Export formats, see export_rdf
+EXPORT_FORMATS = ('ntriples', 'jsonld')
+
+_JSONLD_CONTEXT = {'@vocab': MP_NS}
+
+# N-Triples literal escapes
+_NT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"',
+                             '\n': '\\n', '\r': '\\r'})
+_NT_PREDICATES = dict((key, '<{0}{1}>'.format(MP_NS, key))
+                      for key in _MU_KEYS)
+
+
+def _escape(text):
+    # The escaping done by ElementTree for element text.
+    if not isinstance(text, str):
+        raise TypeError('cannot serialize {0!r} (type {1})'
+                        .format(text, type(text).__name__))
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
 class MuRDF:
-    def __init__(self):
-        # Start an RDF document
-        self.top = ET.Element(_RDF('RDF'))
+    """The RDF description of a piece.
 
-        # The RDF document tree has a description as its sole element.
-        self.description = ET.SubElement(self.top,
-                                         _RDF('Description'),
-                                         {_RDF('about'): '.'})
-        # Generate the RDF with all elements in the order we want.
-        # Ordering is mostly cosmetic but we still want to create a
-        # blank-filled RDF of our expected elements.
-        for key in _MU_KEYS:
-            ET.SubElement(self.description, _MP(key))
+    Values are kept in a table in :py:data:`_MU_KEYS` order and the
+    RDF/XML is written directly from it, without building an element
+    tree. The output is identical to serializing :py:attr:`top`
+    with ElementTree, indented two spaces per level.
+
+    """
+    def __init__(self):
+        # A blank-filled description of our expected elements, in
+        # the order we want. Ordering is mostly cosmetic.
+        self._values = dict.fromkeys(_MU_KEYS)
 
 
     def update_description(self, name, value):
@@ -74,49 +113,195 @@ class MuRDF:
         :rtype: boolean
 
         """
-        node = self.description.find(_MP(name))
-        if node is None:
+        if name not in self._values:
             return False
-        node.text = value
+        self._values[name] = value
         return True
 
 
-    @classmethod
-    def indent(cls, elem, level=0):
-        """Indent xml tree in place.
+    @property
+    def top(self):
+        """The RDF document as an ElementTree element.
 
-        :param xml.etree.ElementTree elem: RDF to indent.
-        :param int level: level for indent (recursive routine).
+        The tree is built from the current values on each access.
+        Changes made to it are not written, use
+        :py:meth:`update_description`.
 
         """
-        # also from effbot (Fredrik Lundh)
-
-        i = "\n" + level*"  "
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for elem in elem:
-                cls.indent(elem, level+1)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
+        top = ET.Element(_RDF_PREFIX + 'RDF')
+        description = ET.SubElement(top, _RDF_PREFIX + 'Description',
+                                    {_RDF_PREFIX + 'about': '.'})
+        for key, value in self._values.items():
+            if value or key not in _OPTIONAL_KEYS:
+                ET.SubElement(description, _MP_PREFIX + key).text = value
+        return top
+
+
+    @property
+    def description(self):
+        """The description element of :py:attr:`top`."""
+        return self.top[0]
+
+
+    def to_xml(self):
+        """Return the RDF/XML document.
+
+        :returns: the UTF-8 encoded document.
+        :rtype: bytes
+
+        """
+        parts = [_XML_HEAD]
+        for key, value in self._values.items():
+            start, end, empty = _MU_TAGS[key]
+            if value:
+                parts.append(start)
+                parts.append(_escape(value))
+                parts.append(end)
+            elif key not in _OPTIONAL_KEYS:
+                parts.append(empty)
+        parts.append(_XML_TAIL)
+        return ''.join(parts).encode('utf-8', 'xmlcharrefreplace')
 
 
     def write_xml(self, path):
-        """Write the ElementTree to RDF/XML.
+        """Write the RDF/XML.
+
+        The file is only replaced if its content changes.
+
+        :param path: Name of output file.
+        :returns: True if the file was written.
+        :rtype: boolean
+
+        """
+        return mupub.utils.write_if_changed(path, self.to_xml())
+
+
+    def to_jsonld(self, subject='.'):
+        """Return the description as a JSON-LD object.
+
+        Fields are in RDF order, empty ones are left out.
+
+        :param str subject: IRI of the piece, relative to the
+                            document by default as in the RDF/XML.
+        :rtype: dict
+
+        """
+        return _jsonld_record(subject, self._values)
+
+
+    def write_jsonld(self, path):
+        """Write the description as a JSON-LD document.
+
+        The file is only replaced if its content changes.
 
         :param path: Name of output file.
+        :returns: True if the file was written.
+        :rtype: boolean
 
         """
-        # Registration of the namespace allows the output to define
-        # xmlns attributes in the RDF header.
-        ET.register_namespace('rdf', RDF_NS)
-        ET.register_namespace('mp', MP_NS)
-        MuRDF.indent(self.top)
-        root = ET.ElementTree(element=self.top)
-        with open(path, 'wb') as rdfout:
-            root.write(rdfout, encoding='UTF-8', xml_declaration=True)
+        data = json.dumps(self.to_jsonld(), indent=2, ensure_ascii=False)
+        return mupub.utils.write_if_changed(path, (data+'\n').encode('utf-8'))
+
+
+
+def read_rdf(path):
+    """Read the description of a piece from an RDF file.
+
+    The reading counterpart of :py:class:`MuRDF`. The file is
+    streamed with ``iterparse`` and each element is cleared once read,
+    so memory use does not grow with the number of files read.
+
+    :param path: RDF file name or binary file object.
+    :returns: element name to text, for the elements present. Empty
+              elements map to None.
+    :rtype: dict
+    :raises: xml.etree.ElementTree.ParseError on malformed RDF.
+
+    """
+    values = {}
+    for _, elem in ET.iterparse(path):
+        if elem.tag.startswith(_MP_PREFIX):
+            values[elem.tag[len(_MP_PREFIX):]] = elem.text
+        elem.clear()
+    return values
+
+
+def rdf_files(top):
+    """Generate the RDF files below a folder.
+
+    Hidden folders are skipped.
+
+    :param str top: the folder to search.
+    :returns: RDF file paths, as a generator.
+
+    """
+    for folder, dirs, files in os.walk(top):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.rdf'):
+                yield os.path.join(folder, name)
+
+
+def _jsonld_record(subject, values):
+    record = {'@context': _JSONLD_CONTEXT, '@id': subject}
+    for key in _MU_KEYS:
+        if values.get(key):
+            record[key] = values[key]
+    return record
+
+
+def _ntriples(subject, values):
+    subject = '<{}>'.format(subject)
+    return ''.join('{0} {1} "{2}" .\n'.format(subject, _NT_PREDICATES[key],
+                                              values[key].translate(_NT_ESCAPES))
+                   for key in _MU_KEYS if values.get(key))
+
+
+def export_rdf(top, outfile, fmt='ntriples', base_uri=None):
+    """Export the descriptions of the pieces in an archive.
+
+    Every RDF file below the top folder is read and written to the
+    output as one record, N-Triples statements or a line of JSON-LD,
+    before the next is read, so memory use does not depend on the size
+    of the archive. Each piece is identified by the URL of its folder.
+
+    :param str top: archive folder, such as
+                    :py:data:`~mupub.core.FTP_BASE`.
+    :param outfile: text file object to write.
+    :param str fmt: one of :py:data:`EXPORT_FORMATS`.
+    :param str base_uri: URL of the top folder, defaults to the
+                         ``ftp`` folder of
+                         :py:data:`~mupub.core.URL_BASE`.
+    :returns: (pieces exported, RDF files that could not be read)
+    :rtype: tuple
+    :raises: ValueError on an unknown format.
+
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format - {}'.format(fmt))
+    logger = logging.getLogger(__name__)
+    if base_uri is None:
+        base_uri = mupub.URL_BASE + '/ftp/'
+    elif not base_uri.endswith('/'):
+        base_uri += '/'
+    exported = failed = 0
+    for rdf_path in rdf_files(top):
+        try:
+            values = read_rdf(rdf_path)
+        except ET.ParseError as err:
+            logger.warning('%s: %s' % (rdf_path, err))
+            failed += 1
+            continue
+        folder = os.path.relpath(os.path.dirname(rdf_path), top)
+        subject = base_uri
+        if folder != '.':
+            # a space or '>' in a folder name would end the IRI
+            subject += urllib.parse.quote(folder.replace(os.sep, '/') + '/')
+        if fmt == 'ntriples':
+            outfile.write(_ntriples(subject, values))
+        else:
+            outfile.write(json.dumps(_jsonld_record(subject, values),
+                                     ensure_ascii=False))
+            outfile.write('\n')
+        exported += 1
+    return exported, failed
@@ -0,0 +1,198 @@
+"""Build telemetry.
+
+Each |LilyPond| invocation made during a build is recorded in a small
+SQLite database in the configuration folder. The history allows the
+cost of building the archive to be followed over time and across
+compiler versions.
+
+"""
+
+__docformat__ = 'reStructuredText'
+
+import logging
+import os
+import re
+import sqlite3
+import time
+import mupub
+
+_CREATE_RUNS = """CREATE TABLE IF NOT EXISTS
+   lilypond_runs (
+      run_id INTEGER PRIMARY KEY,
+      started TEXT,
+      piece TEXT,
+      label TEXT,
+      compiler TEXT,
+      page_size TEXT,
+      flags TEXT,
+      returncode INT,
+      wall REAL,
+      cpu_user REAL,
+      cpu_sys REAL,
+      max_rss INT,
+      pages INT,
+      warnings INT,
+      output_bytes INT,
+      outputs TEXT
+   )
+"""
+
+_INSERT_RUN = """INSERT INTO lilypond_runs
+   (started, piece, label, compiler, page_size, flags, returncode,
+    wall, cpu_user, cpu_sys, max_rss, pages, warnings, output_bytes, outputs)
+   VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+_PAPER_RE = re.compile(r'-dpaper-size="?([^"]+)"?')
+
+
+def getTelemetryPath():
+    """Return the telemetry database path from configuration.
+    """
+    return os.path.join(mupub.CONFIG_DIR,
+                        mupub.CONFIG_DICT['common'].get('telemetry_db',
+                                                        'mu-telemetry.db'))
+
+
+def _page_size(command):
+    for arg in command:
+        pmatch = _PAPER_RE.match(arg)
+        if pmatch:
+            return pmatch.group(1)
+    return ''
+
+
+class Telemetry():
+    """The store of recorded |LilyPond| runs.
+
+    :param str path: database path, defaults to the configured path.
+
+    """
+    def __init__(self, path=None):
+        self.conn = sqlite3.connect(path or getTelemetryPath())
+        with self.conn:
+            self.conn.execute(_CREATE_RUNS)
+
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+
+    def record(self, lyrun, piece, compiler):
+        """Record a single run.
+
+        :param lyrun: a :py:class:`~mupub.lily.LyRun`.
+        :param str piece: the piece being built.
+        :param str compiler: the compiler version.
+
+        """
+        sizes = [os.path.getsize(f) for f in lyrun.outputs if os.path.exists(f)]
+        started = time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(lyrun.started))
+        with self.conn:
+            self.conn.execute(_INSERT_RUN,
+                              (started, piece, lyrun.label, str(compiler),
+                               _page_size(lyrun.command),
+                               ' '.join(lyrun.command[1:-1]),
+                               lyrun.returncode,
+                               lyrun.wall,
+                               lyrun.cpu_user,
+                               lyrun.cpu_sys,
+                               lyrun.max_rss,
+                               lyrun.progress.pages,
+                               len(lyrun.progress.warnings()),
+                               sum(sizes),
+                               ' '.join(lyrun.outputs)))
+
+
+    def slowest(self, limit=10):
+        """Return the runs with the longest average time.
+
+        Runs are grouped by piece and label, so that the score of each
+        page size and the preview are averaged apart.
+
+        :param int limit: number of rows to return.
+        :returns: rows of (piece, label, runs, average wall, max wall,
+                  max rss)
+        :rtype: list
+
+        """
+        cursor = self.conn.execute(
+            'SELECT piece, label, COUNT(*), AVG(wall), MAX(wall), MAX(max_rss)'
+            ' FROM lilypond_runs WHERE returncode = 0'
+            ' GROUP BY piece, label ORDER BY AVG(wall) DESC LIMIT ?', (limit,))
+        return cursor.fetchall()
+
+
+    def regressions(self, threshold=1.1):
+        """Find pieces that got slower with a newer compiler.
+
+        Average run times of each piece and run label (a page size or
+        the preview) are compared between successive compiler versions
+        it was built with. Keeping the labels apart means a build that
+        only reran the preview does not change the average of the
+        scores.
+
+        :param float threshold: minimum ratio of new to old time.
+        :returns: rows of (piece, label, old compiler, new compiler,
+                  old average wall, new average wall, ratio)
+        :rtype: list
+
+        """
+        cursor = self.conn.execute(
+            'SELECT piece, label, compiler, AVG(wall) FROM lilypond_runs'
+            ' WHERE returncode = 0 GROUP BY piece, label, compiler')
+        by_run = {}
+        for piece, label, compiler, wall in cursor:
+            by_run.setdefault((piece, label), []).append(
+                (mupub.LyVersion(compiler), wall))
+        found = []
+        for piece, label in sorted(by_run):
+            history = sorted(by_run[(piece, label)], key=lambda h: h[0].sortval)
+            for (old, old_wall), (new, new_wall) in zip(history, history[1:]):
+                if old_wall > 0 and new_wall / old_wall >= threshold:
+                    found.append((piece, label, str(old), str(new),
+                                  old_wall, new_wall, new_wall / old_wall))
+        return found
+
+
+    def page_trends(self):
+        """Return the time per page, by month and compiler.
+
+        :returns: rows of (month, compiler, runs, seconds per page)
+        :rtype: list
+
+        """
+        cursor = self.conn.execute(
+            'SELECT substr(started, 1, 7), compiler, COUNT(*),'
+            ' SUM(wall) / SUM(pages) FROM lilypond_runs'
+            ' WHERE returncode = 0 AND pages > 0'
+            ' GROUP BY substr(started, 1, 7), compiler'
+            ' ORDER BY substr(started, 1, 7), compiler')
+        return cursor.fetchall()
+
+
+def record_runs(runs, piece, compiler):
+    """Record a list of runs in the telemetry store.
+
+    Telemetry is a convenience, failures are logged and ignored so
+    that they never interrupt a build.
+
+    :param runs: list of :py:class:`~mupub.lily.LyRun` records.
+    :param str piece: the piece being built.
+    :param str compiler: the compiler version.
+
+    """
+    if len(runs) < 1:
+        return
+    logger = logging.getLogger(__name__)
+    try:
+        store = Telemetry()
+        try:
+            for lyrun in runs:
+                store.record(lyrun, piece, compiler)
+        finally:
+            store.close()
+    except sqlite3.Error as err:
+        logger.warning('Telemetry not recorded: %s' % err)
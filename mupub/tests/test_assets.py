@@ -0,0 +1,295 @@
+"""Asset collection tests
+"""
+
+import glob
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from unittest import TestCase
+import mupub
+
+
+def _write(name, content):
+    with open(name, 'wb') as outfile:
+        outfile.write(content)
+
+
+class AssetsTest(TestCase):
+    """Asset collection testing"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='assets_')
+        os.chdir(self.dirpath)
+        _write('piece.ly', b'\\version "2.18.2"\n')
+        _write('piece.preview.svg', b'<svg/>')
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_collect(self):
+        """Assets are zipped, gzipped or renamed"""
+        ps_data = b'%!PS\n' + b'0 0 moveto\n' * 1000
+        _write('piece-a4.ps', ps_data)
+        _write('piece-let.pdf', b'%PDF-1.4')
+        _write('one.mid', b'MThd')
+        _write('two.mid', b'MThd')
+        assets = mupub.collect_assets('piece')
+        self.assertEqual(assets['lyFile'], 'piece.ly')
+        self.assertEqual(assets['midFile'], 'piece-mids.zip')
+        self.assertEqual(assets['psFileA4'], 'piece-a4.ps.gz')
+        self.assertEqual(assets['psFileLet'], 'empty')
+        self.assertEqual(assets['pdfFileLet'], 'piece-let.pdf')
+        self.assertEqual(assets['pngFile'], 'piece-preview.svg')
+        with gzip.open('piece-a4.ps.gz') as gzfile:
+            self.assertEqual(gzfile.read(), ps_data)
+        with zipfile.ZipFile('piece-mids.zip') as midzip:
+            self.assertEqual(sorted(midzip.namelist()), ['one.mid', 'two.mid'])
+
+
+    def test_policy(self):
+        """Zip compression follows the asset type policy"""
+        _write('a-a4.pdf', b'%PDF-1.4')
+        _write('b-a4.pdf', b'%PDF-1.4')
+        _write('a-a4.ps', b'%!PS\n' * 100)
+        _write('b-a4.ps', b'%!PS\n' * 100)
+        assets = mupub.collect_assets('piece')
+        with zipfile.ZipFile(assets['pdfFileA4']) as pdfzip:
+            for info in pdfzip.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                # no data descriptor, for streaming readers
+                self.assertFalse(info.flag_bits & 0x08)
+        with zipfile.ZipFile(assets['psFileA4']) as pszip:
+            for info in pszip.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+
+
+    def test_parse_policy(self):
+        """Policy entries are parsed"""
+        self.assertEqual(mupub.compress.parse_policy('lzma'),
+                         (zipfile.ZIP_LZMA, None))
+        self.assertEqual(mupub.compress.parse_policy(' deflate:6 '),
+                         (zipfile.ZIP_DEFLATED, 6))
+        with self.assertRaises(ValueError):
+            mupub.compress.parse_policy('zstd')
+
+
+    def test_parallel_gzip(self):
+        """Block-parallel gzip output is a standard gzip stream"""
+        rand = random.Random(1)
+        words = [b'moveto', b'lineto', b'stroke', b'0', b'1', b'2']
+        data = b' '.join(rand.choice(words) for _ in range(100000))
+        _write('big.ps', data)
+        mupub.compress.parallel_gzip('big.ps', 'big.ps.gz', 6,
+                                     block_size=64*1024, max_workers=4)
+        with gzip.open('big.ps.gz') as gzfile:
+            self.assertEqual(gzfile.read(), data)
+        if shutil.which('gunzip'):
+            self.assertEqual(subprocess.call(['gunzip', '-t', 'big.ps.gz']), 0)
+        # empty input
+        _write('empty.ps', b'')
+        mupub.compress.parallel_gzip('empty.ps', 'empty.ps.gz')
+        with gzip.open('empty.ps.gz') as gzfile:
+            self.assertEqual(gzfile.read(), b'')
+
+
+    def test_incremental(self):
+        """Unchanged archives are kept, changed ones reuse members"""
+        os.mkdir('piece-lys')
+        _write(os.path.join('piece-lys', 'piece.ly'), b'\\include "notes.ly"\n' * 50)
+        _write(os.path.join('piece-lys', 'notes.ly'), b'{ c4 d e f }\n' * 50)
+        _write('one.mid', b'MThd')
+        _write('two.mid', b'MThd')
+        assets = mupub.collect_assets('piece')
+        self.assertEqual(assets['lyFile'], 'piece-lys.zip')
+        os.utime('piece-lys.zip', (1, 1))
+
+        # nothing changed, archives are kept and still reported
+        _write('piece.preview.svg', b'<svg/>')
+        assets = mupub.collect_assets('piece')
+        self.assertEqual(os.stat('piece-lys.zip').st_mtime, 1)
+        self.assertEqual(assets['midFile'], 'piece-mids.zip')
+
+        # rebuilt scores without MIDI no longer publish the archive
+        _write('piece.preview.svg', b'<svg/>')
+        assets = mupub.collect_assets('piece', rebuilt=True)
+        self.assertEqual(assets['midFile'], 'empty')
+        self.assertFalse(os.path.exists('piece-mids.zip'))
+        self.assertIsNone(mupub.archive.ArchiveManifest('piece').get('piece-mids.zip'))
+
+        # a changed member causes a rebuild
+        _write(os.path.join('piece-lys', 'notes.ly'), b'{ g4 a b c }\n' * 50)
+        _write('piece.preview.svg', b'<svg/>')
+        mupub.collect_assets('piece')
+        self.assertNotEqual(os.stat('piece-lys.zip').st_mtime, 1)
+        with zipfile.ZipFile('piece-lys.zip') as lyzip:
+            self.assertIsNone(lyzip.testzip())
+            self.assertEqual(lyzip.read('piece-lys/notes.ly'),
+                             b'{ g4 a b c }\n' * 50)
+            self.assertEqual(lyzip.read('piece-lys/piece.ly'),
+                             b'\\include "notes.ly"\n' * 50)
+
+
+    def test_without_raw_copy(self):
+        """Members are compressed again if zipfile internals change"""
+        saved = mupub.archive._ZIP_ATTRIBUTES
+        self.addCleanup(setattr, mupub.archive, '_ZIP_ATTRIBUTES', saved)
+        mupub.archive._ZIP_ATTRIBUTES = saved + ('_no_such_attribute',)
+        _write('one.mid', b'MThd' * 100)
+        _write('two.mid', b'MThd' * 100)
+        mupub.collect_assets('piece')
+        _write('one.mid', b'MThd' * 100)
+        _write('two.mid', b'MThd' * 200)
+        _write('piece.preview.svg', b'<svg/>')
+        mupub.collect_assets('piece')
+        with zipfile.ZipFile('piece-mids.zip') as midzip:
+            self.assertIsNone(midzip.testzip())
+            self.assertEqual(midzip.read('two.mid'), b'MThd' * 200)
+        self.assertEqual(glob.glob('*.tmp'), [])
+
+
+    def test_digests(self):
+        """Output digests are published and match the files"""
+        _write('piece-a4.ps', b'%!PS\n' * 500)
+        _write('one.mid', b'MThd')
+        _write('two.mid', b'MThd')
+        _write('piece-let.pdf', b'%PDF-1.4')
+        assets = mupub.collect_assets('piece')
+        with open('piece-digests.json') as dfile:
+            digests = json.load(dfile)
+        self.assertEqual(sorted(digests),
+                         sorted(['piece.ly', 'piece-mids.zip',
+                                 'piece-a4.ps.gz', 'piece-let.pdf',
+                                 'piece-preview.svg']))
+        for name, entry in digests.items():
+            self.assertEqual(entry['sha256'], mupub.archive.file_hash(name))
+            self.assertEqual(entry['size'], os.path.getsize(name))
+        with zipfile.ZipFile(assets['midFile']) as midzip:
+            self.assertIsNone(midzip.testzip())
+
+
+    def test_unchanged(self):
+        """Rebuilt outputs with the same content are left in place"""
+        def _build():
+            _write('piece-a4.ps', b'%!PS\n' * 500)
+            _write('one.mid', b'MThd')
+            _write('two.mid', b'MThd')
+            _write('piece.preview.svg', b'<svg/>')
+            # zip members carry their modification time
+            for name in ['one.mid', 'two.mid']:
+                os.utime(name, (1e9, 1e9))
+
+        _build()
+        changed = []
+        mupub.collect_assets('piece', changed=changed)
+        self.assertEqual(changed, ['piece-a4.ps.gz', 'piece-mids.zip',
+                                   'piece-preview.svg', 'piece.ly'])
+        outputs = ['piece-a4.ps.gz', 'piece-mids.zip', 'piece-preview.svg']
+        for name in outputs:
+            os.utime(name, (1, 1))
+
+        # archives are rebuilt, without the manifest, to the same bytes
+        os.unlink(mupub.archive.manifest_path('piece'))
+        _build()
+        changed = []
+        mupub.collect_assets('piece', changed=changed)
+        self.assertEqual(changed, [])
+        for name in outputs:
+            self.assertEqual(os.path.getmtime(name), 1)
+        self.assertEqual(glob.glob('*.tmp'), [])
+
+        _build()
+        _write('two.mid', b'MThd\0')
+        changed = []
+        mupub.collect_assets('piece', changed=changed)
+        self.assertEqual(changed, ['piece-mids.zip'])
+
+
+    def test_hashed_as_written(self):
+        """Archives and renamed outputs are not read back to hash them"""
+        for limit in [mupub.compress.HOLD_LIMIT, 10]:
+            with open('test.zip', 'wb') as outfile:
+                writer = mupub.compress.ZipHashingWriter(outfile, limit)
+                with zipfile.ZipFile(writer, 'w',
+                                     compression=zipfile.ZIP_DEFLATED) as outzip:
+                    outzip.writestr('a.txt', b'a' * 1000)
+                    outzip.writestr('b.txt', b'b' * 1000)
+            digest = writer.digest()
+            if limit == 10:
+                self.assertIsNone(digest)
+            else:
+                self.assertEqual(digest, (mupub.archive.file_hash('test.zip'),
+                                          os.path.getsize('test.zip')))
+        os.unlink('test.zip')
+
+        hashed = []
+        file_hash = mupub.archive.file_hash
+        def _hash(path):
+            hashed.append(path)
+            return file_hash(path)
+        self.addCleanup(setattr, mupub.archive, 'file_hash', file_hash)
+        mupub.archive.file_hash = _hash
+        _write('one.mid', b'MThd')
+        _write('two.mid', b'MThd')
+        _write('piece-let.pdf', b'%PDF-1.4')
+        _write('part-a4.pdf', b'%PDF-1.4')
+        mupub.collect_assets('piece')
+        self.assertEqual(sorted(hashed), ['one.mid', 'part-a4.pdf',
+                                          'piece-let.pdf', 'piece.ly',
+                                          'piece.preview.svg', 'two.mid'])
+        with open('piece-digests.json') as dfile:
+            for name, entry in json.load(dfile).items():
+                self.assertEqual(entry['sha256'], file_hash(name))
+
+
+    def test_bad_raw_copy(self):
+        """A raw copy that does not read back is compressed again"""
+        copy_raw = mupub.archive._copy_raw
+        def _bad_copy(src, dest, info):
+            copy_raw(src, dest, info)
+            dest.filelist[-1].CRC ^= 1
+        self.addCleanup(setattr, mupub.archive, '_copy_raw', copy_raw)
+        mupub.archive._copy_raw = _bad_copy
+        _write('one.mid', b'MThd' * 100)
+        _write('two.mid', b'MThd' * 100)
+        mupub.collect_assets('piece')
+        _write('one.mid', b'MThd' * 100)
+        _write('two.mid', b'MThd' * 200)
+        _write('piece.preview.svg', b'<svg/>')
+        with self.assertLogs('mupub.archive', 'WARNING'):
+            mupub.collect_assets('piece')
+        with zipfile.ZipFile('piece-mids.zip') as midzip:
+            self.assertIsNone(midzip.testzip())
+            self.assertEqual(midzip.read('one.mid'), b'MThd' * 100)
+        self.assertEqual(glob.glob('*.tmp'), [])
+
+
+    def test_set_changes_size(self):
+        """The archive of a set is removed when it takes another form"""
+        _write('one.mid', b'MThd')
+        _write('two.mid', b'MThd')
+        _write('piece-a4.ps', b'%!PS\n')
+        mupub.collect_assets('piece', rebuilt=True)
+        self.assertTrue(os.path.exists('piece-mids.zip'))
+        self.assertTrue(os.path.exists('piece-a4.ps.gz'))
+
+        _write('piece.mid', b'MThd')
+        _write('one-a4.ps', b'%!PS\n')
+        _write('two-a4.ps', b'%!PS\n')
+        _write('piece.preview.svg', b'<svg/>')
+        assets = mupub.collect_assets('piece', rebuilt=True)
+        self.assertEqual(assets['midFile'], 'piece.mid')
+        self.assertEqual(assets['psFileA4'], 'piece-a4-pss.zip')
+        self.assertFalse(os.path.exists('piece-mids.zip'))
+        self.assertFalse(os.path.exists('piece-a4.ps.gz'))
+        manifest = mupub.archive.ArchiveManifest('piece')
+        self.assertIsNone(manifest.get('piece-mids.zip'))
+        self.assertIsNone(manifest.get('piece-a4.ps.gz'))
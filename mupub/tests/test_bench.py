@@ -0,0 +1,52 @@
+"""Compiler benchmark tests
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import mupub
+from mupub.commands import bench
+
+
+class _Locator():
+    """Finds a do-nothing compiler for every version."""
+    located = []
+
+    def __init__(self, version, progress_bar=False):
+        self.version = version
+
+    def working_path(self):
+        _Locator.located.append(self.version)
+        return '/bin/true'
+
+
+class BenchTest(TestCase):
+    """Benchmark argument handling"""
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='bench_')
+        self.piece = os.path.join(self.dirpath, 'piece')
+        os.mkdir(self.piece)
+        with open(os.path.join(self.piece, 'piece.ly'), 'w') as lyfile:
+            lyfile.write('\\version "2.18.2"\n')
+        del _Locator.located[:]
+        self.addCleanup(setattr, mupub, 'LyLocator', mupub.LyLocator)
+        mupub.LyLocator = _Locator
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_split(self):
+        """Versions are split, repeats and invalid ones dropped"""
+        self.assertEqual(bench.split_versions(' 2.18.2,2.24.3,,2.18.2-1, x.y '),
+                         ['2.18.2', '2.24.3'])
+
+
+    def test_repeated_version(self):
+        """A repeated version is built once"""
+        bench.main([self.piece, '--versions', '2.18.2,2.18.2,2.24.3',
+                    '--jobs', '2'])
+        self.assertEqual(_Locator.located, ['2.18.2', '2.24.3'])
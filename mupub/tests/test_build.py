@@ -1,9 +1,13 @@
 """Test cases for mupub.commands.build
 """
+import glob
 import os
+import shutil
+import tempfile
 import unittest
 from .tutils import PREFIX
 import mupub
+from mupub.commands import build as build_command
 
 _HERE = os.getcwd()
 _TEST_PATH = os.path.join(PREFIX, 'AguadoD', 'aminor-study')
@@ -29,3 +33,98 @@ class CheckTest(unittest.TestCase):
                     database='default',
                     verbose=False,
                     collect_only=False)
+
+
+_HEADER = """\\version "2.18.2"
+\\header {
+  title = "Study"
+  composer = "AguadoD"
+  instrument = "Guitar"
+  style = "Classical"
+  license = "Creative Commons Attribution 4.0"
+  maintainer = "Someone"
+  source = "Somewhere"
+}
+"""
+
+
+class _Run():
+    def __init__(self):
+        self.outputs = []
+        self.returncode = 0
+
+    def succeeded(self):
+        return True
+
+
+class _Runner():
+    """Stands in for LilyPond, writing the files it would."""
+    labels = []
+
+    def __init__(self):
+        self.runs = []
+
+    def run(self, command, label=None, cwd=None, timeout=None):
+        _Runner.labels.append(label)
+        if '--format=pdf' in command:
+            for name in ['piece.pdf', 'piece.ps']:
+                with open(name, 'w') as outfile:
+                    outfile.write(label)
+        else:
+            with open('piece.preview.svg', 'w') as outfile:
+                outfile.write('<svg width="10" height="10"/>')
+            with open('piece.midi', 'w') as outfile:
+                outfile.write('MThd')
+        return _Run()
+
+
+class StagesTest(unittest.TestCase):
+    """Resuming a build at the first stage that needs it"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='build_')
+        # the folder names the piece
+        os.mkdir(os.path.join(self.dirpath, 'piece'))
+        os.chdir(os.path.join(self.dirpath, 'piece'))
+        with open('piece.ly', 'w') as lyfile:
+            lyfile.write(_HEADER)
+        _Runner.labels = []
+        for module, name, value in [
+                (mupub.commands.init, 'verify_init', lambda: True),
+                (build_command, '_resolve_compiler', lambda v: 'lilypond'),
+                (mupub, 'LyRunner', _Runner)]:
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def _build(self, **options):
+        _Runner.labels = []
+        mupub.build(infile=[], header_file=None, parts_folder=None,
+                    skip_header_check=True, **options)
+        return _Runner.labels
+
+
+    def test_collect_only_change(self):
+        """Options of the collection do not run LilyPond again"""
+        self.assertEqual(self._build(),
+                         ['piece (a4)', 'piece (letter)', 'piece (preview)'])
+        self.assertEqual(sorted(glob.glob('piece-*')),
+                         ['piece-a4.pdf', 'piece-a4.ps.gz', 'piece-archives.json',
+                          'piece-checkpoint.json', 'piece-digests.json',
+                          'piece-let.pdf', 'piece-let.ps.gz',
+                          'piece-preview.svg'])
+        self.assertEqual(self._build(), [])
+        # the preview is collected again as published
+        self.assertEqual(self._build(optimize_preview=True), [])
+        self.assertEqual(self._build(optimize_pdf=True), [])
+        self.assertTrue(os.path.exists('piece-preview.svg'))
+        self.assertTrue(os.path.exists('piece.rdf'))
+        # a PNG preview needs LilyPond, the scores do not
+        self.assertEqual(self._build(force_png_preview=True),
+                         ['piece (preview)'])
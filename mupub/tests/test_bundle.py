@@ -0,0 +1,60 @@
+"""Publication bundle tests
+"""
+
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+import mupub
+
+
+class BundleTest(TestCase):
+    """Bundle writing and reading"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='bundle_')
+        os.chdir(self.dirpath)
+        self.files = {'piece.rdf': b'<rdf/>\n',
+                      'piece-a4.pdf': os.urandom(70000),
+                      'piece.ly': b''}
+        for name, data in self.files.items():
+            with open(name, 'wb') as outfile:
+                outfile.write(data)
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_roundtrip(self):
+        """Members are found through the trailing index"""
+        mupub.write_bundle('piece-bundle.tar', sorted(self.files))
+        with tarfile.open('piece-bundle.tar') as tar:
+            self.assertEqual(tar.getnames(),
+                             sorted(self.files) + [mupub.bundle.INDEX_NAME])
+        mupub.unbundle('piece-bundle.tar', ['piece-a4.pdf'], dest='out')
+        self.assertEqual(os.listdir('out'), ['piece-a4.pdf'])
+        mupub.unbundle('piece-bundle.tar', [], dest='out')
+        for name, data in self.files.items():
+            with open(os.path.join('out', name), 'rb') as infile:
+                self.assertEqual(infile.read(), data)
+
+
+    def test_damaged(self):
+        """Damaged members and files that are not bundles are rejected"""
+        mupub.write_bundle('piece-bundle.tar', sorted(self.files))
+        with open('piece-bundle.tar', 'rb') as bfile:
+            index = mupub.read_index(bfile)
+        with open('piece-bundle.tar', 'r+b') as bfile:
+            bfile.seek(index['piece-a4.pdf']['offset'] + 100)
+            bfile.write(b'X')
+        with open('piece-bundle.tar', 'rb') as bfile:
+            with self.assertRaises(ValueError):
+                mupub.bundle.extract_member(bfile, index['piece-a4.pdf'], 'x.pdf')
+        self.assertFalse(os.path.exists('x.pdf'))
+        with open('piece.rdf', 'rb') as bfile:
+            with self.assertRaises(ValueError):
+                mupub.read_index(bfile)
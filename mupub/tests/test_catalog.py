@@ -0,0 +1,86 @@
+"""Catalog tests
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+import mupub
+
+
+def _write_rdf(path, **fields):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rdf = mupub.MuRDF()
+    for name, value in fields.items():
+        rdf.update_description(name, value)
+    rdf.write_xml(path)
+
+
+class CatalogTest(TestCase):
+    """RDF catalog testing"""
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='catalog_')
+        self.top = os.path.join(self.dirpath, 'ftp')
+        _write_rdf(os.path.join(self.top, 'SorF', 'O5', 'sor-op5-5', 'sor-op5-5.rdf'),
+                   title='Andante Largo', composer='SorF',
+                   lilypondVersion='2.18.2',
+                   licence='Creative Commons Attribution-ShareAlike 2.5',
+                   **{'for': 'Guitar'})
+        _write_rdf(os.path.join(self.top, 'BachJS', 'BWV846', 'bwv846', 'bwv846.rdf'),
+                   title='Prelude in C', composer='BachJS',
+                   lilypondVersion='2.24.3', licence='Public Domain',
+                   **{'for': 'Harpsichord, Piano'})
+        self.catalog = mupub.Catalog(os.path.join(self.dirpath, 'catalog.db'))
+
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_query(self):
+        """Filtered lookups"""
+        self.assertEqual(self.catalog.update(self.top), (2, 0, 0))
+        rows = self.catalog.query(composer='sorf')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['title'], 'Andante Largo')
+        self.assertEqual(rows[0]['for'], 'Guitar')
+        self.assertEqual(rows[0]['path'],
+                         os.path.join('SorF', 'O5', 'sor-op5-5', 'sor-op5-5.rdf'))
+        self.assertEqual(len(self.catalog.query(instrument='piano')), 1)
+        self.assertEqual(len(self.catalog.query(version='2.18')), 1)
+        self.assertEqual(len(self.catalog.query(version='2.1')), 0)
+        self.assertEqual(len(self.catalog.query(licence='Public', composer='SorF')), 0)
+        self.assertEqual(len(self.catalog.query()), 2)
+        # wildcards in values are matched literally
+        self.assertEqual(len(self.catalog.query(title='%')), 0)
+        self.assertEqual(len(self.catalog.query(version='2_18')), 0)
+        with self.assertRaises(ValueError):
+            self.catalog.query(opus='5')
+
+
+    def test_incremental(self):
+        """Only changed files are read, removed files are dropped"""
+        self.catalog.update(self.top)
+        self.assertEqual(self.catalog.update(self.top), (0, 0, 2))
+        sor = os.path.join(self.top, 'SorF', 'O5', 'sor-op5-5', 'sor-op5-5.rdf')
+        _write_rdf(sor, title='Andante', composer='SorF')
+        os.utime(sor, (1, 1))
+        os.unlink(os.path.join(self.top, 'BachJS', 'BWV846', 'bwv846', 'bwv846.rdf'))
+        self.assertEqual(self.catalog.update(self.top), (1, 1, 0))
+        rows = self.catalog.query()
+        self.assertEqual([r['title'] for r in rows], ['Andante'])
+
+
+    def test_new_column(self):
+        """A catalog made before a field was added is extended"""
+        self.catalog.close()
+        path = os.path.join(self.dirpath, 'catalog.db')
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute('ALTER TABLE pieces DROP COLUMN "pngSrcset"')
+        conn.close()
+        self.catalog = mupub.Catalog(path)
+        self.assertEqual(self.catalog.update(self.top), (2, 0, 0))
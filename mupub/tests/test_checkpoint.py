@@ -0,0 +1,67 @@
+"""Build checkpoint tests
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import mupub
+
+
+class CheckpointTest(TestCase):
+    """Checkpoint testing"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='ckpt_')
+        os.chdir(self.dirpath)
+        with open('piece.ly', 'w') as lyfile:
+            lyfile.write('\\version "2.18.2"\n')
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_fingerprint(self):
+        """Fingerprints follow content and extras"""
+        first = mupub.fingerprint(['piece.ly'], '2.18.2')
+        self.assertEqual(first, mupub.fingerprint(['piece.ly'], '2.18.2'))
+        self.assertNotEqual(first, mupub.fingerprint(['piece.ly'], '2.19.0'))
+        with open('piece.ly', 'a') as lyfile:
+            lyfile.write('{ c4 }\n')
+        self.assertNotEqual(first, mupub.fingerprint(['piece.ly'], '2.18.2'))
+
+
+    def test_resume(self):
+        """Completed stages persist and are current"""
+        fprint = mupub.fingerprint(mupub.source_files('piece'))
+        with open('piece-a4.pdf', 'w') as pdf:
+            pdf.write('pdf')
+        ckpt = mupub.Checkpoint('piece')
+        ckpt.complete('scores', fprint, ['piece-a4.pdf'])
+        ckpt.fail('preview')
+
+        ckpt = mupub.Checkpoint('piece')
+        self.assertTrue(ckpt.is_current('scores', fprint))
+        self.assertFalse(ckpt.is_current('scores', 'other'))
+        self.assertFalse(ckpt.is_current('preview', fprint))
+        self.assertEqual(ckpt.status('preview'), 'failed')
+
+        # a missing output invalidates the stage
+        os.unlink('piece-a4.pdf')
+        self.assertFalse(ckpt.is_current('scores', fprint))
+
+        ckpt.clear()
+        self.assertFalse(os.path.exists(mupub.checkpoint.checkpoint_path('piece')))
+
+
+    def test_missing_preview(self):
+        """Collection without a preview leaves scores in place"""
+        with open('piece-a4.ps', 'w') as psfile:
+            psfile.write('%!PS')
+        with self.assertRaises(mupub.IncompleteBuild):
+            mupub.collect_assets('piece')
+        self.assertTrue(os.path.exists('piece-a4.ps'))
+        self.assertFalse(os.path.exists('piece-a4.ps.gz'))
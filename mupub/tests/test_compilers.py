@@ -0,0 +1,98 @@
+"""Compiler prefetch tests
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+import mupub
+from mupub.commands import compilers
+
+
+def _piece(top, name, version, lys=False):
+    folder = os.path.join(top, name)
+    header = '\\version "{}"\n\\header {{ title = "x" }}\n'.format(version)
+    if lys:
+        os.makedirs(os.path.join(folder, name+'-lys'))
+        path = os.path.join(folder, name+'-lys', 'notes.ily')
+    else:
+        os.makedirs(folder)
+        path = os.path.join(folder, name+'.ly')
+    with open(path, 'w') as lyfile:
+        lyfile.write(header)
+
+
+class PrefetchTest(TestCase):
+    """Installing the compilers an archive needs"""
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp(prefix='prefetch_')
+        self.cache = tempfile.mkdtemp(prefix='lycache_')
+        _piece(self.top, 'a', '2.18.2')
+        _piece(self.top, 'b', '2.18.2')
+        _piece(self.top, 'c', '2.24.3', lys=True)
+        _piece(self.top, 'd', '2.16.0')
+        _piece(self.top, 'e', '2.19.x')
+        os.mkdir(os.path.join(self.cache, '2.16.0'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.top, ignore_errors=True)
+        shutil.rmtree(self.cache, ignore_errors=True)
+
+
+    def test_needed(self):
+        """Each distinct version is counted once"""
+        needed = compilers.needed_versions(self.top)
+        self.assertEqual(needed, {mupub.LyVersion('2.16.0'): 1,
+                                  mupub.LyVersion('2.18.2'): 2,
+                                  mupub.LyVersion('2.24.3'): 1})
+
+
+    def test_prefetch(self):
+        """Missing compilers are installed, one at a time"""
+        saved = mupub.lily.LYCACHE
+        mupub.lily.LYCACHE = self.cache
+        self.addCleanup(setattr, mupub.lily, 'LYCACHE', saved)
+        fetched = []
+        workers = set()
+        running = []
+        overlap = []
+        lock = threading.Lock()
+
+        def fetch_script(installer, version):
+            # downloads are not held up by the install running
+            if version.version == '2.24.3':
+                time.sleep(0.05)
+                self.assertTrue(running)
+            fetched.append(str(version))
+            workers.add(installer.workers)
+            return 'url', 'script', 'sha'
+
+        def run_script(installer, version, script):
+            with lock:
+                running.append(version)
+                overlap.append(len(running))
+            time.sleep(0.2)
+            os.mkdir(version.cache_folder())
+            mupub.lyregistry.compiler_registry().add(version, version.version)
+            with lock:
+                running.remove(version)
+            return version.version != '2.24.3'
+
+        for name, func in [('fetch_script', fetch_script),
+                           ('run_script', run_script)]:
+            self.addCleanup(setattr, mupub.lily.LinuxInstaller, name,
+                            getattr(mupub.lily.LinuxInstaller, name))
+            setattr(mupub.lily.LinuxInstaller, name, func)
+
+        # a single download thread, free while the first install runs
+        failed = mupub.prefetch(self.top, jobs=1, installs=1)
+        self.assertEqual(sorted(fetched), ['2.18.2', '2.24.3'])
+        # all connections fit in the session's pool
+        self.assertTrue(workers.pop() <= mupub.utils.HTTP_POOL_SIZE)
+        self.assertEqual(max(overlap), 1)
+        self.assertEqual(failed, [mupub.LyVersion('2.24.3')])
+        self.assertEqual(len(mupub.lyregistry.compiler_registry()), 3)
@@ -0,0 +1,158 @@
+"""Resumable download tests
+"""
+
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+import mupub
+
+_DATA = os.urandom(3 * 1024 * 1024 + 123)
+_ETAG = '"v2"'
+
+
+class _Files(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ranges = []
+    # bytes sent before dropping the connection, None for all
+    cut = None
+    # answer ranged requests with the whole file, as some proxies do
+    whole = False
+
+    def _headers(self, status, start, end):
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', _ETAG)
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range',
+                             'bytes {0}-{1}/{2}'.format(start, end - 1, len(_DATA)))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, 0, len(_DATA))
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if _Files.whole or self.headers.get('If-Range', _ETAG) != _ETAG:
+            match = None
+        start, end = 0, len(_DATA)
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = int(match.group(2)) + 1
+            self.ranges.append((start, end))
+            if start >= len(_DATA):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(_DATA)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self._headers(206 if match else 200, start, end)
+        cut = _Files.cut
+        if cut is not None:
+            _Files.cut = None
+            self.wfile.write(_DATA[start:start+cut])
+            self.close_connection = True
+            return
+        self.wfile.write(_DATA[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTest(TestCase):
+    """Downloads with resume and parallel ranges"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Files)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:{}/lilypond.sh'.format(cls.server.server_port)
+        cls.sha = hashlib.sha256(_DATA).hexdigest()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='download_')
+        self.path = os.path.join(self.dirpath, 'lilypond.sh')
+        del _Files.ranges[:]
+        _Files.cut = None
+        _Files.whole = False
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def _check(self, result):
+        self.assertEqual(result, (self.sha, len(_DATA)))
+        self.assertTrue(mupub.download.verify(self.path, self.sha))
+        self.assertFalse(os.path.exists(self.path + '.part'))
+        self.assertFalse(os.path.exists(self.path + '.part.validator'))
+
+
+    def _part(self, data, validator):
+        with open(self.path + '.part', 'wb') as part:
+            part.write(data)
+        with open(self.path + '.part.validator', 'w') as vfile:
+            vfile.write(validator)
+
+
+    def test_resume(self):
+        """A partial download is continued, not restarted"""
+        self._part(_DATA[:1000], _ETAG)
+        self._check(mupub.fetch(self.url, self.path))
+        self.assertEqual(_Files.ranges, [(1000, len(_DATA))])
+
+
+    def test_stale_part(self):
+        """A partial file of another version is not continued"""
+        self._part(os.urandom(1000), '"v1"')
+        self._check(mupub.fetch(self.url, self.path))
+        self.assertEqual(_Files.ranges, [])
+
+
+    def test_interrupted(self):
+        """A dropped connection is resumed by the next attempt"""
+        # the block being read when the connection drops is lost
+        _Files.cut = 1500000
+        seen = []
+        self._check(mupub.fetch(self.url, self.path,
+                                callback=lambda done, total: seen.append(done)))
+        self.assertEqual(_Files.ranges, [(mupub.download.CHUNK_SIZE, len(_DATA))])
+        self.assertEqual(seen[-1], len(_DATA))
+
+
+    def test_parallel(self):
+        """Large files are fetched as ranges at once"""
+        saved = mupub.download.PARALLEL_THRESHOLD
+        mupub.download.PARALLEL_THRESHOLD = 1024 * 1024
+        self.addCleanup(setattr, mupub.download, 'PARALLEL_THRESHOLD', saved)
+        self._check(mupub.fetch(self.url, self.path, workers=3))
+        self.assertEqual(sorted(_Files.ranges)[0][0], 0)
+        self.assertEqual(len(_Files.ranges), 3)
+
+
+    def test_ranges_ignored(self):
+        """Ranges answered with the whole file fall back to one stream"""
+        saved = mupub.download.PARALLEL_THRESHOLD
+        mupub.download.PARALLEL_THRESHOLD = 1024 * 1024
+        self.addCleanup(setattr, mupub.download, 'PARALLEL_THRESHOLD', saved)
+        _Files.whole = True
+        self._check(mupub.fetch(self.url, self.path, workers=3))
+
+
+    def test_complete_part(self):
+        """A complete partial file needs no data"""
+        self._part(_DATA, _ETAG)
+        self._check(mupub.fetch(self.url, self.path))
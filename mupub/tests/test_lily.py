@@ -0,0 +1,117 @@
+"""LilyPond interaction tests
+"""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from unittest import TestCase
+import mupub
+
+_PROGRESS = [
+    'GNU LilyPond 2.18.2\nProcessing `foo.ly\'\nPars',
+    'ing...\nInterpreting music...[8]',
+    '[16]\nfoo.ly:12:3: warning: barcheck failed at: 1/4\n',
+    'Preprocessing graphical objects...\n'
+    'Finding the ideal number of pages...\n'
+    'Fitting music on 3 or 4 pages...\n'
+    'Drawing systems...\n'
+    'Layout output to `foo.ps\'...\n'
+    'Converting to `./foo.pdf\'...\n'
+    'Success: compilation successfully completed\n',
+]
+
+
+class ProgressTest(TestCase):
+    """LilyPond progress parsing"""
+
+    def test_phases(self):
+        """Phases are timestamped when first seen"""
+        clock = iter(range(100))
+        progress = mupub.LyProgress(clock=lambda: next(clock))
+        for chunk in _PROGRESS:
+            progress.feed(chunk)
+        progress.close()
+        names = [name for name,_ in progress.phases]
+        self.assertEqual(names, ['parsing', 'interpreting', 'preprocessing',
+                                 'fitting', 'drawing', 'output', 'converting'])
+        # interpreting starts on the partial line, not when it ends
+        self.assertEqual(dict(progress.phases)['interpreting'], 2)
+        self.assertEqual(progress.pages, 3)
+        durations = progress.durations()
+        self.assertEqual(durations['interpreting'], 2)
+        self.assertEqual(sum(durations.values()), progress.end - progress.start)
+
+
+    def test_messages(self):
+        """Warnings and errors carry their location"""
+        progress = mupub.LyProgress()
+        progress.feed(_PROGRESS[2])
+        progress.feed('foo.ly:20:7: error: syntax error, unexpected }\n')
+        progress.feed('warning: no \\version statement found\n')
+        progress.close()
+        self.assertEqual(len(progress.warnings()), 2)
+        errors = progress.errors()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].line, 20)
+        self.assertEqual(errors[0].column, 7)
+        self.assertEqual(progress.warnings()[1].file, None)
+
+
+    def test_runner(self):
+        """The runner parses stderr of a live process"""
+        script = 'import sys; sys.stderr.write("Parsing...\\nDrawing systems...\\n")'
+        runner = mupub.LyRunner()
+        lyrun = runner.run([sys.executable, '-c', script], label='fake')
+        self.assertTrue(lyrun.succeeded())
+        self.assertEqual([n for n,_ in lyrun.progress.phases],
+                         ['parsing', 'drawing'])
+        self.assertEqual(len(runner.runs), 1)
+        self.assertTrue(lyrun.max_rss > 0)
+        report = mupub.timing_report(runner.runs)
+        self.assertTrue(report[1].startswith('fake'))
+
+
+    def test_timeout(self):
+        """Runs are killed after the timeout"""
+        script = 'import sys, time; sys.stderr.write("Parsing...\\n"); time.sleep(30)'
+        lyrun = mupub.LyRunner().run([sys.executable, '-c', script], timeout=0.5)
+        self.assertTrue(lyrun.timed_out)
+        self.assertFalse(lyrun.succeeded())
+        self.assertTrue(lyrun.wall < 10)
+        self.assertEqual(lyrun.returncode, -signal.SIGKILL)
+
+
+    def test_exit_code(self):
+        """The exit status of a failed run is kept"""
+        lyrun = mupub.LyRunner().run([sys.executable, '-c', 'raise SystemExit(3)'])
+        self.assertEqual(lyrun.returncode, 3)
+
+
+class InstallerTest(TestCase):
+    """Running fetched install scripts"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='lyinstall_')
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.script = os.path.join(self.folder, 'install.sh')
+        with open(self.script, 'w') as script:
+            script.write('exit 0\n')
+        self.sha = mupub.download.file_digest(self.script).hexdigest()
+
+
+    def test_changed_script(self):
+        """A script changed since it was fetched is not run"""
+        calls = []
+        saved = mupub.lily.subprocess.check_call
+        self.addCleanup(setattr, mupub.lily.subprocess, 'check_call', saved)
+        mupub.lily.subprocess.check_call = calls.append
+        with open(self.script, 'a') as script:
+            script.write('echo tampered\n')
+        installer = mupub.lily.LinuxInstaller(progress_bar=False)
+        fetched = ('url', self.script, self.sha)
+        self.assertFalse(installer.run_script(mupub.LyVersion('2.18.2'), fetched))
+        os.unlink(self.script)
+        self.assertFalse(installer.run_script(mupub.LyVersion('2.18.2'), fetched))
+        self.assertEqual(calls, [])
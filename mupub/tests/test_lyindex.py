@@ -0,0 +1,179 @@
+"""Compiler listing cache tests
+"""
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import requests
+from unittest import TestCase
+import mupub
+
+_PAGES = {
+    '/binaries/': '<html><body><a href="../">Parent</a>\n'
+                  '<a href="linux-64/">linux-64/</a>\n'
+                  '<a HREF=\'linux-x86/\'>linux-x86/</a></body></html>',
+    '/binaries/linux-64/': '<a href="lilypond-2.18.2-1.linux-64.sh">x</a>\n'
+                           '<a href="lilypond-2.19.0-1.linux-64.sh">x</a>\n'
+                           '<a href="lilypond-2.18.2-2.linux-64.sh">x</a>',
+}
+
+
+class _Listing(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        etag = '"{}"'.format(len(_PAGES.get(self.path, '')))
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/flaky/' and len(self.requests) == 1:
+            self.send_error(503)
+        elif self.path == '/flaky/':
+            self.path = '/binaries/'
+            self.do_GET()
+        elif self.path == '/down/':
+            if len(self.requests) > 1:
+                self.send_error(503)
+                return
+            self.path = '/binaries/'
+            self.do_GET()
+        elif self.path not in _PAGES:
+            self.send_error(404)
+        elif self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            body = _PAGES[self.path].encode('utf-8')
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ListingCacheTest(TestCase):
+    """Cached download listings"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.HTTPServer(('127.0.0.1', 0), _Listing)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:{}/binaries/'.format(cls.server.server_port)
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='lyindex_')
+        del _Listing.requests[:]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+    def test_parse(self):
+        """Links and install scripts are found without an HTML parser"""
+        self.assertEqual(mupub.lyindex.parse_links(_PAGES['/binaries/']),
+                         ['../', 'linux-64/', 'linux-x86/'])
+        links = mupub.lyindex.parse_links(_PAGES['/binaries/linux-64/'])
+        self.assertEqual(list(mupub.lyindex.install_scripts(links)),
+                         ['2.18.2-1', '2.19.0-1', '2.18.2-2'])
+
+
+    def test_revalidate(self):
+        """Listings are cached, then revalidated once stale"""
+        cache = mupub.ListingCache(self.folder, ttl=3600)
+        self.assertIn('linux-64/', cache.links(self.url))
+        self.assertIn('linux-64/', cache.links(self.url))
+        self.assertEqual(_Listing.requests, [('/binaries/', None)])
+
+        stale = mupub.ListingCache(self.folder, ttl=0)
+        self.assertIn('linux-64/', stale.links(self.url))
+        self.assertEqual(_Listing.requests[-1], ('/binaries/', '"{}"'.format(
+            len(_PAGES['/binaries/']))))
+        self.assertIsNone(cache.links(self.url + 'missing/'))
+
+
+    def test_defaults(self):
+        """The configured time to live is used by default"""
+        cache = mupub.ListingCache()
+        self.assertEqual(cache.ttl, mupub.CONFIG_DICT['common'].getint(
+            'index_ttl', mupub.lyindex.DEFAULT_TTL))
+        self.assertEqual(cache.folder, os.path.join(mupub.lily.LYCACHE, 'index'))
+
+
+    def test_server_error(self):
+        """A stale listing is used while the server fails"""
+        url = self.url.replace('binaries', 'down')
+        self.assertIn('linux-64/', mupub.ListingCache(self.folder).links(url))
+        # without the retries of the shared session
+        stale = mupub.ListingCache(self.folder, ttl=0, session=requests.Session())
+        self.assertIn('linux-64/', stale.links(url))
+        self.assertEqual([r[0] for r in _Listing.requests],
+                         ['/down/', '/binaries/', '/down/'])
+
+
+    def test_session(self):
+        """One session is shared, server errors are retried"""
+        session = mupub.utils.http_session()
+        self.assertIs(session, mupub.utils.http_session())
+        cache = mupub.ListingCache(self.folder)
+        self.assertIs(cache.session, session)
+        self.assertIn('linux-64/', cache.links(self.url.replace('binaries', 'flaky')))
+        self.assertEqual([r[0] for r in _Listing.requests],
+                         ['/flaky/', '/flaky/', '/binaries/'])
+
+
+    def test_install_script(self):
+        """The first script of the version is chosen"""
+        cache = mupub.ListingCache(self.folder, ttl=3600)
+        saved = dict(mupub.CONFIG_DICT['common'])
+        self.addCleanup(mupub.CONFIG_DICT['common'].update, saved)
+        mupub.CONFIG_DICT['common']['download_url'] = self.url
+        mupub.CONFIG_DICT['common']['download_url_fallback'] = self.url + 'missing/'
+        version = mupub.LyVersion('2.18.2')
+        self.assertEqual(version.get_install_script('linux-64', cache),
+                         self.url + 'linux-64/lilypond-2.18.2-1.linux-64.sh')
+        self.assertIsNone(version.get_install_script('linux-arm', cache))
+        self.assertIsNone(mupub.LyVersion('2.20.0').get_install_script('linux-64',
+                                                                       cache))
+
+
+    def test_new_release(self):
+        """A miss in a fresh listing revalidates it once"""
+        cache = mupub.ListingCache(self.folder, ttl=3600)
+        saved = dict(mupub.CONFIG_DICT['common'])
+        self.addCleanup(mupub.CONFIG_DICT['common'].update, saved)
+        mupub.CONFIG_DICT['common']['download_url'] = self.url
+        mupub.CONFIG_DICT['common'].pop('download_url_fallback', None)
+        self.assertIsNone(mupub.LyVersion('2.20.0').get_install_script('linux-64',
+                                                                       cache))
+        # fetched by this cache, nothing to revalidate
+        self.assertEqual([r[0] for r in _Listing.requests],
+                         ['/binaries/', '/binaries/linux-64/'])
+
+        listing = '/binaries/linux-64/'
+        self.addCleanup(_PAGES.__setitem__, listing, _PAGES[listing])
+        _PAGES[listing] += '\n<a href="lilypond-2.20.0-1.linux-64.sh">x</a>'
+        del _Listing.requests[:]
+        cache = mupub.ListingCache(self.folder, ttl=3600)
+        self.assertEqual(mupub.LyVersion('2.20.0').get_install_script('linux-64',
+                                                                      cache),
+                         self.url + 'linux-64/lilypond-2.20.0-1.linux-64.sh')
+        self.assertEqual([r[0] for r in _Listing.requests],
+                         ['/binaries/', '/binaries/linux-64/'])
+        self.assertTrue(all(r[1] for r in _Listing.requests))
+
+        # once per listing
+        del _Listing.requests[:]
+        self.assertIsNone(mupub.LyVersion('2.22.0').get_install_script('linux-64',
+                                                                       cache))
+        self.assertEqual(_Listing.requests, [])
@@ -0,0 +1,73 @@
+"""Compiler registry tests
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import mupub
+
+
+class RegistryTest(TestCase):
+    """Installed compiler registry"""
+
+    def setUp(self):
+        self.cache = tempfile.mkdtemp(prefix='lycache_')
+        for name in ['2.18.2-1', '2.24.3', '2.19.0', 'index']:
+            os.mkdir(os.path.join(self.cache, name))
+        open(os.path.join(self.cache, 'lilypond-2.19.0-1.linux-64.sh'), 'w').close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache, ignore_errors=True)
+
+
+    def test_versions(self):
+        """Versions are hashable and totally ordered"""
+        table = {mupub.LyVersion('2.16.2'): 'x'}
+        self.assertEqual(table[mupub.LyVersion('2.16.2-1')], 'x')
+        self.assertNotIn(mupub.LyVersion('2.16.0'), table)
+        self.assertTrue(mupub.LyVersion('2.16.2') <= mupub.LyVersion('2.16.2-1'))
+        self.assertTrue(mupub.LyVersion('2.19.0') >= mupub.LyVersion('2.18.2'))
+        self.assertFalse(mupub.LyVersion('2.16.2') == '2.16.2')
+
+
+    def test_lookup(self):
+        """Exact and range lookups"""
+        registry = mupub.CompilerRegistry(self.cache)
+        self.assertEqual(len(registry), 3)
+        self.assertIn(mupub.LyVersion('2.18.2'), registry)
+        self.assertEqual(registry.folder(mupub.LyVersion('2.18.2')),
+                         os.path.join(self.cache, '2.18.2-1'))
+        self.assertIsNone(registry.folder(mupub.LyVersion('2.22.1')))
+        self.assertEqual([str(v) for v in registry.versions(mupub.LyVersion('2.18'),
+                                                            mupub.LyVersion('2.20'))],
+                         ['2.18.2-1', '2.19.0'])
+        self.assertEqual([str(v) for v in registry.versions(low=mupub.LyVersion('2.19.0'))],
+                         ['2.19.0', '2.24.3'])
+
+
+    def test_consistency(self):
+        """The registry follows changes to the cache folder"""
+        registry = mupub.CompilerRegistry(self.cache)
+        registry.add(mupub.LyVersion('2.19.0'), '2.19.0', sha256='abc')
+        self.assertTrue(os.path.exists(registry.path))
+        self.assertEqual(mupub.CompilerRegistry(self.cache)
+                         .get(mupub.LyVersion('2.19.0'))['sha256'], 'abc')
+
+        os.mkdir(os.path.join(self.cache, '2.22.1'))
+        shutil.rmtree(os.path.join(self.cache, '2.24.3'))
+        registry = mupub.CompilerRegistry(self.cache)
+        self.assertIn(mupub.LyVersion('2.22.1'), registry)
+        self.assertNotIn(mupub.LyVersion('2.24.3'), registry)
+        # details survive a resynchronization
+        self.assertEqual(registry.get(mupub.LyVersion('2.19.0'))['sha256'], 'abc')
+
+
+    def test_shared(self):
+        """The shared registry is reread only after a change"""
+        registry = mupub.lyregistry.compiler_registry(self.cache)
+        self.assertIs(mupub.lyregistry.compiler_registry(self.cache), registry)
+        os.mkdir(os.path.join(self.cache, '2.22.1'))
+        registry = mupub.lyregistry.compiler_registry(self.cache)
+        self.assertIn(mupub.LyVersion('2.22.1'), registry)
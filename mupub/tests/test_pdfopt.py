@@ -0,0 +1,71 @@
+"""PDF post-processing tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, skipIf
+import mupub
+
+_PDF = b'%PDF-1.4\n' + b'% padding\n' * 200 + b'%%EOF\n'
+
+# A stand-in for qpdf: --check succeeds, otherwise the input is
+# written to the output with the given transformation.
+_FAKE_QPDF = """#!{0}
+import sys
+if sys.argv[1] == '--check':
+    sys.exit(0)
+with open(sys.argv[-2], 'rb') as src:
+    data = src.read()
+with open(sys.argv[-1], 'wb') as dest:
+    dest.write({1})
+"""
+
+
+@skipIf(os.name != 'posix', 'needs an executable script')
+class PdfOptTest(TestCase):
+    """PDF optimization testing"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='pdfopt_')
+        os.chdir(self.dirpath)
+        with open('piece-a4.pdf', 'wb') as pdf:
+            pdf.write(_PDF)
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def _tool(self, transform):
+        path = os.path.join(self.dirpath, 'fake-qpdf')
+        with open(path, 'w') as script:
+            script.write(_FAKE_QPDF.format(sys.executable, transform))
+        os.chmod(path, 0o755)
+        return ('qpdf', path)
+
+
+    def test_smaller(self):
+        """A smaller result replaces the original"""
+        tool = self._tool("data.replace(b'% padding\\n', b'')")
+        result = mupub.pdfopt.optimize_pdf('piece-a4.pdf', tool)
+        self.assertEqual(result.status, 'optimized')
+        self.assertEqual(result.before, len(_PDF))
+        self.assertEqual(result.after, os.path.getsize('piece-a4.pdf'))
+        self.assertTrue(result.saved() > 0)
+        self.assertFalse(os.path.exists('piece-a4.pdf.opt'))
+
+
+    def test_kept(self):
+        """Larger or broken results leave the original alone"""
+        tool = self._tool("data + b'% more\\n'")
+        result = mupub.pdfopt.optimize_pdf('piece-a4.pdf', tool)
+        self.assertEqual(result.status, 'kept')
+        tool = self._tool("data[:100]")
+        results = mupub.optimize_pdfs(['piece-a4.pdf'], tool)
+        self.assertEqual(results[0].status, 'failed')
+        with open('piece-a4.pdf', 'rb') as pdf:
+            self.assertEqual(pdf.read(), _PDF)
@@ -0,0 +1,180 @@
+"""Preview image tests
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+import xml.etree.ElementTree as ET
+from unittest import TestCase
+import mupub
+
+
+def _png(width, height):
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    raw = b''.join(b'\0' + b'\xff' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr)
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+class PreviewTest(TestCase):
+    """Preview dimension testing"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.dirpath = tempfile.mkdtemp(prefix='preview_')
+        os.chdir(self.dirpath)
+
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def test_png(self):
+        """PNG size from the IHDR chunk"""
+        with open('p.png', 'wb') as pngfile:
+            pngfile.write(_png(37, 11))
+        self.assertEqual(mupub.image_size('p.png'), (37, 11))
+        with open('bad.png', 'wb') as pngfile:
+            pngfile.write(b'GIF89a')
+        with self.assertRaises(ValueError):
+            mupub.image_size('bad.png')
+
+
+    def test_svg(self):
+        """SVG size from root attributes"""
+        with open('mm.svg', 'w') as svgfile:
+            svgfile.write('<svg xmlns="http://www.w3.org/2000/svg" '
+                          'width="25.40mm" height="12.70mm" '
+                          'viewBox="0 0 10 5"><path d="M0 0"/></svg>')
+        self.assertEqual(mupub.image_size('mm.svg'), (96, 48))
+        with open('box.svg', 'w') as svgfile:
+            svgfile.write('<?xml version="1.0"?>\n'
+                          '<svg xmlns="http://www.w3.org/2000/svg" '
+                          'width="100%" viewBox="0,0,119.5,16.8"></svg>')
+        self.assertEqual(mupub.image_size('box.svg'), (120, 17))
+
+
+    def test_collect(self):
+        """Collected assets report preview dimensions"""
+        with open('piece.preview.png', 'wb') as pngfile:
+            pngfile.write(_png(20, 10))
+        assets = mupub.collect_assets('piece')
+        self.assertEqual(assets['pngFile'], 'piece-preview.png')
+        self.assertEqual((assets['pngWidth'], assets['pngHeight']), ('20', '10'))
+
+
+    def test_minify_svg(self):
+        """SVG minification keeps the drawing"""
+        glyph = 'M218 136c55 0 108 -28 108 -89c0 -71 -55 -121 -102 -149'
+        svg = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<svg xmlns="http://www.w3.org/2000/svg" '
+               'width="25.4000mm" height="12.7000mm" viewBox="0 0 10 5">\n'
+               '  <path transform="translate(1.5000, 2.0000)" d="{0}"/>\n'
+               '  <path transform="translate(3.0500, 2.0000)" d="{0}"/>\n'
+               '  <text font-size="3.8220"><tspan>Allegro </tspan></text>\n'
+               '</svg>\n').format(glyph)
+        with open('piece.preview.svg', 'w') as svgfile:
+            svgfile.write(svg)
+        before, after = mupub.preview.optimize_preview('piece.preview.svg')
+        self.assertEqual(before, len(svg))
+        self.assertTrue(after < before)
+        self.assertEqual(mupub.image_size('piece.preview.svg'), (96, 48))
+        with open('piece.preview.svg') as svgfile:
+            minified = svgfile.read()
+        self.assertEqual(minified.count(glyph), 1)
+        self.assertEqual(minified.count('<use '), 2)
+        self.assertIn('translate(3.05, 2)', minified)
+        self.assertIn('>Allegro </tspan>', minified)
+
+
+    def test_minify_links(self):
+        """Links keep their namespace without shared paths"""
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" '
+               'xmlns:xlink="http://www.w3.org/1999/xlink" '
+               'width="10mm" height="5mm">'
+               '<a xlink:href="http://x">   <path d="M0.000 0.000"/>   </a></svg>')
+        with open('piece.preview.svg', 'w') as svgfile:
+            svgfile.write(svg)
+        before, after = mupub.preview.optimize_preview('piece.preview.svg')
+        self.assertTrue(after < before)
+        with open('piece.preview.svg', 'rb') as svgfile:
+            root = ET.fromstring(svgfile.read())
+        link = root.find('{http://www.w3.org/2000/svg}a')
+        self.assertEqual(link.get('{http://www.w3.org/1999/xlink}href'), 'http://x')
+
+
+    def test_quantize_png(self):
+        """Truecolor PNG with few colors is reduced losslessly"""
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest('Pillow is not installed')
+        img = Image.new('RGB', (200, 50), (255, 255, 255))
+        for x in range(0, 200, 3):
+            img.putpixel((x, 25), (x % 7 * 30, x % 7 * 30, x % 7 * 30))
+        img.save('piece.preview.png', compress_level=1)
+        before, after = mupub.preview.optimize_preview('piece.preview.png')
+        self.assertTrue(after < before)
+        with Image.open('piece.preview.png') as optimized:
+            self.assertEqual(optimized.mode, 'L')
+            self.assertEqual(optimized.convert('RGB').tobytes(), img.tobytes())
+
+
+    def test_crop(self):
+        """PNG previews are cropped to the ink and scaled"""
+        try:
+            import numpy
+            from PIL import Image
+        except ImportError:
+            self.skipTest('NumPy or Pillow is not installed')
+        img = Image.new('RGB', (400, 300), (255, 255, 255))
+        img.paste((0, 0, 0), (50, 100, 250, 150))
+        img.save('piece.preview.png')
+        assets = mupub.collect_assets('piece', preview_widths=(100, 640))
+        self.assertEqual((assets['pngWidth'], assets['pngHeight']), ('216', '66'))
+        self.assertEqual(assets['pngSrcset'], 'piece-preview-100w.png 100w')
+        self.assertEqual(mupub.image_size('piece-preview-100w.png'), (100, 31))
+        with open('piece-digests.json') as dfile:
+            self.assertIn('piece-preview-100w.png', dfile.read())
+        # published in the RDF, and found again without a build
+        rdf = mupub.MuRDF()
+        for name, value in assets.items():
+            rdf.update_description(name, value)
+        rdf.write_xml('piece.rdf')
+        self.assertEqual(mupub.read_rdf('piece.rdf')['pngSrcset'],
+                         assets['pngSrcset'])
+        self.assertEqual(mupub.assets.existing_assets('piece')['pngSrcset'],
+                         assets['pngSrcset'])
+        self.assertNotIn(b'pngSrcset', mupub.MuRDF().to_xml())
+
+
+    def test_crop_palette(self):
+        """Cropping keeps an optimized palette preview"""
+        try:
+            import numpy
+            from PIL import Image
+        except ImportError:
+            self.skipTest('NumPy or Pillow is not installed')
+        img = Image.new('RGB', (400, 300), (255, 255, 255))
+        img.paste((200, 0, 0), (50, 100, 250, 150))
+        img.save('piece.preview.png')
+        mupub.preview.optimize_preview('piece.preview.png')
+        assets = mupub.collect_assets('piece', preview_widths=())
+        self.assertEqual((assets['pngWidth'], assets['pngHeight']), ('216', '66'))
+        with Image.open('piece-preview.png') as cropped:
+            self.assertEqual(cropped.mode, 'P')
+
+
+    def test_corrupt_png(self):
+        """An unreadable PNG is published uncropped"""
+        with open('piece.preview.png', 'wb') as pngfile:
+            pngfile.write(_png(20, 10)[:40])
+        assets = mupub.collect_assets('piece')
+        self.assertEqual(assets['pngFile'], 'piece-preview.png')
+        self.assertTrue(os.path.exists('piece-preview.png'))
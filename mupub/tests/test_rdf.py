@@ -1,13 +1,49 @@
 """Core tests for mut
 """
 
+import io
+import json
+import logging
 import os.path
+import shutil
+import tempfile
+import timeit
+import xml.etree.ElementTree as ET
 from unittest import TestCase
 import mupub
 from .tutils import PREFIX
 
 TEST_DATA = 'data'
 
+
+def _indent(elem, level=0):
+    # the layout MuRDF writes, from effbot (Fredrik Lundh)
+    i = "\n" + level*"  "
+    if len(elem):
+        if not elem.text or not elem.text.strip():
+            elem.text = i + "  "
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+        for elem in elem:
+            _indent(elem, level+1)
+        if not elem.tail or not elem.tail.strip():
+            elem.tail = i
+    else:
+        if level and (not elem.tail or not elem.tail.strip()):
+            elem.tail = i
+
+
+def _etree_xml(rdf):
+    """Serialize an RDF the way it was before MuRDF wrote it directly."""
+    ET.register_namespace('rdf', mupub.rdfu.RDF_NS)
+    ET.register_namespace('mp', mupub.rdfu.MP_NS)
+    top = rdf.top
+    _indent(top)
+    out = io.BytesIO()
+    ET.ElementTree(top).write(out, encoding='UTF-8', xml_declaration=True)
+    return out.getvalue()
+
+
 class RdfTest(TestCase):
     """RDF Testing"""
 
@@ -17,3 +53,130 @@ class RdfTest(TestCase):
                             'AguadoD', 'aminor-study', 'aminor-study.ly')
         header.load_table(path)
         header.write_rdf('test.rdf')
+
+
+    def test_etree_identical(self):
+        """Output matches ElementTree serialization"""
+        values = {'title': 'Étude <No. 1> & "Coda"',
+                  'composer': '',
+                  'pngWidth': '320',
+                  'moreInfo': ' line\r\nbreak '}
+        rdf = mupub.MuRDF()
+        for key in mupub.rdfu._MU_KEYS:
+            rdf.update_description(key, values.get(key))
+        self.assertFalse(rdf.update_description('bogus', 'x'))
+        self.assertEqual(rdf.description.find('{%s}pngWidth' % mupub.rdfu.MP_NS).text,
+                         '320')
+        self.assertEqual(rdf.to_xml(), _etree_xml(rdf))
+
+
+    def test_benchmark(self):
+        """Direct writing is faster than ElementTree serialization"""
+        rdf = mupub.MuRDF()
+        for key in mupub.rdfu._MU_KEYS:
+            rdf.update_description(key, key + ' <value> & more')
+        # best of several runs of writing 200 descriptions
+        direct = min(timeit.repeat(rdf.to_xml, number=200, repeat=5))
+        etree = min(timeit.repeat(lambda: _etree_xml(rdf), number=200, repeat=5))
+        logging.getLogger(__name__).info(
+            'RDF/XML x200: direct %.4fs, ElementTree %.4fs' % (direct, etree))
+        self.assertLess(direct, etree)
+
+
+    def test_export(self):
+        """Archive export as N-Triples and JSON-LD lines"""
+        top = tempfile.mkdtemp(prefix='export_')
+        self.addCleanup(shutil.rmtree, top, True)
+        for folder, title in [('BachJS/bwv846', 'Prelude "C"'),
+                              ('SorF/sor-op5-5', 'Andante\nLargo'),
+                              ('Zz <one>/a b', 'Odd')]:
+            os.makedirs(os.path.join(top, folder))
+            rdf = mupub.MuRDF()
+            rdf.update_description('title', title)
+            rdf.update_description('composer', folder.split('/')[0])
+            rdf.write_xml(os.path.join(top, folder, 'piece.rdf'))
+
+        out = io.StringIO()
+        self.assertEqual(mupub.export_rdf(top, out, 'ntriples',
+                                          'http://x.org/ftp'), (3, 0))
+        self.assertEqual(out.getvalue().splitlines(), [
+            '<http://x.org/ftp/BachJS/bwv846/> <{}title> "Prelude \\"C\\"" .'
+            .format(mupub.rdfu.MP_NS),
+            '<http://x.org/ftp/BachJS/bwv846/> <{}composer> "BachJS" .'
+            .format(mupub.rdfu.MP_NS),
+            '<http://x.org/ftp/SorF/sor-op5-5/> <{}title> "Andante\\nLargo" .'
+            .format(mupub.rdfu.MP_NS),
+            '<http://x.org/ftp/SorF/sor-op5-5/> <{}composer> "SorF" .'
+            .format(mupub.rdfu.MP_NS),
+            '<http://x.org/ftp/Zz%20%3Cone%3E/a%20b/> <{}title> "Odd" .'
+            .format(mupub.rdfu.MP_NS),
+            '<http://x.org/ftp/Zz%20%3Cone%3E/a%20b/> <{}composer> "Zz <one>" .'
+            .format(mupub.rdfu.MP_NS)])
+
+        out = io.StringIO()
+        mupub.export_rdf(top, out, 'jsonld')
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records[1], {
+            '@context': {'@vocab': mupub.rdfu.MP_NS},
+            '@id': mupub.URL_BASE + '/ftp/SorF/sor-op5-5/',
+            'title': 'Andante\nLargo',
+            'composer': 'SorF'})
+        with self.assertRaises(ValueError):
+            mupub.export_rdf(top, out, 'turtle')
+
+
+class RegenerateTest(TestCase):
+    """RDF regeneration without building"""
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp(prefix='rdf_')
+        self.piece = os.path.join(self.dirpath, 'sor-op5-5')
+        shutil.copytree(os.path.join(PREFIX, 'SorF', 'O5', 'sor-op5-5'),
+                        self.piece)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+    def _fields(self):
+        rdf_path = os.path.join(self.piece, 'sor-op5-5.rdf')
+        root = ET.parse(rdf_path).getroot()
+        prefix = '{%s}' % mupub.rdfu.MP_NS
+        return dict((e.tag[len(prefix):], e.text) for e in root.iter()
+                    if e.tag.startswith(prefix))
+
+
+    def test_regenerate(self):
+        """Assets come from the folder, then the previous RDF"""
+        with open(os.path.join(self.piece, 'sor-op5-5-preview.svg'), 'w') as svg:
+            svg.write('<svg xmlns="http://www.w3.org/2000/svg" '
+                      'width="300" height="80"/>')
+        open(os.path.join(self.piece, 'sor-op5-5-a4.pdf'), 'w').close()
+        folder, error, changed = mupub.commands.rdf.regenerate_rdf(self.piece)
+        self.assertIsNone(error)
+        self.assertTrue(changed)
+        fields = self._fields()
+        self.assertEqual(fields['title'], 'Andante Largo')
+        self.assertEqual(fields['lyFile'], 'sor-op5-5.ly')
+        self.assertEqual(fields['pdfFileA4'], 'sor-op5-5-a4.pdf')
+        self.assertEqual(fields['midFile'], 'empty')
+        self.assertEqual((fields['pngWidth'], fields['pngHeight']), ('300', '80'))
+
+        # published assets not in the folder are kept, leaving the
+        # RDF unchanged
+        os.unlink(os.path.join(self.piece, 'sor-op5-5-a4.pdf'))
+        self.assertFalse(mupub.commands.rdf.regenerate_rdf(self.piece)[2])
+        self.assertEqual(self._fields()['pdfFileA4'], 'sor-op5-5-a4.pdf')
+        self.assertEqual(mupub.utils.find_pieces(self.dirpath), [self.piece])
+
+
+    def test_regenerate_error(self):
+        """Any error in a piece is reported as its failure"""
+        def broken(base, folder):
+            raise KeyError('pngFile')
+        self.addCleanup(setattr, mupub, 'existing_assets', mupub.existing_assets)
+        mupub.existing_assets = broken
+        folder, error, changed = mupub.commands.rdf.regenerate_rdf(self.piece)
+        self.assertEqual(error, "KeyError: 'pngFile'")
+        self.assertFalse(changed)
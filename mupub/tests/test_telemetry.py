@@ -0,0 +1,50 @@
+"""Build telemetry tests
+"""
+
+from unittest import TestCase
+import mupub
+
+
+def _fake_run(label, wall, pages):
+    progress = mupub.LyProgress()
+    progress.pages = pages
+    lyrun = mupub.LyRun(['lilypond', '-dpaper-size="a4"', label + '.ly'],
+                        label, 0, wall, progress)
+    lyrun.max_rss = 1000
+    return lyrun
+
+
+class TelemetryTest(TestCase):
+    """Telemetry store testing"""
+
+    def setUp(self):
+        self.store = mupub.Telemetry(':memory:')
+
+
+    def tearDown(self):
+        self.store.close()
+
+
+    def test_record(self):
+        """Runs are recorded with their page size"""
+        self.store.record(_fake_run('piece', 2.0, 4), 'piece', '2.18.2')
+        row = self.store.conn.execute(
+            'SELECT page_size, pages, max_rss FROM lilypond_runs').fetchone()
+        self.assertEqual(row, ('a4', 4, 1000))
+        self.assertEqual(self.store.slowest()[0][0], 'piece')
+
+
+    def test_regressions(self):
+        """Slow-downs are found across compiler versions"""
+        self.store.record(_fake_run('slow', 2.0, 4), 'slow', '2.18.2')
+        self.store.record(_fake_run('slow', 3.0, 4), 'slow', '2.22.1')
+        self.store.record(_fake_run('fast', 2.0, 4), 'fast', '2.10.33')
+        self.store.record(_fake_run('fast', 1.0, 4), 'fast', '2.22.1')
+        # a quick preview run does not mask the slower score
+        self.store.record(_fake_run('slow (preview)', 0.1, 1), 'slow', '2.22.1')
+        found = self.store.regressions(1.1)
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0][:4], ('slow', 'slow', '2.18.2', '2.22.1'))
+        trends = self.store.page_trends()
+        self.assertEqual(len(trends), 3)
+        self.assertEqual(self.store.slowest()[0][:3], ('slow', 'slow', 2))
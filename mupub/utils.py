@@ -7,6 +7,10 @@ import argparse
 import sys
 from clint.textui.validators import ValidationError
 import stat
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import mupub
 
 def _find_files(folder, outlist):
@@ -35,6 +39,138 @@ def find_files(folder):
     return _find_files(folder, [])
 
 
+# (connect, read) timeouts in seconds for HTTP requests
+HTTP_TIMEOUT = (10, 60)
+HTTP_RETRIES = 3
+# connections kept per host, concurrent requests beyond it are not
+# pooled
+HTTP_POOL_SIZE = 8
+
+class _Session(requests.Session):
+    """A session applying a default timeout to every request."""
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def http_session():
+    """Return the HTTP session shared by all requests.
+
+    The session is created on first use. Connections are kept alive
+    and pooled per host, requests time out after
+    :py:data:`HTTP_TIMEOUT` unless given their own timeout, and
+    failed connections or server errors on ``GET`` and ``HEAD`` are
+    retried with an exponential backoff. After the last retry the
+    server's response is returned as it is.
+
+    :rtype: requests.Session
+
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=HTTP_RETRIES,
+                          backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(['GET', 'HEAD']),
+                          raise_on_status=False)
+            adapter = HTTPAdapter(max_retries=retry,
+                                  pool_maxsize=HTTP_POOL_SIZE)
+            session = _Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+_CMP_SIZE = 1 << 16
+
+def same_content(path_a, path_b):
+    """Return True if two files have the same content.
+
+    Sizes are compared first, the contents only if they are equal.
+
+    :param str path_a: a file.
+    :param str path_b: another file, which may not exist.
+    :rtype: boolean
+
+    """
+    if not os.path.exists(path_b):
+        return False
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as file_a, open(path_b, 'rb') as file_b:
+        while True:
+            block = file_a.read(_CMP_SIZE)
+            if block != file_b.read(_CMP_SIZE):
+                return False
+            if not block:
+                return True
+
+
+def replace_if_changed(new_path, path):
+    """Move a newly written file into place if its content differs.
+
+    An unchanged file is left alone, keeping its modification time,
+    so that mirrors do not transfer it again. The replacement is
+    atomic.
+
+    :param str new_path: the new content, removed in either case.
+    :param str path: the file to replace.
+    :returns: True if path was replaced.
+    :rtype: boolean
+
+    """
+    if same_content(new_path, path):
+        os.unlink(new_path)
+        return False
+    os.replace(new_path, path)
+    return True
+
+
+def write_if_changed(path, data):
+    """Write data to a file if its content differs.
+
+    :param str path: the file to write.
+    :param bytes data: the content.
+    :returns: True if the file was written.
+    :rtype: boolean
+
+    """
+    # named per thread, the same file may be written concurrently
+    tmp_path = '{0}.{1}.tmp'.format(path, threading.get_ident())
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(data)
+    return replace_if_changed(tmp_path, path)
+
+
+def find_pieces(top):
+    """Return the piece folders under a folder.
+
+    A piece folder is named for its piece and contains either the
+    main |LilyPond| file, ``<folder>.ly``, or a ``<folder>-lys``
+    folder. The search does not descend into piece folders.
+
+    :param str top: The top-most folder, typically the ``ftp``
+                    folder of the repository.
+    :returns: list of piece folders, sorted.
+    :rtype: [str]
+
+    """
+    pieces = []
+    for folder, dirs, files in os.walk(top):
+        base = os.path.basename(folder)
+        if base+'.ly' in files or base+'-lys' in dirs:
+            pieces.append(folder)
+            dirs[:] = []
+        else:
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+    return sorted(pieces)
+
+
 def resolve_lysfile(infile):
     if os.path.exists(infile):
         return infile
@@ -17,9 +17,16 @@ setup(
         'Natural Language :: English',
         'Topic :: Documentation :: Sphinx',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
+    # ZipFile(compresslevel=...) needs 3.7
+    python_requires='>=3.7',
     packages = ['mupub', 'mupub.commands'],
     entry_points = {
         'mupub.registered_commands': [
@@ -28,6 +35,12 @@ setup(
             'build = mupub.commands.build:main',
             'clean = mupub.commands.clean:main',
             'init = mupub.commands.init:main',
+            'rdf = mupub.commands.rdf:main',
+            'query = mupub.commands.query:main',
+            'stats = mupub.commands.stats:main',
+            'bench-compilers = mupub.commands.bench:main',
+            'unbundle = mupub.commands.unbundle:main',
+            'compilers = mupub.commands.compilers:main',
         ],
         'console_scripts': [
             'mupub = mupub.__main__:main',
@@ -36,8 +49,12 @@ setup(
     install_requires=[
         'setuptools',
         'beautifulsoup4>=4.6',
-        'pillow>=10',
         'clint>=0.5',
         'requests>=2.18',
+        # Retry(allowed_methods=...)
+        'urllib3>=1.26',
     ],
+    extras_require={
+        'preview': ['pillow>=10', 'numpy'],
+    },
 )